@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Load benchmark for the POS API against a local mongod and the in-process ASGI app.
+
+Seeds a reproducible dataset, drives a weighted mix of realistic requests from
+concurrent workers and writes p50/p95/p99 latency and throughput per endpoint
+to a JSON artifact that ``compare`` can diff between commits::
+
+    python bench.py run --orders 500000 --duration 60 --output bench.json
+    python bench.py compare before.json after.json
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import typer
+
+# server.py reads its connection settings at import time
+os.environ.setdefault("MONGO_URL", os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+os.environ.setdefault("DB_NAME", os.environ.get("BENCH_DB_NAME", "pos_bench"))
+# At bench concurrency the heavy admission lane turns requests away with 429,
+# which would make reports incomparable with runs from before it existed
+os.environ.setdefault("ADMISSION_ENABLED", os.environ.get("BENCH_ADMISSION_ENABLED", "0"))
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from datagen import ShopSpec, generate_shop  # noqa: E402
+
+app = typer.Typer(help="Reproducible load benchmark for the POS API")
+
+BENCH_END_DATE = date(2025, 6, 30)
+
+
+async def seed_dataset(products: int, customers: int, orders: int, seed: int, days: int = 365) -> dict:
+    """Drop the benchmark database and fill it deterministically from ``seed``."""
+    await server.client.drop_database(server.DB_NAME)
+    # A fixed end date keeps the dataset identical across runs on different days
+    spec = ShopSpec(
+        products=products, customers=customers, orders=orders, seed=seed,
+        days=days, end_date=BENCH_END_DATE,
+    )
+    return await generate_shop(server.db, spec)
+
+
+class Workload:
+    """Shared ids sampled from the seeded data that request generators draw from."""
+
+    def __init__(self, order_ids: List[str], customers: List[dict], products: List[dict]):
+        self.order_ids = order_ids
+        self.customers = customers
+        self.products = products
+
+    @classmethod
+    async def load(cls, sample: int = 20000) -> "Workload":
+        order_ids = [doc["id"] async for doc in server.db.orders.aggregate(
+            [{"$sample": {"size": sample}}, {"$project": {"_id": 0, "id": 1}}]
+        )]
+        customers = await server.db.customers.aggregate(
+            [{"$sample": {"size": 2000}}, {"$project": {"_id": 0}}]
+        ).to_list(2000)
+        products = await server.db.products.aggregate(
+            [{"$sample": {"size": 500}}, {"$project": {"_id": 0}}]
+        ).to_list(500)
+        return cls(order_ids, customers, products)
+
+
+async def op_order_entry(http: httpx.AsyncClient, rng: random.Random, work: Workload):
+    customer = rng.choice(work.customers)
+    items = []
+    for product in rng.sample(work.products, rng.randint(1, 3)):
+        variant = rng.choice(product["variants"])
+        items.append({
+            "product_id": product["id"], "variant_id": variant["id"], "product_name": product["name"],
+            "size": variant["size"], "color": variant["color"], "quantity": 1,
+            "unit_price": variant["price"], "total_price": variant["price"],
+        })
+    subtotal = sum(item["total_price"] for item in items)
+    return await http.post("/api/orders", json={
+        "customer_id": customer["id"], "customer_name": customer["name"],
+        "customer_address": customer["address"], "customer_phone": customer["phone"],
+        "customer_city": customer["city"], "items": items, "subtotal": subtotal,
+        "tax_amount": 0.0, "total_amount": subtotal + 350.0,
+    })
+
+
+async def op_dashboard(http, rng, work):
+    return await http.get("/api/dashboard")
+
+
+async def op_orders_list(http, rng, work):
+    return await http.get("/api/orders")
+
+
+async def op_products_list(http, rng, work):
+    return await http.get("/api/products")
+
+
+async def op_label_print(http, rng, work):
+    return await http.post("/api/orders/bulk-labels", json=rng.sample(work.order_ids, 50))
+
+
+async def op_csv_export(http, rng, work):
+    return await http.post("/api/orders/export-csv", json=rng.sample(work.order_ids, 200))
+
+
+async def op_profit_loss(http, rng, work):
+    end = BENCH_END_DATE - timedelta(days=rng.randint(0, 300))
+    start = end - timedelta(days=30)
+    return await http.get("/api/finance/profit-loss", params={
+        "start_date": start.isoformat(), "end_date": end.isoformat(),
+    })
+
+
+OPERATIONS = {
+    "order_entry": op_order_entry,
+    "dashboard": op_dashboard,
+    "orders_list": op_orders_list,
+    "products_list": op_products_list,
+    "label_print": op_label_print,
+    "csv_export": op_csv_export,
+    "profit_loss": op_profit_loss,
+}
+
+MIXES: Dict[str, Dict[str, int]] = {
+    "default": {"order_entry": 30, "dashboard": 20, "orders_list": 10, "products_list": 10,
+                "label_print": 10, "csv_export": 10, "profit_loss": 10},
+    "pos": {"order_entry": 60, "products_list": 25, "dashboard": 15},
+    "back_office": {"dashboard": 20, "label_print": 30, "csv_export": 25, "profit_loss": 25},
+}
+
+
+async def drive(mix: Dict[str, int], concurrency: int, duration: float, seed: int, work: Workload) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    # 429s from admission control, kept out of latencies and errors
+    rejected: Dict[str, int] = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        async def worker(worker_id: int):
+            rng = random.Random(seed * 1000 + worker_id)
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights=weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await OPERATIONS[name](http, rng, work)
+                    if response.status_code == 429:
+                        rejected[name] += 1
+                        continue
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                latencies[name].append(time.perf_counter() - started)
+                if failed:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name, samples in sorted(latencies.items()):
+        ms = np.asarray(samples) * 1000
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": errors[name],
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "mean_ms": round(float(ms.mean()), 2),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            "p99_ms": round(float(np.percentile(ms, 99)), 2),
+            "max_ms": round(float(ms.max()), 2),
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": total,
+        "total_errors": sum(errors.values()),
+        "rejected": dict(sorted(rejected.items())),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+        "endpoints": endpoints,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@app.command()
+def run(
+    products: int = typer.Option(5000, help="Products to seed"),
+    customers: int = typer.Option(50000, help="Customers to seed"),
+    orders: int = typer.Option(500000, help="Orders to seed"),
+    seed: int = typer.Option(42, help="Seed for data and request generation"),
+    reseed: bool = typer.Option(True, help="Drop and reseed the benchmark database first"),
+    mix: str = typer.Option("default", help=f"Request mix: {', '.join(MIXES)}"),
+    concurrency: int = typer.Option(8, min=1, help="Concurrent virtual clients"),
+    duration: float = typer.Option(30.0, min=1, help="Seconds to drive load"),
+    output: Path = typer.Option(Path("bench_results.json"), help="Where to write the JSON report"),
+):
+    """Seed the benchmark database, run the request mix and write a JSON report."""
+    if mix not in MIXES:
+        raise typer.BadParameter(f"Unknown mix {mix!r}", param_hint="--mix")
+
+    async def main():
+        async with server.app.router.lifespan_context(server.app):
+            dataset = None
+            if reseed:
+                seed_started = time.perf_counter()
+                dataset = await seed_dataset(products, customers, orders, seed)
+                dataset["seed_seconds"] = round(time.perf_counter() - seed_started, 1)
+                # Startup created indexes and loaded the catalog from the database that was just dropped
+                await server.ensure_indexes()
+                await server.catalog.load()
+                await server.rebuild_customer_stats()
+            work = await Workload.load()
+            results = await drive(MIXES[mix], concurrency, duration, seed, work)
+            return dataset, results
+
+    dataset, results = asyncio.run(main())
+    report = {
+        "revision": _git_revision(),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "database": server.DB_NAME,
+        "dataset": dataset,
+        "mix": {"name": mix, "weights": MIXES[mix]},
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "admission_enabled": server.ADMISSION_ENABLED,
+        **results,
+    }
+    output.write_text(json.dumps(report, indent=2))
+    for name, stats in report["endpoints"].items():
+        typer.echo(
+            f"{name:15} {stats['requests']:7d} req  {stats['throughput_rps']:8.1f} rps  "
+            f"p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  p99 {stats['p99_ms']:8.1f} ms"
+            f"  errors {stats['errors']}"
+        )
+    if report["rejected"]:
+        typer.echo(f"Rejected by admission control: {report['rejected']}")
+    typer.echo(f"Report written to {output}")
+
+
+@app.command()
+def compare(baseline: Path, candidate: Path):
+    """Print per-endpoint p95 and throughput changes between two reports."""
+    before = json.loads(baseline.read_text())
+    after = json.loads(candidate.read_text())
+    typer.echo(f"{before.get('revision')} -> {after.get('revision')}")
+    # Reports from before admission control existed ran without it
+    if before.get("admission_enabled", False) != after.get("admission_enabled", False):
+        typer.echo("warning: admission control differs between the reports; latencies are not comparable")
+    for name in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old, new = before["endpoints"].get(name), after["endpoints"].get(name)
+        if not old or not new:
+            typer.echo(f"{name:15} only in {'candidate' if new else 'baseline'}")
+            continue
+        p95_change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+        rps_change = (new["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100 \
+            if old["throughput_rps"] else 0
+        typer.echo(
+            f"{name:15} p95 {old['p95_ms']:8.1f} -> {new['p95_ms']:8.1f} ms ({p95_change:+.1f}%)  "
+            f"rps {old['throughput_rps']:7.1f} -> {new['throughput_rps']:7.1f} ({rps_change:+.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Command line maintenance tasks for the POS backend.
+
+Run from the backend directory, e.g. ``python cli.py import-products catalog.csv``.
+"""
+import asyncio
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from datagen import ShopSpec, generate_shop
+import server
+from server import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_STATE_TTL_SECONDS,
+    DB_NAME,
+    FINANCE_EXPORT_BATCH_ROWS,
+    FINANCE_EXPORT_FORMATS,
+    IMPORT_BATCH_SIZE,
+    archive_orders,
+    connect_mongo,
+    detect_import_format,
+    ensure_indexes,
+    finance_csv_chunks,
+    import_customers,
+    import_products,
+    iter_finance_frames,
+    iter_import_rows,
+    rebuild_customer_stats,
+    write_finance_parquet,
+)
+
+app = typer.Typer(help="Maintenance commands for the POS backend")
+
+
+def run_with_db(main):
+    """Run ``main()`` with the server's Mongo client connected, as the API's startup would."""
+    async def runner():
+        await connect_mongo()
+        try:
+            return await main()
+        finally:
+            server.client.close()
+
+    return asyncio.run(runner())
+
+
+def _open_import_file(path: Path, fmt: Optional[str]):
+    try:
+        fmt = detect_import_format(path.name, fmt)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    return path.open(encoding="utf-8-sig", newline=""), fmt
+
+
+@app.command("import-products")
+def import_products_command(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON catalog file"),
+    format: Optional[str] = typer.Option(None, help="csv or ndjson (defaults to the file extension)"),
+    batch_size: int = typer.Option(IMPORT_BATCH_SIZE, min=1, help="Rows per bulk_write"),
+):
+    """Upsert products and variants keyed by SKU from a catalog file."""
+    stream, fmt = _open_import_file(path, format)
+    with stream:
+        summary = run_with_db(lambda: import_products(iter_import_rows(stream, fmt), batch_size))
+    typer.echo(json.dumps(summary, indent=2))
+
+
+@app.command("import-customers")
+def import_customers_command(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON customer file"),
+    format: Optional[str] = typer.Option(None, help="csv or ndjson (defaults to the file extension)"),
+    batch_size: int = typer.Option(IMPORT_BATCH_SIZE, min=1, help="Rows per bulk_write"),
+):
+    """Insert customers, merging rows whose normalized phone already exists."""
+    stream, fmt = _open_import_file(path, format)
+    with stream:
+        summary = run_with_db(lambda: import_customers(iter_import_rows(stream, fmt), batch_size))
+    typer.echo(json.dumps(summary, indent=2))
+
+
+@app.command("archive-orders")
+def archive_orders_command(
+    older_than_days: int = typer.Option(ARCHIVE_AFTER_DAYS, min=0, help="Archive orders created before this many days ago"),
+    batch_size: int = typer.Option(ARCHIVE_BATCH_SIZE, min=1, help="Orders moved per batch"),
+    announce_wait: float = typer.Option(
+        ARCHIVE_STATE_TTL_SECONDS, min=0,
+        help="Seconds to let running API workers see the new watermark before moving orders",
+    ),
+):
+    """Move old delivered and returned orders to the orders_archive collection."""
+    summary = run_with_db(lambda: archive_orders(
+        older_than_days, batch_size, announce_wait,
+        progress=lambda done: typer.echo(f"archived: {done}", err=True),
+    ))
+    typer.echo(json.dumps(summary, indent=2))
+
+
+@app.command("export-finance")
+def export_finance_command(
+    start_date: datetime = typer.Argument(..., formats=["%Y-%m-%d"], help="First day, inclusive"),
+    end_date: datetime = typer.Argument(..., formats=["%Y-%m-%d"], help="Last day, inclusive"),
+    output: Path = typer.Option(..., "--output", "-o", dir_okay=False, help="File to write"),
+    format: Optional[str] = typer.Option(None, help="csv or parquet (defaults to the output extension)"),
+    batch_rows: int = typer.Option(FINANCE_EXPORT_BATCH_ROWS, min=1, help="Order lines per frame"),
+):
+    """Write order lines with cost and margin for a date range to CSV or Parquet."""
+    fmt = (format or output.suffix.lstrip(".")).lower()
+    if fmt not in FINANCE_EXPORT_FORMATS:
+        raise typer.BadParameter(f"Unsupported format {fmt!r}; use csv or parquet", param_hint="--format")
+    if fmt == "parquet" and server.pq is None:
+        raise typer.BadParameter("Parquet export requires pyarrow", param_hint="--format")
+    stats = {"lines": 0}
+
+    async def run():
+        frames = iter_finance_frames(
+            start_date.date().isoformat(), end_date.date().isoformat(), batch_rows, stats,
+        )
+        if fmt == "csv":
+            with output.open("w", encoding="utf-8", newline="") as sink:
+                async for chunk in finance_csv_chunks(frames):
+                    sink.write(chunk)
+        else:
+            await write_finance_parquet(frames, str(output))
+
+    run_with_db(run)
+    typer.echo(json.dumps({"output": str(output), "format": fmt, **stats}, indent=2))
+
+
+@app.command("rebuild-customer-stats")
+def rebuild_customer_stats_command():
+    """Recompute order count, lifetime value and order dates for every customer."""
+    typer.echo(json.dumps(run_with_db(rebuild_customer_stats), indent=2))
+
+
+@app.command("generate")
+def generate_command(
+    products: int = typer.Option(500, min=1, help="Products, each with a size x colour variant matrix"),
+    customers: int = typer.Option(20000, min=1, help="Customers"),
+    orders: int = typer.Option(100000, min=0, help="Orders spread over --days"),
+    seed: int = typer.Option(42, help="Same seed and end date give identical data"),
+    days: int = typer.Option(365, min=1, help="Days of order history"),
+    end_date: Optional[datetime] = typer.Option(
+        None, formats=["%Y-%m-%d"], help="Last day of order history (default: today)"
+    ),
+    batch_size: int = typer.Option(5000, min=1, help="Documents per insert_many"),
+    drop: bool = typer.Option(False, "--drop", help="Drop products, customers and orders first"),
+):
+    """Fill the configured database with a realistic synthetic shop."""
+    if drop:
+        typer.confirm(f"Drop products, customers and orders in '{DB_NAME}'?", abort=True)
+    spec = ShopSpec(
+        products=products, customers=customers, orders=orders, seed=seed,
+        days=days, end_date=(end_date or datetime.now()).date(), batch_size=batch_size,
+    )
+
+    async def run():
+        summary = await generate_shop(
+            server.db, spec, drop=drop, progress=lambda kind, done: typer.echo(f"{kind}: {done}", err=True),
+        )
+        await ensure_indexes()
+        summary["customer_stats"] = await rebuild_customer_stats()
+        return summary
+
+    typer.echo(json.dumps(run_with_db(run), indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,377 @@
+"""Deterministic synthetic shop data for scale testing and benchmarks.
+
+Everything is drawn from a single ``random.Random(seed)`` and anchored to an
+explicit end date, so the same spec always produces the same documents.
+Documents are written in ``insert_many`` batches while the next batch is being
+generated.
+"""
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from server import normalize_phone
+
+# name: (code, sizes, (min price, max price), colours per product)
+CATEGORIES: Dict[str, Tuple[str, List[str], Tuple[int, int], Tuple[int, int]]] = {
+    "T-Shirts": ("TS", ["XS", "S", "M", "L", "XL", "XXL"], (1200, 2800), (3, 6)),
+    "Shirts": ("SH", ["S", "M", "L", "XL", "XXL"], (2200, 4800), (2, 5)),
+    "Dresses": ("DR", ["XS", "S", "M", "L", "XL"], (3500, 9500), (2, 4)),
+    "Frocks": ("FR", ["XS", "S", "M", "L"], (2500, 6500), (2, 5)),
+    "Trousers": ("TR", ["S", "M", "L", "XL", "XXL"], (2800, 5500), (2, 4)),
+    "Skirts": ("SK", ["XS", "S", "M", "L"], (1800, 4200), (2, 4)),
+    "Sarongs": ("SR", ["M", "L", "XL"], (1500, 3500), (3, 6)),
+    "Sarees": ("SA", ["M"], (6500, 25000), (1, 3)),
+    "Shorts": ("SO", ["S", "M", "L", "XL"], (1100, 2600), (2, 5)),
+    "Kurtas": ("KU", ["S", "M", "L", "XL"], (2800, 6800), (2, 4)),
+}
+CATEGORY_WEIGHTS = [22, 14, 12, 10, 10, 7, 6, 5, 8, 6]
+SIZE_STOCK_WEIGHT = {"XS": 0.5, "S": 0.9, "M": 1.3, "L": 1.2, "XL": 0.8, "XXL": 0.5}
+COLORS = [
+    "Black", "White", "Navy", "Maroon", "Olive", "Beige", "Grey", "Sky Blue",
+    "Mustard", "Emerald", "Peach", "Lavender", "Charcoal", "Coral", "Teal", "Cream",
+]
+ADJECTIVES = ["Classic", "Everyday", "Premium", "Relaxed", "Slim Fit", "Batik", "Linen", "Festive", "Casual", "Office"]
+FABRICS = ["Cotton", "Linen", "Rayon", "Silk", "Denim", "Chiffon", "Jersey", "Handloom"]
+
+FIRST_NAMES = [
+    "Nimal", "Kasun", "Tharindu", "Nuwan", "Chaminda", "Sanjaya", "Dilan", "Ruwan", "Lahiru", "Isuru",
+    "Dilini", "Sachini", "Chamari", "Ishara", "Nadeesha", "Hiruni", "Kavindi", "Thilini", "Anjali", "Sewwandi",
+    "Arun", "Kumaran", "Suresh", "Priya", "Tharshini", "Lavanya", "Mohamed", "Rizwan", "Fathima", "Aysha",
+]
+LAST_NAMES = [
+    "Perera", "Fernando", "Silva", "de Silva", "Jayasinghe", "Bandara", "Wickramasinghe", "Gunawardena",
+    "Dissanayake", "Rajapaksha", "Herath", "Senanayake", "Karunaratne", "Ekanayake", "Wijesinghe",
+    "Kumar", "Sivakumar", "Nadarajah", "Rahman", "Mohideen", "Cassim",
+]
+STREETS = [
+    "Galle Road", "Temple Road", "Station Road", "Main Street", "Kandy Road", "Lake Road", "Church Road",
+    "High Level Road", "Baseline Road", "Hospital Road", "School Lane", "Old Road", "Negombo Road",
+    "Peradeniya Road", "Matara Road", "Circular Road", "1st Cross Street", "Mosque Lane",
+]
+# city: (postal code, area code, weight, western province)
+CITIES: Dict[str, Tuple[str, str, int, bool]] = {
+    "Colombo": ("00100", "11", 24, True),
+    "Dehiwala": ("10350", "11", 7, True),
+    "Maharagama": ("10280", "11", 6, True),
+    "Moratuwa": ("10400", "11", 5, True),
+    "Gampaha": ("11000", "33", 6, True),
+    "Negombo": ("11500", "31", 5, True),
+    "Kalutara": ("12000", "34", 4, True),
+    "Kandy": ("20000", "81", 8, False),
+    "Kurunegala": ("60000", "37", 5, False),
+    "Galle": ("80000", "91", 5, False),
+    "Matara": ("81000", "41", 4, False),
+    "Jaffna": ("40000", "21", 4, False),
+    "Anuradhapura": ("50000", "25", 3, False),
+    "Ratnapura": ("70000", "45", 3, False),
+    "Badulla": ("90000", "55", 2, False),
+    "Batticaloa": ("30000", "65", 2, False),
+    "Trincomalee": ("31000", "26", 2, False),
+    "Nuwara Eliya": ("22200", "52", 1, False),
+}
+MOBILE_PREFIXES = ["70", "71", "72", "74", "75", "76", "77", "78"]
+EMAIL_DOMAINS = ["gmail.com", "gmail.com", "gmail.com", "yahoo.com", "hotmail.com", "sltnet.lk"]
+REMARKS = ["Call before delivery", "Deliver after 5pm", "Gift wrap please", "Leave at the shop next door", "Fragile"]
+
+COURIER_CHARGE_WESTERN = 350.0
+COURIER_CHARGE_OUTSTATION = 450.0
+HOUR_WEIGHTS = [1, 1, 0, 0, 0, 0, 1, 2, 4, 6, 8, 9, 9, 8, 7, 6, 6, 7, 9, 11, 12, 10, 6, 3]
+
+
+@dataclass
+class ShopSpec:
+    products: int = 500
+    customers: int = 20000
+    orders: int = 100000
+    seed: int = 42
+    days: int = 365
+    end_date: date = field(default_factory=lambda: datetime.now(timezone.utc).date())
+    batch_size: int = 5000
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+def seasonal_weight(day: date) -> float:
+    """Relative order volume for a day: December and Avurudu peaks, Vesak and weekend bumps."""
+    weight = 1.0
+    if day.month == 12:
+        weight *= 1.6 if day.day < 15 else 2.2 if day.day <= 24 else 1.3
+    elif day.month == 4 and day.day <= 13:
+        weight *= 2.4
+    elif day.month == 5 and 10 <= day.day <= 20:
+        weight *= 1.3
+    elif day.month in (1, 2):
+        weight *= 0.8
+    if day.weekday() >= 5:
+        weight *= 1.25
+    return weight
+
+
+def order_status(rng: random.Random, age_days: float) -> str:
+    """Status mix that depends on order age: recent orders are still moving."""
+    if age_days < 2:
+        choices, weights = ["pending", "on_courier"], [65, 35]
+    elif age_days < 7:
+        choices, weights = ["pending", "on_courier", "delivered", "returned"], [8, 47, 40, 5]
+    else:
+        choices, weights = ["pending", "on_courier", "delivered", "returned"], [1, 2, 88, 9]
+    return rng.choices(choices, weights=weights)[0]
+
+
+def format_mobile(rng: random.Random) -> str:
+    """A Sri Lankan mobile number in one of the formats customers actually type."""
+    prefix = rng.choice(MOBILE_PREFIXES)
+    number = f"{rng.randint(0, 9999999):07d}"
+    style = rng.random()
+    if style < 0.55:
+        return f"0{prefix}{number}"
+    if style < 0.75:
+        return f"0{prefix} {number[:3]} {number[3:]}"
+    if style < 0.9:
+        return f"+94{prefix}{number}"
+    return f"+94 {prefix} {number[:3]} {number[3:]}"
+
+
+def generate_products(rng: random.Random, count: int, end: datetime) -> List[dict]:
+    """Products with a full size x colour variant matrix per product."""
+    names = list(CATEGORIES)
+    products = []
+    for index in range(count):
+        category = rng.choices(names, weights=CATEGORY_WEIGHTS)[0]
+        code, sizes, (low, high), (min_colors, max_colors) = CATEGORIES[category]
+        colors = rng.sample(COLORS, rng.randint(min_colors, max_colors))
+        price = float(rng.randrange(low, high, 50))
+        created = end - timedelta(days=rng.randint(30, 720))
+        has_cost = rng.random() < 0.85
+        variants = []
+        for size, color in itertools.product(sizes, colors):
+            base_stock = rng.randint(0, 40) * SIZE_STOCK_WEIGHT[size]
+            variants.append({
+                "id": _uuid(rng),
+                "size": size,
+                "color": color,
+                "sku": f"{code}-{index:05d}-{size}-{color.replace(' ', '')[:3].upper()}",
+                "stock_quantity": int(base_stock),
+                "price": price,
+                "buy_price": round(price * rng.uniform(0.48, 0.66), -1) if has_cost else None,
+                "purchase_date": _iso(created) if has_cost else None,
+            })
+        singular = category[:-1] if category.endswith("s") else category
+        products.append({
+            "id": _uuid(rng),
+            "name": f"{rng.choice(ADJECTIVES)} {rng.choice(FABRICS)} {singular} {index + 1:04d}",
+            "description": f"{rng.choice(FABRICS)} {singular.lower()} available in {len(colors)} colours",
+            "category": category,
+            "variants": variants,
+            "low_stock_threshold": rng.choice([3, 5, 5, 5, 8, 10]),
+            "created_at": _iso(created),
+            "updated_at": _iso(created),
+        })
+    return products
+
+
+def generate_customer(rng: random.Random, index: int, end: datetime, days: int) -> dict:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    city = rng.choices(list(CITIES), weights=[c[2] for c in CITIES.values()])[0]
+    postal_code, area_code, _, _ = CITIES[city]
+    phone = format_mobile(rng)
+    house = f"{rng.randint(1, 450)}" + (f"/{rng.choice('ABCD')}" if rng.random() < 0.2 else "")
+    created = end - timedelta(days=rng.uniform(0, days * 1.5))
+    return {
+        "id": _uuid(rng),
+        "name": f"{first} {last}",
+        "email": f"{first.lower()}.{last.lower().replace(' ', '')}{index}@{rng.choice(EMAIL_DOMAINS)}",
+        "phone": phone,
+        "phone_2": f"0{area_code}{rng.randint(0, 9999999):07d}" if rng.random() < 0.2 else None,
+        "phone_normalized": normalize_phone(phone),
+        # "..., City, Postal code" keeps the city second-to-last, which the CSV export relies on
+        "address": f"No. {house}, {rng.choice(STREETS)}, {city}, {postal_code}",
+        "city": city,
+        "postal_code": postal_code,
+        "created_at": _iso(created),
+        "updated_at": _iso(created),
+    }
+
+
+def order_timestamps(rng: random.Random, count: int, end: datetime, days: int) -> List[datetime]:
+    """Chronologically sorted order times following the seasonal and hourly curves."""
+    first_day = end.date() - timedelta(days=days - 1)
+    calendar = [first_day + timedelta(days=offset) for offset in range(days)]
+    # Slight growth trend so the shop looks busier now than a year ago
+    weights = [seasonal_weight(day) * (0.7 + 0.3 * offset / max(days - 1, 1)) for offset, day in enumerate(calendar)]
+    picked_days = rng.choices(calendar, weights=weights, k=count)
+    picked_hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+    stamps = [
+        datetime.combine(day, dt_time(hour, rng.randint(0, 59), rng.randint(0, 59)), tzinfo=timezone.utc)
+        for day, hour in zip(picked_days, picked_hours)
+    ]
+    stamps.sort()
+    return [min(stamp, end) for stamp in stamps]
+
+
+def generate_order(rng: random.Random, number: int, created: datetime, end: datetime,
+                   customer: dict, products: List[dict]) -> dict:
+    items = []
+    item_count = rng.choices([1, 2, 3, 4], weights=[60, 25, 10, 5])[0]
+    for product in {p["id"]: p for p in (_popular(rng, products) for _ in range(item_count))}.values():
+        variant = rng.choice(product["variants"])
+        quantity = rng.choices([1, 2, 3], weights=[80, 15, 5])[0]
+        items.append({
+            "product_id": product["id"],
+            "variant_id": variant["id"],
+            "product_name": product["name"],
+            "size": variant["size"],
+            "color": variant["color"],
+            "quantity": quantity,
+            "unit_price": variant["price"],
+            "total_price": variant["price"] * quantity,
+        })
+    subtotal = sum(item["total_price"] for item in items)
+    discount_percentage = rng.choices([0.0, 5.0, 10.0, 15.0], weights=[85, 7, 6, 2])[0]
+    discount_amount = round(subtotal * discount_percentage / 100, 2)
+    courier = COURIER_CHARGE_WESTERN if CITIES[customer["city"]][3] else COURIER_CHARGE_OUTSTATION
+    total = subtotal - discount_amount + courier
+    age_days = (end - created).total_seconds() / 86400
+    status = order_status(rng, age_days)
+    updated = created + timedelta(days=min(age_days, rng.uniform(0.5, 6))) if status != "pending" else created
+    return {
+        "id": _uuid(rng),
+        "order_number": f"ORD-{number:06d}",
+        "customer_id": customer["id"],
+        "customer_name": customer["name"],
+        "customer_address": customer["address"],
+        "customer_phone": customer["phone"],
+        "customer_phone_2": customer["phone_2"],
+        "customer_city": customer["city"],
+        "items": items,
+        "subtotal": subtotal,
+        "tax_amount": 0.0,
+        "courier_charges": courier,
+        "discount_amount": discount_amount,
+        "discount_percentage": discount_percentage,
+        "total_amount": total,
+        "status": status,
+        "tracking_number": f"CD{rng.randint(0, 10**10):010d}" if status != "pending" else None,
+        "cod_amount": total,
+        "remarks": rng.choice(REMARKS) if rng.random() < 0.08 else None,
+        "created_at": _iso(created),
+        "updated_at": _iso(updated),
+    }
+
+
+def _popular(rng: random.Random, population: list):
+    """Pick with a long-tail skew: a few items account for most picks."""
+    return population[int(len(population) * rng.random() ** 2.2)]
+
+
+class _BatchWriter:
+    """insert_many in fixed-size batches, overlapping each write with generating the next batch."""
+
+    def __init__(self, collection, batch_size: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch: List[dict] = []
+        self.pending: Optional[asyncio.Task] = None
+        self.written = 0
+
+    async def add(self, doc: dict):
+        self.batch.append(doc)
+        if len(self.batch) >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        if self.pending is not None:
+            await self.pending
+        if self.batch:
+            self.pending = asyncio.ensure_future(self.collection.insert_many(self.batch, ordered=False))
+            self.written += len(self.batch)
+            self.batch = []
+
+    async def close(self) -> int:
+        await self._flush()
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+        return self.written
+
+
+async def generate_shop(db, spec: ShopSpec, drop: bool = False,
+                        progress: Optional[Callable[[str, int], None]] = None) -> dict:
+    """Generate products, customers and orders for ``spec`` into ``db``.
+
+    Without ``drop`` the documents are appended and order numbers continue
+    from the order number counter.
+    """
+    rng = random.Random(spec.seed)
+    end = datetime.combine(spec.end_date, dt_time(23, 59, 59), tzinfo=timezone.utc)
+    if drop:
+        for name in ("products", "customers", "customer_stats", "orders", "orders_archive", "tombstones", "counters"):
+            await db[name].drop()
+    counter = await db.counters.find_one({"_id": "order_number"})
+    first_number = (counter["seq"] if counter else await db.orders.count_documents({})) + 1
+    timings = {}
+
+    started = time.perf_counter()
+    products = generate_products(rng, spec.products, end)
+    writer = _BatchWriter(db.products, spec.batch_size)
+    for product in products:
+        await writer.add(dict(product))
+    await writer.close()
+    timings["products"] = time.perf_counter() - started
+    if progress:
+        progress("products", spec.products)
+
+    # Orders denormalise customer fields, so keep just what they copy
+    started = time.perf_counter()
+    customers = []
+    writer = _BatchWriter(db.customers, spec.batch_size)
+    for index in range(spec.customers):
+        customer = generate_customer(rng, index, end, spec.days)
+        customers.append({key: customer[key] for key in ("id", "name", "address", "phone", "phone_2", "city")})
+        await writer.add(customer)
+    await writer.close()
+    timings["customers"] = time.perf_counter() - started
+    if progress:
+        progress("customers", spec.customers)
+
+    started = time.perf_counter()
+    writer = _BatchWriter(db.orders, spec.batch_size)
+    for offset, created in enumerate(order_timestamps(rng, spec.orders, end, spec.days)):
+        await writer.add(generate_order(
+            rng, first_number + offset, created, end, _popular(rng, customers), products,
+        ))
+        if progress and (offset + 1) % (spec.batch_size * 20) == 0:
+            progress("orders", offset + 1)
+    await writer.close()
+    # Orders created through the API continue after the generated ones
+    await db.counters.update_one(
+        {"_id": "order_number"}, {"$max": {"seq": first_number + spec.orders - 1}}, upsert=True
+    )
+    timings["orders"] = time.perf_counter() - started
+    if progress:
+        progress("orders", spec.orders)
+
+    total_docs = spec.products + spec.customers + spec.orders
+    total_seconds = sum(timings.values())
+    return {
+        "products": spec.products,
+        "variants": sum(len(product["variants"]) for product in products),
+        "customers": spec.customers,
+        "orders": spec.orders,
+        "seed": spec.seed,
+        "days": spec.days,
+        "end_date": spec.end_date.isoformat(),
+        "seconds": {name: round(seconds, 1) for name, seconds in timings.items()},
+        "docs_per_minute": round(total_docs / total_seconds * 60) if total_seconds else 0,
+    }
@@ -1,198 +1,3129 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Form, UploadFile, File, Query, Request, Response
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne, MongoClient, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 import os
+import time
+import asyncio
+import contextvars
+import io
+import re
+import csv
 import logging
+import logging.handlers
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterable, Iterator, Tuple, Union, Generic, TypeVar
 import uuid
-from datetime import datetime, timezone
+import base64
+import hashlib
+import zlib
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
+from collections import OrderedDict, defaultdict, deque
 import json
+import numpy as np
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:  # gzip is still negotiated without it
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # finance export falls back to CSV only
+    pa = pq = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"], buckets=HTTP_LATENCY_BUCKETS,
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Requests currently being handled", ["method", "route"],
+)
+http_response_size = Histogram(
+    "http_response_size_bytes", "Response body size as sent, after compression",
+    ["method", "route"], buckets=RESPONSE_SIZE_BUCKETS,
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency",
+    ["command", "collection"], buckets=MONGO_LATENCY_BUCKETS,
+)
+mongo_command_failures = Counter(
+    "mongo_command_failures_total", "Mongo commands that returned an error", ["command", "collection"],
+)
+mongo_route_commands = Counter(
+    "mongo_route_commands_total", "Mongo commands issued while serving each route",
+    ["route", "command", "collection"],
+)
+mongo_commands_per_request = Histogram(
+    "mongo_commands_per_request", "Mongo commands issued by a single request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000),
+)
+label_cache_lookups = Counter(
+    "label_cache_lookups_total", "Shipping label cache lookups by where the label was found", ["result"],
+)
+
+class RequestContext:
+    """Per-request state shared with code running on Motor's executor threads."""
+    __slots__ = ("route", "mongo_commands")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.mongo_commands = 0
+
+current_request: contextvars.ContextVar = contextvars.ContextVar("current_request", default=None)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Record latency and counts for every command the Motor client issues."""
+    def __init__(self):
+        self._inflight: Dict[Tuple[Any, int], Tuple[str, str, Optional[RequestContext]]] = {}
+
+    @staticmethod
+    def collection_name(command_name: str, command: dict) -> str:
+        target = command.get("collection") if command_name == "getMore" else command.get(command_name)
+        return target if isinstance(target, str) else "-"
+
+    def started(self, event):
+        context = current_request.get()
+        command = event.command_name
+        collection = self.collection_name(command, event.command)
+        self._inflight[(event.connection_id, event.request_id)] = (command, collection, context)
+        if context is not None:
+            context.mongo_commands += 1
+            mongo_route_commands.labels(context.route, command, collection).inc()
+
+    def _finish(self, event, failed: bool):
+        labels = self._inflight.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            return
+        command, collection, _ = labels
+        mongo_command_duration.labels(command, collection).observe(event.duration_micros / 1e6)
+        if failed:
+            mongo_command_failures.labels(command, collection).inc()
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+mongo_command_metrics = MongoCommandMetrics()
+
+class MongoPoolStats(monitoring.ConnectionPoolListener):
+    """Track open, checked-out and waiting connections for each server the pool talks to."""
+    FIELDS = ("open", "checked_out", "waiting", "checkouts", "checkout_failures")
+
+    def __init__(self):
+        self._pools: Dict[str, Dict[str, int]] = {}
+
+    def _pool(self, event) -> Dict[str, int]:
+        address = "%s:%s" % event.address
+        pool = self._pools.get(address)
+        if pool is None:
+            pool = self._pools[address] = dict.fromkeys(self.FIELDS, 0)
+        return pool
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {address: dict(pool) for address, pool in list(self._pools.items())}
+
+    def pool_created(self, event):
+        self._pool(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        self._pools.pop("%s:%s" % event.address, None)
+
+    def connection_created(self, event):
+        self._pool(event)["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool = self._pool(event)
+        pool["open"] = max(pool["open"] - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._pool(event)["waiting"] += 1
+
+    def connection_check_out_failed(self, event):
+        pool = self._pool(event)
+        pool["waiting"] = max(pool["waiting"] - 1, 0)
+        pool["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        pool = self._pool(event)
+        pool["waiting"] = max(pool["waiting"] - 1, 0)
+        pool["checked_out"] += 1
+        pool["checkouts"] += 1
+
+    def connection_checked_in(self, event):
+        pool = self._pool(event)
+        pool["checked_out"] = max(pool["checked_out"] - 1, 0)
+
+mongo_pool_stats = MongoPoolStats()
+
+class MongoPoolCollector:
+    """Expose mongo_pool_stats per server address."""
+    def collect(self):
+        gauges = {
+            field: GaugeMetricFamily(f"mongo_pool_{field}_connections", help_text, labels=["address"])
+            for field, help_text in (
+                ("open", "Open connections in the pool"),
+                ("checked_out", "Connections currently checked out"),
+                ("waiting", "Operations waiting for a connection"),
+            )
+        }
+        checkouts = CounterMetricFamily("mongo_pool_checkouts", "Connection checkouts", labels=["address"])
+        failures = CounterMetricFamily(
+            "mongo_pool_checkout_failures", "Checkouts that timed out or failed", labels=["address"])
+        for address, pool in mongo_pool_stats.snapshot().items():
+            for field, gauge in gauges.items():
+                gauge.add_metric([address], pool[field])
+            checkouts.add_metric([address], pool["checkouts"])
+            failures.add_metric([address], pool["checkout_failures"])
+        yield from (*gauges.values(), checkouts, failures)
+
+REGISTRY.register(MongoPoolCollector())
+
+# Slow query log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '0'))
+SLOW_QUERY_EXPLAIN_FILE = Path(os.environ.get('SLOW_QUERY_EXPLAIN_FILE', str(ROOT_DIR / 'logs' / 'slow_explain.jsonl')))
+SLOW_QUERY_EXPLAIN_MAX_BYTES = int(os.environ.get('SLOW_QUERY_EXPLAIN_MAX_BYTES', str(10 * 1024 * 1024)))
+SLOW_QUERY_EXPLAIN_BACKUPS = int(os.environ.get('SLOW_QUERY_EXPLAIN_BACKUPS', '5'))
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Parts of a command that describe its shape; everything else (documents,
+# session and cluster-time fields) is dropped before logging.
+SHAPE_FIELDS = ("filter", "query", "sort", "projection", "pipeline", "key", "hint")
+# Fields the driver adds that an explain command must not carry
+DRIVER_FIELDS = {"lsid", "$clusterTime", "$db", "txnNumber", "$readPreference", "readConcern", "writeConcern"}
+
+slow_query_logger = logging.getLogger("slow_query")
+
+def redact_shape(value):
+    """Replace literal values with '?' while keeping field names and operators."""
+    if isinstance(value, dict):
+        return {key: redact_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shapes = []
+        for item in value:
+            shape = redact_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def command_shape(command_name: str, command: dict) -> dict:
+    shape = {field: redact_shape(command[field]) for field in SHAPE_FIELDS if field in command}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes", [])
+        shape["q"] = redact_shape([statement.get("q", {}) for statement in statements])
+    return shape
+
+def returned_count(reply: dict) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "n" in reply:
+        return reply["n"]
+    if "values" in reply:
+        return len(reply["values"])
+    return None
+
+def summarize_explain(explain: dict) -> dict:
+    """Pull examined/returned totals and plan stage names out of an explain result."""
+    summary = {"docs_examined": 0, "keys_examined": 0, "returned": None, "stages": []}
+
+    def walk(node):
+        if isinstance(node, dict):
+            stats = node.get("executionStats")
+            if isinstance(stats, dict):
+                summary["docs_examined"] += stats.get("totalDocsExamined", 0)
+                summary["keys_examined"] += stats.get("totalKeysExamined", 0)
+                if summary["returned"] is None:
+                    summary["returned"] = stats.get("nReturned")
+            stage = node.get("stage")
+            if isinstance(stage, str) and stage not in summary["stages"]:
+                summary["stages"].append(stage)
+            for key, child in node.items():
+                if key != "executionStats":
+                    walk(child)
+        elif isinstance(node, list):
+            for child in node:
+                walk(child)
+
+    walk(explain)
+    return summary
+
+class SlowQueryLogger(monitoring.CommandListener):
+    """Log commands slower than SLOW_QUERY_MS and optionally capture a sampled explain().
+
+    A command reply only says how many documents came back. Documents and keys
+    examined are only known from an explain, so the slow line marks them as
+    "not sampled" or "see explain", and the sampled explain line that follows
+    carries totalDocsExamined and totalKeysExamined.
+
+    Explains run on a separate synchronous client on a single worker thread,
+    so they never re-enter this listener or compete with request handlers
+    for the Motor pool.
+    """
+    def __init__(self):
+        self._inflight: Dict[Tuple[Any, int], Tuple[dict, str, Optional[str]]] = {}
+        self._explain_executor = None
+        self._explain_client = None
+        self._explain_logger = None
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        context = current_request.get()
+        self._inflight[(event.connection_id, event.request_id)] = (
+            event.command, event.database_name, context.route if context else None,
+        )
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+    def _finish(self, event, reply: Optional[dict]):
+        entry = self._inflight.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if entry is None or duration_ms < SLOW_QUERY_MS:
+            return
+        command, database, route = entry
+        record = {
+            "route": route or "-",
+            "command": event.command_name,
+            "collection": MongoCommandMetrics.collection_name(event.command_name, command),
+            "duration_ms": round(duration_ms, 1),
+            "shape": command_shape(event.command_name, command),
+            "returned": returned_count(reply) if reply else None,
+            "failed": reply is None,
+        }
+        sampled = SLOW_QUERY_EXPLAIN_SAMPLE_RATE > 0 and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        slow_query_logger.warning(
+            "Slow mongo %s on %s from %s took %.1f ms (returned=%s, examined=%s) shape=%s",
+            record["command"], record["collection"], record["route"], duration_ms,
+            record["returned"], "see explain" if sampled else "not sampled",
+            json.dumps(record["shape"], default=str),
+        )
+        if sampled:
+            self._submit_explain(database, command, record)
+
+    def _submit_explain(self, database: str, command: dict, record: dict):
+        if self._explain_executor is None:
+            self._explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        explain_command = {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+        self._explain_executor.submit(self._run_explain, database, explain_command, record)
+
+    def _run_explain(self, database: str, command: dict, record: dict):
+        try:
+            if self._explain_client is None:
+                self._explain_client = MongoClient(mongo_url, appname="slow-query-explain")
+            explain = self._explain_client[database].command(
+                {"explain": command, "verbosity": "executionStats"}
+            )
+        except PyMongoError as e:
+            slow_query_logger.info("explain failed for %s on %s: %s", record["command"], record["collection"], e)
+            return
+        record = {**record, **summarize_explain(explain), "at": datetime.now(timezone.utc).isoformat()}
+        slow_query_logger.warning(
+            "Explain for slow %s on %s from %s: examined %s docs / %s keys for %s returned, stages=%s",
+            record["command"], record["collection"], record["route"], record["docs_examined"],
+            record["keys_examined"], record["returned"], ",".join(record["stages"]),
+        )
+        self._get_explain_logger().info(json.dumps(record, default=str))
+
+    def _get_explain_logger(self) -> logging.Logger:
+        if self._explain_logger is None:
+            SLOW_QUERY_EXPLAIN_FILE.parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                SLOW_QUERY_EXPLAIN_FILE, maxBytes=SLOW_QUERY_EXPLAIN_MAX_BYTES, backupCount=SLOW_QUERY_EXPLAIN_BACKUPS,
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            explain_logger = logging.getLogger("slow_query.explain")
+            explain_logger.addHandler(handler)
+            explain_logger.setLevel(logging.INFO)
+            explain_logger.propagate = False
+            self._explain_logger = explain_logger
+        return self._explain_logger
+
+slow_query_log = SlowQueryLogger()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+    "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "appname": os.environ.get('MONGO_APP_NAME', 'pos-backend'),
+}
+READINESS_PING_TIMEOUT = float(os.environ.get('READINESS_PING_TIMEOUT', '1'))
+mongo_event_listeners = [mongo_command_metrics, slow_query_log, mongo_pool_stats]
+
+# Read routing
+# Report routes read through reports_db, which uses REPORT_READ_PREFERENCE
+# (e.g. secondaryPreferred on a replica set) bounded by
+# REPORT_MAX_STALENESS_SECONDS. Every other route, and code running outside a
+# request, reads from the primary so writes are visible to the next read.
+READ_PREFERENCE_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+REPORT_READ_PREFERENCE = os.environ.get('REPORT_READ_PREFERENCE', 'primary')
+# 0 disables the bound; otherwise the server requires at least 90 seconds
+REPORT_MAX_STALENESS_SECONDS = int(os.environ.get('REPORT_MAX_STALENESS_SECONDS', '90'))
+REPORT_ROUTES = {
+    "/api/dashboard",
+    "/api/finance/daily-sales",
+    "/api/finance/profit-loss",
+    "/api/finance/export",
+    "/api/analytics/sales",
+    "/api/inventory/valuation",
+}
+
+def report_read_preference():
+    mode = READ_PREFERENCE_MODES.get(REPORT_READ_PREFERENCE)
+    if mode is None:
+        raise ValueError(
+            f"REPORT_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCE_MODES)}, not {REPORT_READ_PREFERENCE!r}"
+        )
+    if mode is Primary:
+        return Primary()
+    if 0 < REPORT_MAX_STALENESS_SECONDS < 90:
+        raise ValueError("REPORT_MAX_STALENESS_SECONDS must be 0 (unbounded) or at least 90")
+    return mode(max_staleness=REPORT_MAX_STALENESS_SECONDS or -1)
+
+def read_db():
+    """Database handle for reads: report routes use the report read preference, everything else the primary."""
+    context = current_request.get()
+    if context is not None and context.route in REPORT_ROUTES and reports_db is not None:
+        return reports_db
+    return db
+
+# Created by the connect_mongo startup hook so the pool is bound to the serving
+# event loop and a worker only reports ready once it has warm connections
+client: Optional[AsyncIOMotorClient] = None
+db = None
+reports_db = None
+
+async def connect_mongo():
+    """Create the Motor client, check the server answers and open minPoolSize connections."""
+    global client, db, reports_db
+    client = AsyncIOMotorClient(mongo_url, event_listeners=mongo_event_listeners, **MONGO_CLIENT_OPTIONS)
+    db = client[DB_NAME]
+    reports_db = client.get_database(DB_NAME, read_preference=report_read_preference())
+    await db.command("ping")
+    # Concurrent pings each check out their own connection
+    warm = min(MONGO_CLIENT_OPTIONS["minPoolSize"], MONGO_CLIENT_OPTIONS["maxPoolSize"])
+    await asyncio.gather(*(db.command("ping") for _ in range(warm - 1)))
+
+# Create the main app without a prefix
+app = FastAPI()
+
+# Create a router with the /api prefix
+api_router = APIRouter(prefix="/api")
+
+# Enums
+class OrderStatus(str, Enum):
+    PENDING = "pending"
+    ON_COURIER = "on_courier"
+    DELIVERED = "delivered"
+    RETURNED = "returned"
+
+class SizeEnum(str, Enum):
+    XS = "XS"
+    S = "S"
+    M = "M"
+    L = "L"
+    XL = "XL"
+    XXL = "XXL"
+
+# Pydantic Models
+class ProductVariant(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    size: SizeEnum
+    color: str
+    sku: str
+    stock_quantity: int
+    price: float
+    buy_price: Optional[float] = None
+    purchase_date: Optional[datetime] = None
+
+class Product(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    description: str
+    category: str
+    variants: List[ProductVariant]
+    low_stock_threshold: int = 5
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class Customer(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    email: str
+    phone: str
+    phone_2: Optional[str] = None
+    phone_normalized: Optional[str] = None
+    address: str
+    city: str
+    postal_code: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CustomerStats(BaseModel):
+    customer_id: str
+    order_count: int = 0
+    lifetime_value: float = 0.0
+    returns_count: int = 0
+    first_order_at: Optional[datetime] = None
+    last_order_at: Optional[datetime] = None
+
+class CustomerWithStats(Customer):
+    stats: CustomerStats
+
+class CustomerPage(BaseModel):
+    items: List[CustomerWithStats]
+    total: int
+    offset: int
+    limit: int
+
+class OrderSummary(BaseModel):
+    id: str
+    order_number: Optional[str] = None
+    status: OrderStatus
+    total_amount: float
+    cod_amount: Optional[float] = None
+    tracking_number: Optional[str] = None
+    item_count: int
+    created_at: datetime
+
+class OrderHistoryPage(BaseModel):
+    items: List[OrderSummary]
+    total: int
+    offset: int
+    limit: int
+
+class OrderItem(BaseModel):
+    product_id: str
+    variant_id: str
+    product_name: str
+    size: str
+    color: str
+    quantity: int
+    unit_price: float
+    total_price: float
+
+class Order(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    order_number: Optional[str] = None
+    customer_id: str
+    customer_name: str
+    customer_address: str
+    customer_phone: str
+    customer_phone_2: Optional[str] = None
+    customer_city: Optional[str] = None
+    items: List[OrderItem]
+    subtotal: float
+    tax_amount: float
+    courier_charges: float = 350.0
+    discount_amount: float = 0.0
+    discount_percentage: float = 0.0
+    total_amount: float
+    status: OrderStatus = OrderStatus.PENDING
+    tracking_number: Optional[str] = None
+    cod_amount: Optional[float] = None
+    remarks: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class OrderPage(BaseModel):
+    items: List[Order]
+    total: int
+    offset: int
+    limit: int
+
+class BusinessSettings(BaseModel):
+    id: str = Field(default="business_settings")
+    business_name: str = "My Clothing Store"
+    address: str = ""
+    phone: str = ""
+    email: str = ""
+    tax_rate: float = 0.0
+    shipping_label_template: str = """
+    <div style="width: 210mm; height: 297mm; padding: 20mm; font-family: Arial, sans-serif;">
+        <div style="border: 2px solid #000; height: 100%; padding: 10mm;">
+            <h2 style="text-align: center; margin-bottom: 20px;">{{business_name}}</h2>
+            <div style="margin-bottom: 20px;">
+                <strong>From:</strong><br>
+                {{business_address}}<br>
+                {{business_phone}}
+            </div>
+            <div style="margin-bottom: 20px;">
+                <strong>To:</strong><br>
+                {{customer_name}}<br>
+                {{customer_address}}<br>
+                {{customer_phone}}
+            </div>
+            <div style="margin-bottom: 20px;">
+                <strong>Order #:</strong> {{order_number}}<br>
+                <strong>Tracking #:</strong> {{tracking_number}}<br>
+                <strong>Date:</strong> {{order_date}}
+            </div>
+            <div style="margin-bottom: 20px;">
+                <strong>Items:</strong><br>
+                {{order_items}}
+            </div>
+            <div style="margin-top: 40px; text-align: center;">
+                <strong>Total: LKR {{total_amount}}</strong>
+            </div>
+        </div>
+    </div>
+    """
+
+SyncItem = TypeVar("SyncItem")
+
+class DeltaPage(BaseModel, Generic[SyncItem]):
+    items: List[SyncItem]
+    deleted: List[str]
+    sync_token: str
+    has_more: bool = False
+
+# Helper functions
+def prepare_for_mongo(data):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, datetime):
+                data[key] = value.isoformat()
+            elif isinstance(value, list):
+                data[key] = [prepare_for_mongo(item) if isinstance(item, dict) else item for item in value]
+            elif isinstance(value, dict):
+                data[key] = prepare_for_mongo(value)
+    return data
+
+def parse_from_mongo(item):
+    if isinstance(item, dict):
+        for key, value in item.items():
+            if key == '_id':
+                # Skip MongoDB ObjectId fields
+                continue
+            elif isinstance(value, str) and 'T' in value and (value.endswith('Z') or (len(value) > 6 and '+' in value[-6:])):
+                try:
+                    item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                except:
+                    pass
+            elif isinstance(value, list):
+                item[key] = [parse_from_mongo(sub_item) if isinstance(sub_item, dict) else sub_item for sub_item in value]
+            elif isinstance(value, dict):
+                item[key] = parse_from_mongo(value)
+    return item
+
+def validate_page(offset: int, limit: int, max_limit: int):
+    if offset < 0 or not 1 <= limit <= max_limit:
+        raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {max_limit}")
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Normalize a Sri Lankan phone number to +94XXXXXXXXX, or None if it cannot be parsed."""
+    if not phone:
+        return None
+    digits = re.sub(r"\D", "", str(phone))
+    if digits.startswith("0094"):
+        digits = digits[4:]
+    elif digits.startswith("94") and len(digits) == 11:
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        digits = digits[1:]
+    if len(digits) != 9:
+        return None
+    return f"+94{digits}"
+
+# Delta sync
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '1000'))
+# Tokens trail the clock slightly so writes still in flight when a list was
+# read are delivered again on the next sync rather than lost.
+SYNC_CLOCK_SKEW = timedelta(seconds=float(os.environ.get('SYNC_CLOCK_SKEW_SECONDS', '5')))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+SYNC_TOKEN_HEADER = "X-Sync-Token"
+
+class SyncTokenExpired(Exception):
+    """The token predates tombstone retention, so deletions since then may be gone; reload everything."""
+
+def encode_sync_token(moment: datetime, after_id: Optional[str] = None) -> str:
+    value = moment.isoformat() if after_id is None else f"{moment.isoformat()}|{after_id}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+def parse_sync_moment(value: str) -> datetime:
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+def parse_sync_token(value: str) -> Tuple[datetime, Optional[str]]:
+    """Accept either an ISO timestamp or a token previously returned by a list endpoint.
+
+    Returns the moment and, for tokens that end a full page, the id of the last
+    record delivered at that moment.
+    """
+    try:
+        return parse_sync_moment(value), None
+    except ValueError:
+        pass
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        moment, _, after_id = base64.urlsafe_b64decode(padded).decode().partition("|")
+        return parse_sync_moment(moment), after_id or None
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="updated_since must be an ISO timestamp or sync token")
+
+def current_sync_token() -> str:
+    return encode_sync_token(datetime.now(timezone.utc) - SYNC_CLOCK_SKEW)
+
+async def record_tombstone(collection: str, document_id: str):
+    await db.tombstones.insert_one({
+        "collection": collection,
+        "id": document_id,
+        "deleted_at": datetime.now(timezone.utc),
+    })
+
+def delta_queries(since: datetime, after_id: Optional[str]) -> Tuple[dict, dict]:
+    """Document and tombstone filters resuming at ``since``, or strictly after (since, after_id)."""
+    moment = since.isoformat()
+    if after_id is None:
+        return {"updated_at": {"$gte": moment}}, {"deleted_at": {"$gte": since}}
+    return (
+        {"$or": [{"updated_at": {"$gt": moment}}, {"updated_at": moment, "id": {"$gt": after_id}}]},
+        {"$or": [{"deleted_at": {"$gt": since}}, {"deleted_at": since, "id": {"$gt": after_id}}]},
+    )
+
+async def fetch_delta(
+    collection: str, since: datetime, after_id: Optional[str] = None, limit: int = SYNC_PAGE_SIZE,
+) -> dict:
+    """Return documents changed and ids deleted since the cursor, oldest first.
+
+    Both are ordered by (timestamp, id). When either side fills a page, both are
+    cut at the earlier of the two last entries and the returned token resumes
+    strictly after it, so any number of records sharing a timestamp still page
+    through. Raises SyncTokenExpired for cursors older than tombstone retention.
+    """
+    if since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        raise SyncTokenExpired(f"Sync tokens expire after {TOMBSTONE_RETENTION_DAYS} days")
+    token = current_sync_token()
+    doc_query, tombstone_query = delta_queries(since, after_id)
+    docs = await db[collection].find(doc_query, {"_id": 0}).sort([("updated_at", 1), ("id", 1)]).to_list(limit)
+    tombstones = await db.tombstones.find(
+        {"collection": collection, **tombstone_query}, {"_id": 0}
+    ).sort([("deleted_at", 1), ("id", 1)]).to_list(limit)
+
+    def doc_key(doc: dict) -> Tuple[datetime, str]:
+        return parse_sync_moment(doc["updated_at"]), doc["id"]
+
+    def tombstone_key(tombstone: dict) -> Tuple[datetime, str]:
+        return tombstone["deleted_at"].replace(tzinfo=timezone.utc), tombstone["id"]
+
+    cutoffs = []
+    if len(docs) >= limit:
+        cutoffs.append(doc_key(docs[-1]))
+    if len(tombstones) >= limit:
+        cutoffs.append(tombstone_key(tombstones[-1]))
+    if cutoffs:
+        cutoff = min(cutoffs)
+        docs = [doc for doc in docs if doc_key(doc) <= cutoff]
+        tombstones = [t for t in tombstones if tombstone_key(t) <= cutoff]
+        token = encode_sync_token(*cutoff)
+
+    return {
+        "items": docs,
+        "deleted": [tombstone["id"] for tombstone in tombstones],
+        "sync_token": token,
+        "has_more": bool(cutoffs),
+    }
+
+@app.exception_handler(SyncTokenExpired)
+async def sync_token_expired_handler(request: Request, exc: SyncTokenExpired):
+    return JSONResponse({"detail": str(exc), "resync_required": True}, status_code=410)
+
+# Change events
+# "local" publishes from the write handlers of this process; "change_stream"
+# tails Mongo instead so every worker sees writes made by every other worker.
+EVENTS_SOURCE = os.environ.get('EVENTS_SOURCE', 'local')
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '256'))
+EVENTS_REPLAY_SIZE = int(os.environ.get('EVENTS_REPLAY_SIZE', '512'))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+
+class EventBroadcaster:
+    """Fan change events out to SSE subscribers through bounded per-client queues.
+
+    Event ids are ``<epoch>-<sequence>`` so a client reconnecting with a
+    Last-Event-ID from another process (or a restarted one) is told to resync
+    instead of silently missing events.
+    """
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, replay_size: int = EVENTS_REPLAY_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._sequence = 0
+        self._subscribers = set()
+        self._recent = deque(maxlen=replay_size)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_event_id:
+            for event in self._replay_since(last_event_id):
+                queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event_type: str, data: Optional[dict] = None) -> dict:
+        self._sequence += 1
+        event = {
+            "id": f"{self.epoch}-{self._sequence}",
+            "type": event_type,
+            "data": jsonable_encoder(data or {}),
+        }
+        self._recent.append(event)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A client this far behind is cheaper to resync than to catch up
+                self._drain(queue)
+                queue.put_nowait(self._resync_event())
+        return event
+
+    def _replay_since(self, last_event_id: str) -> List[dict]:
+        epoch, _, sequence = last_event_id.partition("-")
+        oldest = int(self._recent[0]["id"].split("-")[1]) if self._recent else self._sequence + 1
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) + 1 < oldest:
+            return [self._resync_event()]
+        replay = [event for event in self._recent if int(event["id"].split("-")[1]) > int(sequence)]
+        return replay[-self.queue_size:]
+
+    def _resync_event(self) -> dict:
+        return {"id": f"{self.epoch}-{self._sequence}", "type": "resync", "data": {}}
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+
+broadcaster = EventBroadcaster()
+
+def publish_event(event_type: str, data: Optional[dict] = None):
+    """Publish a change event from a write handler unless Mongo change streams are the source."""
+    if EVENTS_SOURCE == "local":
+        broadcaster.publish(event_type, data)
+
+def stock_event(product: dict) -> dict:
+    return {
+        "product_id": product.get("id"),
+        "variants": [
+            {"id": variant.get("id"), "stock_quantity": variant.get("stock_quantity")}
+            for variant in product.get("variants", [])
+        ],
+    }
+
+def order_status_event(order_id: str, status: str, tracking_number: Optional[str] = None) -> dict:
+    return {"id": order_id, "status": status, "tracking_number": tracking_number}
+
+def change_to_event(change: dict) -> Optional[Tuple[str, dict]]:
+    """Map a Mongo change stream document onto the same events the write handlers publish."""
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument") or {}
+    document.pop("_id", None)
+
+    if operation == "delete" or (operation in ("update", "replace") and not document):
+        # Only the ObjectId survives a delete, which clients cannot map to a record
+        return "resync", {"collection": collection}
+    if collection == "orders":
+        if operation == "insert":
+            return "order_created", document
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        if operation == "update" and "status" in updated:
+            return "order_status_changed", order_status_event(
+                document.get("id"), document.get("status"), document.get("tracking_number")
+            )
+        return "order_updated", document
+    if collection == "products":
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        if operation == "update" and all(key.startswith("variants") or key == "updated_at" for key in updated):
+            return "stock_changed", stock_event(document)
+        return "product_changed", document
+    if collection == "settings":
+        return "settings_changed", document
+    return None
+
+async def watch_change_streams():
+    """Feed the broadcaster from Mongo change streams (requires a replica set)."""
+    pipeline = [{"$match": {"ns.coll": {"$in": ["orders", "products", "settings"]}}}]
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    event = change_to_event(change)
+                    if event:
+                        broadcaster.publish(*event)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.warning("Change stream interrupted, retrying: %s", e)
+            broadcaster.publish("resync")
+            await asyncio.sleep(5)
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = ("text/html", "text/csv", "text/plain", "application/json", "application/javascript")
+
+# Uncompressed and compressed byte totals per encoding, read by the metrics endpoint
+compression_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"responses": 0, "bytes_in": 0, "bytes_out": 0})
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q-values."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    wildcard = weights.get("*", 0.0)
+    best = max(candidates, key=lambda name: (weights.get(name, wildcard), name == "br"))
+    return best if weights.get(best, wildcard) > 0 else None
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if final else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli for text responses, including streamed ones.
+
+    Body chunks are buffered until ``minimum_size`` bytes are seen, so short
+    responses go out untouched; after that every chunk is compressed and
+    flushed as it arrives, which keeps streamed exports incremental.
+    """
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        buffered = []
+        buffered_size = 0
+        compressor = None
+        passthrough = False
+        stats = compression_stats[encoding]
+
+        async def send_compressed(body: bytes, more_body: bool):
+            out = compressor.compress(body, final=not more_body)
+            stats["bytes_in"] += len(body)
+            stats["bytes_out"] += len(out)
+            await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        async def compressing_send(message):
+            nonlocal start_message, buffered_size, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES)
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                await send_compressed(body, more_body)
+                return
+
+            buffered.append(body)
+            buffered_size += len(body)
+            if more_body and buffered_size < self.minimum_size:
+                return
+            body = b"".join(buffered)
+            buffered.clear()
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body and len(body) < self.minimum_size:
+                start_message["headers"] = headers.raw
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+
+            compressor = _StreamCompressor(encoding)
+            stats["responses"] += 1
+            headers["Content-Encoding"] = encoding
+            start_message["headers"] = headers.raw
+            if more_body:
+                del headers["Content-Length"]
+                await send(start_message)
+                await send_compressed(body, more_body=True)
+            else:
+                out = compressor.compress(body, final=True)
+                stats["bytes_in"] += len(body)
+                stats["bytes_out"] += len(out)
+                headers["Content-Length"] = str(len(out))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": out, "more_body": False})
+
+        await self.app(scope, receive, compressing_send)
+
+class CompressionStatsCollector:
+    """Expose compression_stats as Prometheus counters plus an overall ratio."""
+    def collect(self):
+        responses = CounterMetricFamily(
+            "http_compressed_responses", "Responses compressed", labels=["encoding"])
+        bytes_in = CounterMetricFamily(
+            "http_compression_input_bytes", "Bytes before compression", labels=["encoding"])
+        bytes_out = CounterMetricFamily(
+            "http_compression_output_bytes", "Bytes after compression", labels=["encoding"])
+        ratio = GaugeMetricFamily(
+            "http_compression_ratio", "Uncompressed over compressed bytes", labels=["encoding"])
+        for encoding, stats in list(compression_stats.items()):
+            responses.add_metric([encoding], stats["responses"])
+            bytes_in.add_metric([encoding], stats["bytes_in"])
+            bytes_out.add_metric([encoding], stats["bytes_out"])
+            ratio.add_metric([encoding], stats["bytes_in"] / stats["bytes_out"] if stats["bytes_out"] else 0)
+        yield from (responses, bytes_in, bytes_out, ratio)
+
+REGISTRY.register(CompressionStatsCollector())
+
+def resolve_route_template(scope) -> str:
+    """Find the path template a request will be routed to, keeping label cardinality bounded."""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+class MetricsMiddleware:
+    """Per-route latency, in-flight and response size metrics for every HTTP request."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = resolve_route_template(scope)
+        context = RequestContext(route)
+        token = current_request.set(context)
+        status = 500
+        size = 0
+
+        async def measuring_send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = http_requests_in_flight.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, measuring_send)
+        finally:
+            in_flight.dec()
+            http_request_duration.labels(method, route, str(status)).observe(time.perf_counter() - started)
+            http_response_size.labels(method, route).observe(size)
+            mongo_commands_per_request.labels(route).observe(context.mongo_commands)
+            current_request.reset(token)
+
+# Admission control
+# Requests are admitted through two lanes. Interactive POS routes get a large
+# lane; reports, exports and imports share a small one, and while interactive
+# requests are queued no new heavy request starts. When a lane is full and its
+# queue is too, or a request waits longer than the lane's queue timeout, the
+# request is turned away with 429 and Retry-After instead of piling onto the
+# event loop and the Mongo pool.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_INTERACTIVE_LIMIT = int(os.environ.get('ADMISSION_INTERACTIVE_LIMIT', '64'))
+ADMISSION_INTERACTIVE_QUEUE = int(os.environ.get('ADMISSION_INTERACTIVE_QUEUE', '256'))
+ADMISSION_INTERACTIVE_TIMEOUT = float(os.environ.get('ADMISSION_INTERACTIVE_TIMEOUT', '2'))
+ADMISSION_HEAVY_LIMIT = int(os.environ.get('ADMISSION_HEAVY_LIMIT', '2'))
+ADMISSION_HEAVY_QUEUE = int(os.environ.get('ADMISSION_HEAVY_QUEUE', '4'))
+ADMISSION_HEAVY_TIMEOUT = float(os.environ.get('ADMISSION_HEAVY_TIMEOUT', '10'))
+HEAVY_ROUTES = {
+    ("GET", "/api/finance/daily-sales"),
+    ("GET", "/api/finance/profit-loss"),
+    ("GET", "/api/finance/export"),
+    ("GET", "/api/analytics/sales"),
+    ("GET", "/api/inventory/valuation"),
+    ("POST", "/api/orders/export-csv"),
+    ("POST", "/api/orders/bulk-labels"),
+    ("POST", "/api/products/import"),
+    ("POST", "/api/customers/import"),
+}
+# Long-lived streams would hold a slot for their whole lifetime
+ADMISSION_EXEMPT_ROUTES = {"/api/events"}
+
+admission_rejections = Counter(
+    "admission_rejections_total", "Requests turned away with 429 by lane and reason", ["lane", "reason"],
+)
+admission_wait = Histogram(
+    "admission_wait_seconds", "Time admitted requests spent queued", ["lane"], buckets=HTTP_LATENCY_BUCKETS,
+)
+
+class AdmissionLane:
+    """A concurrency limit with a bounded FIFO queue of waiting requests."""
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float, retry_after: int,
+                 yields_to: Optional["AdmissionLane"] = None):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.yields_to = yields_to
+        self.active = 0
+        self._waiters: deque = deque()
+        self._dependents: List["AdmissionLane"] = []
+        if yields_to:
+            yields_to._dependents.append(self)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _can_start(self) -> bool:
+        return self.active < self.limit and not (self.yields_to and self.yields_to.queued)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, queueing if needed. Returns the rejection reason when turned away."""
+        if not self._waiters and self._can_start():
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+        # Plain futures rather than asyncio.Condition, which binds to the first loop that uses it
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+        # A slot can be handed over just as the timeout fires
+        if not self._abandon(waiter):
+            return "timeout"
+        admission_wait.labels(self.name).observe(time.perf_counter() - started)
+        return None
+
+    def _abandon(self, waiter: asyncio.Future) -> bool:
+        """Stop waiting on ``waiter``; returns whether it had already been given a slot."""
+        granted = waiter.done() and not waiter.cancelled()
+        if not waiter.done():
+            waiter.cancel()
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self._wake_dependents()
+        return granted
+
+    def release(self):
+        self.active -= 1
+        self._admit_waiters()
+
+    def _admit_waiters(self):
+        admitted = False
+        while self._waiters and self._can_start():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.active += 1
+            waiter.set_result(None)
+            admitted = True
+        if admitted:
+            self._wake_dependents()
+
+    def _wake_dependents(self):
+        if not self._waiters:
+            for lane in self._dependents:
+                lane._admit_waiters()
+
+    def status(self) -> dict:
+        return {"active": self.active, "limit": self.limit, "queued": self.queued, "queue_size": self.queue_size}
+
+interactive_lane = AdmissionLane(
+    "interactive", ADMISSION_INTERACTIVE_LIMIT, ADMISSION_INTERACTIVE_QUEUE, ADMISSION_INTERACTIVE_TIMEOUT, 1,
+)
+heavy_lane = AdmissionLane(
+    "heavy", ADMISSION_HEAVY_LIMIT, ADMISSION_HEAVY_QUEUE, ADMISSION_HEAVY_TIMEOUT, 5, yields_to=interactive_lane,
+)
+ADMISSION_LANES = (interactive_lane, heavy_lane)
+
+def admission_lane(method: str, route: str) -> Optional[AdmissionLane]:
+    if not route.startswith("/api/") or route in ADMISSION_EXEMPT_ROUTES:
+        return None
+    return heavy_lane if (method, route) in HEAVY_ROUTES else interactive_lane
+
+def admission_status() -> dict:
+    return {lane.name: lane.status() for lane in ADMISSION_LANES}
+
+class AdmissionCollector:
+    """Expose active and queued requests per admission lane."""
+    def collect(self):
+        active = GaugeMetricFamily("admission_active_requests", "Requests holding an admission slot", labels=["lane"])
+        queued = GaugeMetricFamily("admission_queued_requests", "Requests waiting for an admission slot", labels=["lane"])
+        for lane in ADMISSION_LANES:
+            active.add_metric([lane.name], lane.active)
+            queued.add_metric([lane.name], lane.queued)
+        yield from (active, queued)
+
+REGISTRY.register(AdmissionCollector())
+
+class AdmissionMiddleware:
+    """Hold each API request until its lane admits it, or answer 429 when the lane is saturated."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        lane = None
+        if scope["type"] == "http" and ADMISSION_ENABLED:
+            context = current_request.get()
+            lane = admission_lane(scope["method"], context.route if context else resolve_route_template(scope))
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason = await lane.acquire()
+        if reason:
+            admission_rejections.labels(lane.name, reason).inc()
+            response = JSONResponse(
+                {"detail": f"Server is busy ({lane.name} requests); retry shortly"},
+                status_code=429, headers={"Retry-After": str(lane.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+
+# Bulk import helpers
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ("csv", "ndjson")
+DUPLICATE_KEY_ERROR = 11000
+SKU_INDEX = "variants.sku_1"
+
+PRODUCT_IMPORT_FIELDS = ("description", "category", "low_stock_threshold")
+VARIANT_IMPORT_FIELDS = ("id", "size", "color", "sku", "stock_quantity", "price", "buy_price", "purchase_date")
+
+ImportRow = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+def detect_import_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """Pick the import format from an explicit value or the file extension."""
+    if not fmt and filename:
+        suffix = Path(filename).suffix.lower().lstrip(".")
+        fmt = {"jsonl": "ndjson", "json": "ndjson"}.get(suffix, suffix)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt or 'unknown'} (expected csv or ndjson)")
+    return fmt
+
+def iter_import_rows(stream: Iterable[str], fmt: str) -> Iterator[ImportRow]:
+    """Yield (row_number, row, error) from a CSV or NDJSON text stream one row at a time.
+
+    NDJSON lines may either be flat rows or whole documents with a ``variants``
+    list, which are expanded into one row per variant.
+    """
+    if fmt == "csv":
+        # Row 1 is the header
+        for row_number, row in enumerate(csv.DictReader(stream), start=2):
+            yield row_number, {
+                key.strip(): value.strip() if isinstance(value, str) else value
+                for key, value in row.items() if key
+            }, None
+        return
+
+    for row_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            doc = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(doc, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        variants = doc.pop("variants", None)
+        if isinstance(variants, list):
+            for variant in variants:
+                if isinstance(variant, dict):
+                    yield row_number, {**doc, **variant}, None
+                else:
+                    yield row_number, None, "Variant must be a JSON object"
+        else:
+            yield row_number, doc, None
+
+def format_import_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+        )
+    return str(error)
+
+def record_import_error(summary: dict, row_number: int, message: str):
+    summary["error_count"] += 1
+    if len(summary["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        summary["errors"].append({"row": row_number, "error": message})
+
+def _present_fields(row: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    return {field: row[field] for field in fields if row.get(field) not in (None, "")}
+
+def parse_product_import_row(row: Dict[str, Any]) -> Tuple[str, Dict[str, Any], ProductVariant]:
+    """Split a flat import row into product name, product-level fields and a validated variant."""
+    name = row.get("product_name") or row.get("name")
+    if not name:
+        raise ValueError("product_name: Field required")
+    product_fields = _present_fields(row, PRODUCT_IMPORT_FIELDS)
+    for field, value in (("product_name", name), *product_fields.items()):
+        if field != "low_stock_threshold" and not isinstance(value, str):
+            raise TypeError(f"{field}: Expected a string")
+    if "low_stock_threshold" in product_fields:
+        try:
+            product_fields["low_stock_threshold"] = int(product_fields["low_stock_threshold"])
+        except (TypeError, ValueError):
+            raise ValueError("low_stock_threshold: Expected an integer")
+    variant = ProductVariant(**_present_fields(row, VARIANT_IMPORT_FIELDS))
+    return str(name).strip(), product_fields, variant
+
+async def ensure_unique_index(collection: str, key: str, **options):
+    """Make the index on ``key`` unique, replacing the plain one older databases have.
+
+    If stored documents already share a value the plain index is kept and a
+    warning names the problem, so old data never stops startup.
+    """
+    name = f"{key}_1"
+    existing = (await db[collection].index_information()).get(name)
+    if existing and existing.get("unique"):
+        return
+    if existing:
+        await db[collection].drop_index(name)
+    try:
+        await db[collection].create_index(key, name=name, unique=True, **options)
+    except OperationFailure as e:
+        logger.warning("Duplicate %s.%s values, not enforcing uniqueness until they are fixed: %s", collection, key, e)
+        await db[collection].create_index(key, name=name)
+
+async def ensure_unique_sku_index():
+    # Products without variants are left out of it
+    await ensure_unique_index(
+        "products", "variants.sku", partialFilterExpression={"variants.sku": {"$exists": True}},
+    )
+
+async def _flush_product_import_batch(groups: Dict[str, dict], summary: dict, retry_duplicates: bool = True):
+    """Upsert one batch of grouped variants keyed by SKU with a single bulk_write.
+
+    Counters are added as operations are built and taken back for any write
+    that fails, whose source rows are reported as row errors instead. SKUs
+    are unique across products, so a write that lost a race with another
+    import or an API create fails with a duplicate key; its rows are looked
+    up again and written once more against the product that now owns them.
+    """
+    skus = [sku for group in groups.values() for sku in group["variants"]]
+    sku_owner: Dict[str, str] = {}
+    name_owner: Dict[str, str] = {}
+    async for doc in db.products.find(
+        {"$or": [{"variants.sku": {"$in": skus}}, {"name": {"$in": list(groups)}}]},
+        {"_id": 0, "id": 1, "name": 1, "variants.sku": 1},
+    ):
+        name_owner.setdefault(doc["name"], doc["id"])
+        for variant in doc.get("variants", []):
+            sku_owner[variant["sku"]] = doc["id"]
+
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    # Parallel to operations: the group and source rows each write carries, and what it added to the summary
+    outcomes: List[Tuple[str, List[Tuple[int, ProductVariant]], Dict[str, int]]] = []
+    # Indexes of the writes to each updated product; it only counts as updated if one succeeds
+    updated_products: List[List[int]] = []
+
+    def add(operation, name: str, entries: List[Tuple[int, ProductVariant]], **counts: int):
+        operations.append(operation)
+        outcomes.append((name, entries, counts))
+        for key, count in counts.items():
+            summary[key] += count
+
+    for name, group in groups.items():
+        entries = list(group["variants"].values())
+        variants = [variant for _, variant in entries]
+        product_id = next((sku_owner[v.sku] for v in variants if v.sku in sku_owner), name_owner.get(name))
+
+        if product_id is None:
+            product = Product(
+                name=name,
+                description=group["fields"].get("description", ""),
+                category=group["fields"].get("category", ""),
+                low_stock_threshold=group["fields"].get("low_stock_threshold", 5),
+                variants=variants,
+            )
+            add(
+                InsertOne(prepare_for_mongo(product.dict())), name, entries,
+                products_created=1, variants_inserted=len(variants),
+            )
+            continue
+
+        product_set = {**group["fields"], "updated_at": now}
+        existing_by_owner = defaultdict(list)
+        new_entries = []
+        for row_number, variant in entries:
+            if variant.sku in sku_owner:
+                existing_by_owner[sku_owner[variant.sku]].append((row_number, variant))
+            else:
+                new_entries.append((row_number, variant))
+
+        own_writes = []
+        for owner_id, owned in existing_by_owner.items():
+            update = dict(product_set) if owner_id == product_id else {"updated_at": now}
+            array_filters = []
+            for i, (_, variant) in enumerate(owned):
+                # Keep the stored variant id so existing orders still resolve
+                changes = prepare_for_mongo(variant.dict(exclude_unset=True, exclude={"id"}))
+                for field, value in changes.items():
+                    update[f"variants.$[v{i}].{field}"] = value
+                array_filters.append({f"v{i}.sku": variant.sku})
+            if owner_id == product_id:
+                own_writes.append(len(operations))
+            add(
+                UpdateOne({"id": owner_id}, {"$set": update}, array_filters=array_filters),
+                name, owned, variants_updated=len(owned),
+            )
+
+        if new_entries:
+            own_writes.append(len(operations))
+            add(
+                UpdateOne(
+                    {"id": product_id},
+                    {
+                        "$push": {"variants": {"$each": [prepare_for_mongo(v.dict()) for _, v in new_entries]}},
+                        "$set": product_set,
+                    },
+                ),
+                name, new_entries, variants_inserted=len(new_entries),
+            )
+        updated_products.append(own_writes)
+        summary["products_updated"] += 1
+
+    if not operations:
+        return
+    try:
+        await db.products.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        failed = set()
+        retry: Dict[str, dict] = {}
+        for write_error in e.details.get("writeErrors", []):
+            failed.add(write_error["index"])
+            name, entries, counts = outcomes[write_error["index"]]
+            for key, count in counts.items():
+                summary[key] -= count
+            if retry_duplicates and write_error.get("code") == DUPLICATE_KEY_ERROR:
+                group = retry.setdefault(name, {"fields": groups[name]["fields"], "variants": {}})
+                group["variants"].update((variant.sku, (row, variant)) for row, variant in entries)
+                continue
+            for row_number, _ in entries:
+                record_import_error(summary, row_number, write_error.get("errmsg", "Write failed"))
+        summary["products_updated"] -= sum(1 for writes in updated_products if failed.issuperset(writes))
+        if retry:
+            await _flush_product_import_batch(retry, summary, retry_duplicates=False)
+
+CUSTOMER_IMPORT_FIELDS = ("name", "email", "phone", "phone_2", "address", "city", "postal_code")
+
+def parse_customer_import_row(row: Dict[str, Any]) -> Customer:
+    """Validate an import row into a Customer with a normalized phone."""
+    fields = _present_fields(row, CUSTOMER_IMPORT_FIELDS)
+    customer = Customer(**{field: str(value).strip() for field, value in fields.items()})
+    customer.phone_normalized = normalize_phone(customer.phone)
+    if not customer.phone_normalized:
+        raise ValueError(f"phone: Cannot normalize phone number '{customer.phone}'")
+    return customer
+
+CUSTOMER_PHONE_BACKFILL_MARKER = "customer_phones_backfilled"
+
+async def backfill_customer_phones():
+    """Populate phone_normalized on customers created before it was maintained.
+
+    Runs once per database: phones that cannot be normalized are stored as
+    null like they are on create, and a settings marker records the backfill
+    so later startups skip the scan.
+    """
+    if await db.settings.find_one({"id": CUSTOMER_PHONE_BACKFILL_MARKER}, {"_id": 1}):
+        return
+    operations = []
+    async for doc in db.customers.find(
+        {"phone_normalized": {"$exists": False}}, {"_id": 0, "id": 1, "phone": 1}
+    ):
+        operations.append(UpdateOne(
+            {"id": doc["id"]}, {"$set": {"phone_normalized": normalize_phone(doc.get("phone"))}}
+        ))
+        if len(operations) >= IMPORT_BATCH_SIZE:
+            await db.customers.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.customers.bulk_write(operations, ordered=False)
+    await db.settings.update_one(
+        {"id": CUSTOMER_PHONE_BACKFILL_MARKER},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+    )
+
+async def _flush_customer_import_batch(batch: Dict[str, Tuple[List[int], Customer]], summary: dict):
+    """Insert new customers and merge rows into existing ones matched by normalized phone.
+
+    Every row in the batch is counted once, from the outcome of its write:
+    as inserted or merged if it succeeded, as rejected if it failed.
+    """
+    existing = {}
+    async for doc in db.customers.find(
+        {"phone_normalized": {"$in": list(batch)}}, {"_id": 0, "id": 1, "phone_normalized": 1}
+    ):
+        existing.setdefault(doc["phone_normalized"], doc["id"])
+
+    operations = []
+    # Parallel to operations: the source rows each write carries and what they count as
+    outcomes: List[Tuple[List[int], Dict[str, int]]] = []
+    inserted_ids: List[Optional[str]] = []
+    for phone, (rows, customer) in batch.items():
+        if phone in existing:
+            # Only overwrite with values the row actually carries
+            changes = {
+                field: value
+                for field, value in customer.dict(include=set(CUSTOMER_IMPORT_FIELDS)).items()
+                if value not in (None, "")
+            }
+            changes["updated_at"] = datetime.now(timezone.utc).isoformat()
+            operations.append(UpdateOne({"id": existing[phone]}, {"$set": changes}))
+            outcomes.append((rows, {"merged": len(rows)}))
+            inserted_ids.append(None)
+        else:
+            operations.append(InsertOne(prepare_for_mongo(customer.dict())))
+            # Later rows with the same phone were merged into this one before writing
+            outcomes.append((rows, {"inserted": 1, "merged": len(rows) - 1}))
+            inserted_ids.append(customer.id)
+
+    failed = set()
+    try:
+        await db.customers.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            failed.add(write_error["index"])
+            for row_number in outcomes[write_error["index"]][0]:
+                record_import_error(summary, row_number, write_error.get("errmsg", "Write failed"))
+    for index, (rows, counts) in enumerate(outcomes):
+        if index in failed:
+            summary["rejected"] += len(rows)
+        else:
+            for key, count in counts.items():
+                summary[key] += count
+    await ensure_customer_stats(
+        customer_id for index, customer_id in enumerate(inserted_ids) if customer_id and index not in failed
+    )
+
+async def import_customers(rows: Iterable[ImportRow], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Stream import rows into customers, de-duplicating on normalized phone.
+
+    Duplicates inside one batch are merged before writing; duplicates across
+    batches or against stored customers are matched through the phone index.
+    """
+    summary = {"rows": 0, "inserted": 0, "merged": 0, "rejected": 0, "error_count": 0, "errors": []}
+    batch: Dict[str, Tuple[List[int], Customer]] = {}
+
+    for row_number, row, error in rows:
+        summary["rows"] += 1
+        if error is None:
+            try:
+                customer = parse_customer_import_row(row)
+            except (ValueError, TypeError, ValidationError) as e:
+                error = format_import_error(e)
+        if error is not None:
+            record_import_error(summary, row_number, error)
+            summary["rejected"] += 1
+            continue
+
+        if customer.phone_normalized in batch:
+            batch_rows, first = batch[customer.phone_normalized]
+            merged = first.dict()
+            merged.update({
+                field: value
+                for field, value in customer.dict(include=set(CUSTOMER_IMPORT_FIELDS)).items()
+                if value not in (None, "")
+            })
+            batch[customer.phone_normalized] = (batch_rows + [row_number], Customer(**merged))
+            continue
+
+        batch[customer.phone_normalized] = ([row_number], customer)
+        if len(batch) >= batch_size:
+            await _flush_customer_import_batch(batch, summary)
+            batch = {}
+
+    if batch:
+        await _flush_customer_import_batch(batch, summary)
+    return summary
+
+async def import_products(rows: Iterable[ImportRow], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Stream import rows into products, grouping variants by product name.
+
+    Memory stays bounded by ``batch_size``: a product whose rows span batches is
+    simply found again by name or SKU on the next flush.
+    """
+    summary = {
+        "rows": 0,
+        "products_created": 0,
+        "products_updated": 0,
+        "variants_inserted": 0,
+        "variants_updated": 0,
+        "error_count": 0,
+        "errors": [],
+    }
+    groups: Dict[str, dict] = {}
+    # SKU -> row it came from, for the batch being built
+    batch_skus: Dict[str, int] = {}
+
+    for row_number, row, error in rows:
+        summary["rows"] += 1
+        if error is None:
+            try:
+                name, product_fields, variant = parse_product_import_row(row)
+            except (ValueError, TypeError, ValidationError) as e:
+                error = format_import_error(e)
+            else:
+                if variant.sku in batch_skus:
+                    error = f"sku: Duplicate SKU '{variant.sku}', already imported from row {batch_skus[variant.sku]}"
+        if error is not None:
+            record_import_error(summary, row_number, error)
+            continue
+
+        group = groups.setdefault(name, {"fields": {}, "variants": {}})
+        group["fields"].update(product_fields)
+        group["variants"][variant.sku] = (row_number, variant)
+        batch_skus[variant.sku] = row_number
+        if len(batch_skus) >= batch_size:
+            await _flush_product_import_batch(groups, summary)
+            groups, batch_skus = {}, {}
+
+    if groups:
+        await _flush_product_import_batch(groups, summary)
+    return summary
+
+# Catalog snapshot
+# Order entry, low-stock and finance read products far more often than they
+# change, so each worker keeps them in memory. Writes through this process are
+# applied immediately; writes by other workers or straight to Mongo arrive on
+# the next delta refresh. Stock is only ever changed with $inc in Mongo; the
+# snapshot's copy is for display and alerts, never for deciding a write.
+CATALOG_REFRESH_SECONDS = float(os.environ.get('CATALOG_REFRESH_SECONDS', '5'))
+
+class CatalogSnapshot:
+    """Products by id and variants by id, with a version bumped on every change."""
+    def __init__(self):
+        self.products: Dict[str, Product] = {}
+        self.variants: Dict[str, Tuple[Product, ProductVariant]] = {}
+        self.version = 0
+        self.sync_token: Optional[str] = None
+        self.refreshed_at: Optional[datetime] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.sync_token is not None
+
+    def apply_product(self, product: Union[Product, dict]):
+        if isinstance(product, dict):
+            product = Product(**parse_from_mongo(product))
+        previous = self.products.get(product.id)
+        if previous is not None:
+            for variant in previous.variants:
+                self.variants.pop(variant.id, None)
+        self.products[product.id] = product
+        for variant in product.variants:
+            self.variants[variant.id] = (product, variant)
+        self.version += 1
+
+    def remove_product(self, product_id: str):
+        product = self.products.pop(product_id, None)
+        if product is not None:
+            for variant in product.variants:
+                self.variants.pop(variant.id, None)
+            self.version += 1
+
+    def apply_stock(self, product: dict):
+        """Take stock levels from a partial product as re-read after a stock write."""
+        for variant in product.get("variants", []):
+            cached = self.variant(product["id"], variant.get("id"))
+            if cached is not None:
+                cached.stock_quantity = variant["stock_quantity"]
+        self.version += 1
+
+    def variant(self, product_id: str, variant_id: str) -> Optional[ProductVariant]:
+        entry = self.variants.get(variant_id)
+        return entry[1] if entry is not None and entry[0].id == product_id else None
+
+    async def load(self):
+        """Replace the snapshot with every product currently in Mongo."""
+        token = current_sync_token()
+        products = {}
+        variants = {}
+        async for doc in db.products.find({}, {"_id": 0}):
+            product = Product(**parse_from_mongo(doc))
+            products[product.id] = product
+            for variant in product.variants:
+                variants[variant.id] = (product, variant)
+        self.products, self.variants = products, variants
+        self.sync_token = token
+        self.refreshed_at = datetime.now(timezone.utc)
+        self.version += 1
+
+    async def refresh(self):
+        """Apply product changes and deletions made since the last load or refresh."""
+        if not self.loaded:
+            await self.load()
+            return
+        has_more = True
+        while has_more:
+            try:
+                delta = await fetch_delta("products", *parse_sync_token(self.sync_token))
+            except SyncTokenExpired:
+                # Deletions older than tombstone retention are gone; start over from a full load
+                await self.load()
+                return
+            for doc in delta["items"]:
+                self.apply_product(doc)
+            for product_id in delta["deleted"]:
+                self.remove_product(product_id)
+            self.sync_token = delta["sync_token"]
+            has_more = delta["has_more"]
+        self.refreshed_at = datetime.now(timezone.utc)
+
+    async def fetch_products(self, product_ids: Iterable[str]):
+        product_ids = list(product_ids)
+        if product_ids:
+            async for doc in db.products.find({"id": {"$in": product_ids}}, {"_id": 0}):
+                self.apply_product(doc)
+
+    async def ensure_variants(self, items: Iterable[OrderItem]):
+        """Fetch products whose variants are not in the snapshot yet, e.g. written by another worker."""
+        await self.fetch_products(
+            {item.product_id for item in items if self.variant(item.product_id, item.variant_id) is None}
+        )
+
+    def status(self) -> dict:
+        return {
+            "version": self.version,
+            "products": len(self.products),
+            "variants": len(self.variants),
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+        }
+
+catalog = CatalogSnapshot()
+
+async def refresh_catalog_periodically():
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+        try:
+            await catalog.refresh()
+        except PyMongoError as e:
+            logger.warning("Catalog refresh failed, keeping version %s: %s", catalog.version, e)
+
+# Order helpers
+async def ensure_order_counter():
+    """Seed the order number counter from the existing orders the first time it is needed."""
+    if await db.counters.find_one({"_id": "order_number"}) is None:
+        existing = await db.orders.count_documents({}) + await db[ORDERS_ARCHIVE].count_documents({})
+        try:
+            await db.counters.insert_one({"_id": "order_number", "seq": existing})
+        except DuplicateKeyError:
+            pass
+
+async def next_order_number() -> str:
+    """Allocate the next order number atomically; counting orders raced and scanned the collection."""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "order_number"}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        await ensure_order_counter()
+        counter = await db.counters.find_one_and_update(
+            {"_id": "order_number"}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+        )
+    return f"ORD-{counter['seq']:06d}"
+
+async def adjust_stock(items: List[OrderItem], direction: int):
+    """Apply ``direction * quantity`` to each item's variant stock in one bulk write.
+
+    Stock is changed with $inc on the matching array element, so concurrent
+    orders for the same product cannot overwrite each other's decrements.
+    """
+    if not items:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    operations = [
+        UpdateOne(
+            {"id": item.product_id, "variants.id": item.variant_id},
+            {"$inc": {"variants.$.stock_quantity": direction * item.quantity}, "$set": {"updated_at": now}},
+        )
+        for item in items
+    ]
+    await db.products.bulk_write(operations, ordered=False)
+    product_ids = list({item.product_id for item in items})
+    async for product in db.products.find(
+        {"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "variants.id": 1, "variants.stock_quantity": 1}
+    ):
+        catalog.apply_stock(product)
+        publish_event("stock_changed", stock_event(product))
+
+async def fetch_orders_by_ids(order_ids: List[str]) -> List[Optional[dict]]:
+    """Load orders with a single $in query, returned in the requested order (None if missing).
+
+    Ids not found among hot orders are looked up in the archive with one more query.
+    """
+    wanted = list(set(order_ids))
+    found = {order["id"]: order async for order in db.orders.find({"id": {"$in": wanted}}, {"_id": 0})}
+    missing = [order_id for order_id in wanted if order_id not in found]
+    if missing:
+        async for order in db[ORDERS_ARCHIVE].find({"id": {"$in": missing}}, {"_id": 0}):
+            found[order["id"]] = order
+    return [found.get(order_id) for order_id in order_ids]
+
+def render_shipping_label(order_obj: Order, settings_obj: BusinessSettings) -> str:
+    order_items_html = "<ul>"
+    for item in order_obj.items:
+        order_items_html += f"<li>{item.product_name} ({item.size}, {item.color}) x{item.quantity}</li>"
+    order_items_html += "</ul>"
+    
+    html_content = settings_obj.shipping_label_template
+    html_content = html_content.replace("{{business_name}}", settings_obj.business_name or "")
+    html_content = html_content.replace("{{business_address}}", settings_obj.address or "")
+    html_content = html_content.replace("{{business_phone}}", settings_obj.phone or "")
+    html_content = html_content.replace("{{customer_name}}", order_obj.customer_name or "")
+    html_content = html_content.replace("{{customer_address}}", order_obj.customer_address or "")
+    html_content = html_content.replace("{{customer_phone}}", order_obj.customer_phone or "")
+    html_content = html_content.replace("{{order_number}}", order_obj.order_number or "TBD")
+    html_content = html_content.replace("{{tracking_number}}", order_obj.tracking_number or "TBD")
+    html_content = html_content.replace("{{order_date}}", order_obj.created_at.strftime("%Y-%m-%d") if order_obj.created_at else "")
+    html_content = html_content.replace("{{order_items}}", order_items_html)
+    html_content = html_content.replace("{{total_amount}}", f"{order_obj.total_amount:.2f}" if order_obj.total_amount else "0.00")
+    return html_content
+
+ORDERS_CSV_HEADERS = [
+    "Waybill Number", "Order Number", "Customer Name", "Address",
+    "Order Description", "Customer First Phone No", "Customer Second Phone No",
+    "COD Amount", "City", "Remarks"
+]
+
+def order_csv_row(order_obj: Order) -> list:
+    # Create order description from items
+    order_description = "; ".join([
+        f"{item.product_name} ({item.size}, {item.color}) x{item.quantity}"
+        for item in order_obj.items
+    ])
+
+    # Extract city from address
+    address_parts = order_obj.customer_address.split(", ")
+    city = address_parts[-2] if len(address_parts) >= 2 else order_obj.customer_city if hasattr(order_obj, 'customer_city') else ""
+
+    return [
+        order_obj.tracking_number or "",
+        order_obj.order_number or "",
+        order_obj.customer_name or "",
+        order_obj.customer_address or "",
+        order_description,
+        order_obj.customer_phone or "",
+        order_obj.customer_phone_2 or "",
+        order_obj.cod_amount or order_obj.total_amount,
+        city,
+        order_obj.remarks or ""
+    ]
+
+def render_orders_csv(orders: List[Optional[dict]], header: bool = True) -> str:
+    """CSV courier sheet for raw order documents; missing (None) orders are skipped."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if header:
+        writer.writerow(ORDERS_CSV_HEADERS)
+    for order in orders:
+        if order:
+            writer.writerow(order_csv_row(Order(**parse_from_mongo(order))))
+    return output.getvalue()
+
+# Label cache
+# Rendered labels are keyed by a hash of exactly the order and settings fields
+# a label shows, so any change to an input is a different key and no worker
+# can serve a stale label. Recently used labels stay in memory up to
+# LABEL_CACHE_MAX_BYTES and evicted ones spill to LABEL_CACHE_DIR. Order and
+# settings writes also drop superseded entries so they stop taking up space.
+LABEL_CACHE_MAX_BYTES = int(os.environ.get('LABEL_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+LABEL_CACHE_DIR = Path(os.environ.get('LABEL_CACHE_DIR', str(Path(tempfile.gettempdir()) / "pos_label_cache")))
+LABEL_CACHE_DISK_MAX_BYTES = int(os.environ.get('LABEL_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+LABEL_ORDER_FIELDS = (
+    "customer_name", "customer_address", "customer_phone", "order_number", "tracking_number",
+    "created_at", "total_amount",
+)
+LABEL_ITEM_FIELDS = ("product_name", "size", "color", "quantity")
+LABEL_SETTINGS_FIELDS = ("business_name", "address", "phone", "shipping_label_template")
+LABEL_PAGE_BREAK = '<div style="page-break-after: always;"></div>'
+
+def label_settings_version(settings: dict) -> str:
+    settings_obj = BusinessSettings(**settings)
+    content = [getattr(settings_obj, field) for field in LABEL_SETTINGS_FIELDS]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+def label_key(order: dict, settings_version: str) -> str:
+    content = [
+        settings_version,
+        [order.get(field) for field in LABEL_ORDER_FIELDS],
+        [[item.get(field) for field in LABEL_ITEM_FIELDS] for item in order.get("items", [])],
+    ]
+    return hashlib.sha256(json.dumps(content, default=str).encode()).hexdigest()
+
+def render_label_fragments(orders: List[dict], settings: dict) -> List[str]:
+    """One rendered label per raw order document."""
+    settings_obj = BusinessSettings(**settings)
+    return [render_shipping_label(Order(**parse_from_mongo(order)), settings_obj) for order in orders]
+
+class LabelCache:
+    """LRU of rendered labels in memory, spilling evicted labels to files named by their key.
+
+    Files are read, written and pruned on one worker thread, so the event loop
+    never waits on the disk and file operations keep their order. Each order's
+    current key is only remembered while its label is cached somewhere.
+    """
+    def __init__(self, max_bytes: int, directory: Path, disk_max_bytes: int):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._order_keys: Dict[str, str] = {}
+        self._key_orders: Dict[str, str] = {}
+        self._spilled_since_prune = 0
+        self._executor = None
+
+    async def get(self, key: str) -> Optional[str]:
+        html = self._entries.get(key)
+        if html is not None:
+            self._entries.move_to_end(key)
+            label_cache_lookups.labels("memory").inc()
+            return html
+        html = await self._run(self._read, key)
+        if html is None:
+            label_cache_lookups.labels("miss").inc()
+            return None
+        label_cache_lookups.labels("disk").inc()
+        await self._remember(key, html)
+        return html
+
+    async def put(self, order_id: str, key: str, html: str):
+        previous = self._order_keys.get(order_id)
+        if previous and previous != key:
+            await self._drop(previous)
+        self._order_keys[order_id] = key
+        self._key_orders[key] = order_id
+        await self._remember(key, html)
+
+    async def forget_order(self, order_id: str):
+        key = self._order_keys.get(order_id)
+        if key:
+            await self._drop(key)
+
+    async def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._order_keys.clear()
+        self._key_orders.clear()
+        await self._run(self._remove_files)
+
+    def status(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "orders": len(self._order_keys)}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.html"
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="label-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _forget_key(self, key: str):
+        order_id = self._key_orders.pop(key, None)
+        if order_id is not None and self._order_keys.get(order_id) == key:
+            del self._order_keys[order_id]
+
+    async def _remember(self, key: str, html: str):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = html
+        self._bytes += len(html)
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            evicted_key, evicted_html = self._entries.popitem(last=False)
+            self._bytes -= len(evicted_html)
+            evicted.append((evicted_key, evicted_html))
+        if evicted:
+            for lost in await self._run(self._spill, evicted):
+                if lost not in self._entries:
+                    self._forget_key(lost)
+
+    async def _drop(self, key: str):
+        html = self._entries.pop(key, None)
+        if html is not None:
+            self._bytes -= len(html)
+        self._forget_key(key)
+        await self._run(self._path(key).unlink, True)
+
+    def _read(self, key: str) -> Optional[str]:
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def _spill(self, labels: List[Tuple[str, str]]) -> List[str]:
+        """Write evicted labels to disk, returning the keys that are no longer stored there."""
+        lost = []
+        for key, html in labels:
+            path = self._path(key)
+            if path.exists():
+                continue
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                path.write_text(html, encoding="utf-8")
+            except OSError as e:
+                logger.warning("Could not spill label %s to disk: %s", key, e)
+                lost.append(key)
+                continue
+            self._spilled_since_prune += len(html)
+        if self._spilled_since_prune >= self.disk_max_bytes // 10:
+            lost.extend(self._prune_disk())
+        return lost
+
+    def _prune_disk(self) -> List[str]:
+        self._spilled_since_prune = 0
+        files = []
+        for path in self.directory.glob("*.html"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        pruned = []
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            pruned.append(path.stem)
+            total -= size
+        return pruned
+
+    def _remove_files(self):
+        for path in self.directory.glob("*.html"):
+            path.unlink(missing_ok=True)
+
+label_cache = LabelCache(LABEL_CACHE_MAX_BYTES, LABEL_CACHE_DIR, LABEL_CACHE_DISK_MAX_BYTES)
+
+async def cached_label_fragments(orders: List[Optional[dict]], settings: dict, render=None) -> List[str]:
+    """Labels for the orders that exist, rendering only cache misses.
+
+    ``render(orders, settings)`` returns an awaitable list of labels for the
+    misses; by default they are rendered in-process.
+    """
+    version = label_settings_version(settings)
+    keyed = [(order, label_key(order, version)) for order in orders if order]
+    fragments = {key: await label_cache.get(key) for _, key in keyed}
+    misses = {key: order for order, key in keyed if fragments[key] is None}
+    if misses:
+        if render:
+            rendered = await render(list(misses.values()), settings)
+        else:
+            rendered = render_label_fragments(list(misses.values()), settings)
+        for (key, order), html in zip(misses.items(), rendered):
+            fragments[key] = html
+            await label_cache.put(order["id"], key, html)
+    return [fragments[key] for _, key in keyed]
+
+async def render_bulk_labels(orders: List[Optional[dict]], settings: dict, render=None) -> str:
+    """Concatenated shipping labels, one page each; missing (None) orders are skipped."""
+    return "".join(html + LABEL_PAGE_BREAK for html in await cached_label_fragments(orders, settings, render))
+
+# Order archive
+# Delivered and returned orders older than ARCHIVE_AFTER_DAYS move to
+# orders_archive so the hot collection and its indexes stay small. Reads by id
+# fall back to the archive, and range reads include it only when the range
+# starts before the archive watermark. Workers cache the watermark for
+# ARCHIVE_STATE_TTL_SECONDS, so the job announces a new watermark and waits
+# that long before moving anything.
+ORDERS_ARCHIVE = "orders_archive"
+ARCHIVE_STATE_ID = "order_archive"
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_STATE_TTL_SECONDS = float(os.environ.get('ARCHIVE_STATE_TTL_SECONDS', '60'))
+ARCHIVED_STATUSES = [OrderStatus.DELIVERED.value, OrderStatus.RETURNED.value]
+
+class ArchiveState:
+    """Cached archive watermark and per-status counts of archived orders."""
+    def __init__(self):
+        self.archived_before: Optional[str] = None
+        self.counts: Dict[str, int] = {}
+        self.loaded_at = float("-inf")
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    async def load(self) -> "ArchiveState":
+        state = await db.counters.find_one({"_id": ARCHIVE_STATE_ID}) or {}
+        self.archived_before = state.get("archived_before")
+        self.counts = state.get("counts", {})
+        self.loaded_at = time.monotonic()
+        return self
+
+    async def current(self) -> "ArchiveState":
+        if time.monotonic() - self.loaded_at > ARCHIVE_STATE_TTL_SECONDS:
+            await self.load()
+        return self
+
+    def covers(self, start: Optional[str]) -> bool:
+        """Whether archived orders can fall in a range starting at ``start`` (None for unbounded)."""
+        return self.archived_before is not None and (start is None or start < self.archived_before)
+
+archive_state = ArchiveState()
+
+async def find_order(order_id: str) -> Optional[dict]:
+    """Find an order by id in the hot collection, then in the archive."""
+    order = await db.orders.find_one({"id": order_id})
+    if order is None:
+        order = await db[ORDERS_ARCHIVE].find_one({"id": order_id})
+    return order
+
+async def find_order_for_update(order_id: str) -> Optional[dict]:
+    """Find an order about to be changed, moving it back to the hot collection if it was archived.
+
+    Keeping writes on hot orders means the archive only ever gains or loses
+    whole orders, so its per-status counts stay exact.
+    """
+    order = await db.orders.find_one({"id": order_id})
+    if order is not None:
+        return order
+    order = await db[ORDERS_ARCHIVE].find_one({"id": order_id}, {"_id": 0})
+    if order is None:
+        return None
+    # Insert-only upsert on the unique id: of two concurrent moves one inserts,
+    # and neither overwrites a change the other has already made to the hot copy
+    await db.orders.update_one({"id": order_id}, {"$setOnInsert": order}, upsert=True)
+    removed = await db[ORDERS_ARCHIVE].delete_one({"id": order_id})
+    if removed.deleted_count:
+        await db.counters.update_one({"_id": ARCHIVE_STATE_ID}, {"$inc": {f"counts.{order['status']}": -1}})
+    return await db.orders.find_one({"id": order_id})
+
+async def distinct_orders(cursor) -> List[dict]:
+    """Orders from a cursor over hot and archived orders, each id once.
+
+    Moves either way copy an order before deleting the source, so between
+    those two writes it is in both collections.
+    """
+    orders, seen = [], set()
+    async for order in cursor:
+        if order["id"] not in seen:
+            seen.add(order["id"])
+            orders.append(order)
+    return orders
+
+async def find_orders(query: dict, start: Optional[str], limit: int = 1000) -> List[dict]:
+    """Run ``query`` on hot orders, and on the archive too when ``start`` is before the watermark."""
+    source = read_db()
+    orders = await source.orders.find(query).to_list(limit)
+    if (await archive_state.current()).covers(start):
+        seen = {order["id"] for order in orders}
+        archived = await source[ORDERS_ARCHIVE].find(query).to_list(limit)
+        # The hot copy wins over one still being moved
+        orders.extend(order for order in archived if order["id"] not in seen)
+    return orders
+
+async def aggregate_orders(pipeline: List[dict], start: Optional[str], then: Optional[List[dict]] = None, **kwargs):
+    """Aggregate over hot orders, adding archived ones through $unionWith when ``start`` is before the watermark.
+
+    ``pipeline`` runs on each collection; ``then`` runs once on the combined stream.
+    """
+    source = read_db()
+    if (await archive_state.current()).covers(start):
+        return source[ORDERS_ARCHIVE].aggregate(
+            pipeline + [{"$unionWith": {"coll": "orders", "pipeline": pipeline}}] + (then or []), **kwargs
+        )
+    return source.orders.aggregate(pipeline + (then or []), **kwargs)
+
+async def recount_archive():
+    counts = {status: await db[ORDERS_ARCHIVE].count_documents({"status": status}) for status in ARCHIVED_STATUSES}
+    await db.counters.update_one({"_id": ARCHIVE_STATE_ID}, {"$set": {"counts": counts}}, upsert=True)
+    return counts
+
+async def archive_orders(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    announce_wait: float = ARCHIVE_STATE_TTL_SECONDS,
+    progress=None,
+) -> dict:
+    """Move delivered and returned orders created more than ``older_than_days`` ago to the archive.
+
+    Each batch is copied with idempotent upserts before it is deleted from the
+    hot collection, so an interrupted run can simply be repeated. Orders that
+    change between the copy and the delete stay hot.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    state = await archive_state.load()
+    if state.archived_before is None or cutoff > state.archived_before:
+        await db.counters.update_one(
+            {"_id": ARCHIVE_STATE_ID}, {"$max": {"archived_before": cutoff}}, upsert=True
+        )
+        await archive_state.load()
+        # Let every worker's cached watermark catch up before orders leave the hot collection
+        await asyncio.sleep(announce_wait)
+
+    summary = {"archived_before": cutoff, "archived": 0, "kept_hot": 0, "batches": 0}
+    query = {"status": {"$in": ARCHIVED_STATUSES}, "created_at": {"$lt": cutoff}}
+    while True:
+        batch = await db.orders.find(query, {"_id": 0}).sort("created_at", 1).to_list(batch_size)
+        if not batch:
+            break
+        await db[ORDERS_ARCHIVE].bulk_write(
+            [ReplaceOne({"id": order["id"]}, order, upsert=True) for order in batch], ordered=False
+        )
+        result = await db.orders.bulk_write([
+            DeleteOne({"id": order["id"], "status": order["status"], "updated_at": order.get("updated_at")})
+            for order in batch
+        ], ordered=False)
+        moved = batch
+        if result.deleted_count < len(batch):
+            ids = [order["id"] for order in batch]
+            still_hot = {doc["id"] async for doc in db.orders.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})}
+            await db[ORDERS_ARCHIVE].delete_many({"id": {"$in": list(still_hot)}})
+            moved = [order for order in batch if order["id"] not in still_hot]
+            summary["kept_hot"] += len(still_hot)
+            if not moved:
+                break
+        increments = defaultdict(int)
+        for order in moved:
+            increments[f"counts.{order['status']}"] += 1
+        await db.counters.update_one({"_id": ARCHIVE_STATE_ID}, {"$inc": dict(increments)}, upsert=True)
+        summary["archived"] += len(moved)
+        summary["batches"] += 1
+        if progress:
+            progress(summary["archived"])
+
+    summary["counts"] = await recount_archive()
+    await archive_state.load()
+    return summary
+
+# Finance export
+# Order lines for a date range, read from one aggregation cursor and turned
+# into pandas frames of FINANCE_EXPORT_BATCH_ROWS lines so memory stays bounded.
+FINANCE_EXPORT_BATCH_ROWS = int(os.environ.get('FINANCE_EXPORT_BATCH_ROWS', '50000'))
+FINANCE_EXPORT_SPOOL_BYTES = int(os.environ.get('FINANCE_EXPORT_SPOOL_BYTES', str(64 * 1024 * 1024)))
+FINANCE_EXPORT_FORMATS = ("csv", "parquet")
+# Share of the selling price assumed as cost when a variant has no buy price
+ESTIMATED_COST_RATIO = 0.6
+
+FINANCE_SOURCE_COLUMNS = [
+    "order_id", "order_number", "created_at", "status", "city", "product_id", "product_name",
+    "variant_id", "size", "color", "quantity", "unit_price", "line_total",
+]
+FINANCE_EXPORT_COLUMNS = [
+    "order_id", "order_number", "date", "created_at", "status", "city", "product_id", "product_name",
+    "variant_id", "size", "color", "quantity", "unit_price", "line_total", "buy_price", "unit_cost",
+    "cost", "cost_estimated", "margin", "margin_pct",
+]
+
+def finance_lines_pipeline(start: str, end: str) -> List[dict]:
+    return [
+        {"$match": {"created_at": {"$gte": start, "$lte": end}}},
+        {"$sort": {"created_at": 1}},
+        {"$unwind": "$items"},
+        {"$project": {
+            "_id": 0, "order_id": "$id", "order_number": 1, "created_at": 1, "status": 1,
+            "city": "$customer_city", "product_id": "$items.product_id", "product_name": "$items.product_name",
+            "variant_id": "$items.variant_id", "size": "$items.size", "color": "$items.color",
+            "quantity": "$items.quantity", "unit_price": "$items.unit_price", "line_total": "$items.total_price",
+        }},
+    ]
+
+def finance_frame(rows: List[dict], buy_prices: Dict[str, Optional[float]]) -> pd.DataFrame:
+    """Build a frame of order lines and add cost and margin columns."""
+    frame = pd.DataFrame.from_records(rows, columns=FINANCE_SOURCE_COLUMNS)
+    frame["created_at"] = pd.to_datetime(frame["created_at"], utc=True, format="ISO8601")
+    frame["date"] = frame["created_at"].dt.date
+    quantity = frame["quantity"].to_numpy(dtype=float)
+    unit_price = frame["unit_price"].to_numpy(dtype=float)
+    line_total = frame["line_total"].to_numpy(dtype=float)
+    buy_price = frame["variant_id"].map(buy_prices).to_numpy(dtype=float, na_value=np.nan)
+    # Same rule as profit-loss: a missing or zero buy price means the cost is estimated
+    has_cost = np.nan_to_num(buy_price) > 0
+    unit_cost = np.where(has_cost, buy_price, unit_price * ESTIMATED_COST_RATIO)
+    cost = unit_cost * quantity
+    margin = line_total - cost
+    frame["buy_price"] = buy_price
+    frame["unit_cost"] = unit_cost
+    frame["cost"] = cost
+    frame["cost_estimated"] = ~has_cost
+    frame["margin"] = margin
+    frame["margin_pct"] = np.divide(margin * 100, line_total, out=np.zeros_like(margin), where=line_total != 0)
+    return frame[FINANCE_EXPORT_COLUMNS]
+
+async def iter_finance_frames(
+    start_date: str, end_date: str, batch_rows: int = FINANCE_EXPORT_BATCH_ROWS, stats: Optional[dict] = None,
+) -> AsyncIterator[pd.DataFrame]:
+    """Yield order lines created between two dates (inclusive) as frames of at most ``batch_rows`` lines.
+
+    Hot and archived lines share one cursor, see aggregate_orders.
+    """
+    start, end = f"{start_date}T00:00:00", f"{end_date}T23:59:59"
+    cursor = await aggregate_orders(finance_lines_pipeline(start, end), start, batchSize=batch_rows)
+    buy_prices = {variant_id: variant.buy_price for variant_id, (_, variant) in catalog.variants.items()}
+
+    async def to_frame(rows: List[dict]) -> pd.DataFrame:
+        missing = {row["product_id"] for row in rows if row.get("variant_id") not in buy_prices}
+        if missing:
+            await catalog.fetch_products(missing)
+            buy_prices.update(
+                (variant.id, variant.buy_price)
+                for product_id in missing if product_id in catalog.products
+                for variant in catalog.products[product_id].variants
+            )
+        if stats is not None:
+            stats["lines"] = stats.get("lines", 0) + len(rows)
+        return finance_frame(rows, buy_prices)
+
+    rows = []
+    async for row in cursor:
+        rows.append(row)
+        if len(rows) >= batch_rows:
+            yield await to_frame(rows)
+            rows = []
+    if rows:
+        yield await to_frame(rows)
+
+async def finance_csv_chunks(frames: AsyncIterator[pd.DataFrame]) -> AsyncIterator[str]:
+    header = True
+    async for frame in frames:
+        yield frame.to_csv(index=False, header=header)
+        header = False
+    if header:
+        yield ",".join(FINANCE_EXPORT_COLUMNS) + "\n"
+
+def finance_arrow_schema():
+    string = pa.string()
+    types = {
+        "date": pa.date32(), "created_at": pa.timestamp("us", tz="UTC"), "quantity": pa.int64(),
+        "cost_estimated": pa.bool_(),
+        **{column: pa.float64() for column in (
+            "unit_price", "line_total", "buy_price", "unit_cost", "cost", "margin", "margin_pct",
+        )},
+    }
+    return pa.schema([(column, types.get(column, string)) for column in FINANCE_EXPORT_COLUMNS])
+
+async def write_finance_parquet(frames: AsyncIterator[pd.DataFrame], sink):
+    """Write frames to ``sink`` (a path or binary file) as one Parquet file with a row group per frame."""
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    schema = finance_arrow_schema()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for frame in frames:
+            table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+            await asyncio.to_thread(writer.write_table, table)
+    finally:
+        writer.close()
+
+# Sales analytics
+# Mongo sums order lines per variant (and city when asked for) in one
+# aggregation; the much smaller result is rolled up to the requested
+# dimensions with pandas, where catalog categories and buy prices are joined.
+SALES_DIMENSIONS = {
+    "product": ["product_id", "product_name"],
+    "variant": ["product_id", "product_name", "variant_id", "size", "color"],
+    "size": ["size"],
+    "color": ["color"],
+    "category": ["category"],
+    "city": ["city"],
+}
+SALES_METRICS = ("revenue", "units", "margin")
+
+def parse_sales_dimensions(group_by: str) -> List[str]:
+    dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in dimensions if name not in SALES_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown group_by {', '.join(unknown)}; use {', '.join(SALES_DIMENSIONS)}")
+    return dimensions
+
+def sales_lines_pipeline(start: str, end: str) -> List[dict]:
+    return [
+        {"$match": {"created_at": {"$gte": start, "$lte": end}, "status": {"$ne": "returned"}}},
+        {"$project": {
+            "_id": 0, "customer_city": 1, "items.product_id": 1, "items.variant_id": 1, "items.product_name": 1,
+            "items.size": 1, "items.color": 1, "items.quantity": 1, "items.unit_price": 1, "items.total_price": 1,
+        }},
+        {"$unwind": "$items"},
+    ]
+
+def sales_variant_group(by_city: bool) -> List[dict]:
+    key = {"variant_id": "$items.variant_id", "product_id": "$items.product_id"}
+    if by_city:
+        key["city"] = "$customer_city"
+    return [{"$group": {
+        "_id": key,
+        "product_name": {"$first": "$items.product_name"},
+        "size": {"$first": "$items.size"},
+        "color": {"$first": "$items.color"},
+        "revenue": {"$sum": "$items.total_price"},
+        "units": {"$sum": "$items.quantity"},
+        "list_value": {"$sum": {"$multiply": ["$items.unit_price", "$items.quantity"]}},
+        "lines": {"$sum": 1},
+    }}]
+
+def sales_summary(frame: pd.DataFrame) -> dict:
+    revenue, cost = float(frame["revenue"].sum()), float(frame["cost"].sum())
+    return {
+        "revenue": revenue,
+        "units": int(frame["units"].sum()),
+        "lines": int(frame["lines"].sum()),
+        "cost": cost,
+        "margin": revenue - cost,
+        "margin_pct": (revenue - cost) / revenue * 100 if revenue else 0.0,
+    }
+
+async def sales_breakdown(
+    start_date: str, end_date: str, dimensions: List[str], sort_by: str = "revenue", top: Optional[int] = None,
+) -> dict:
+    start, end = f"{start_date}T00:00:00", f"{end_date}T23:59:59"
+    cursor = await aggregate_orders(
+        sales_lines_pipeline(start, end), start, sales_variant_group("city" in dimensions), allowDiskUse=True,
+    )
+    rows = [{**row.pop("_id"), **row} async for row in cursor]
+    columns = ["variant_id", "product_id", "city", "product_name", "size", "color",
+               "revenue", "units", "list_value", "lines"]
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+
+    await catalog.fetch_products(set(frame["product_id"].dropna()) - catalog.products.keys())
+    buy_prices = {variant_id: variant.buy_price for variant_id, (_, variant) in catalog.variants.items()}
+    buy_price = frame["variant_id"].map(buy_prices).to_numpy(dtype=float, na_value=np.nan)
+    has_cost = np.nan_to_num(buy_price) > 0
+    frame["cost"] = np.where(
+        has_cost, buy_price * frame["units"].to_numpy(dtype=float),
+        frame["list_value"].to_numpy(dtype=float) * ESTIMATED_COST_RATIO,
+    )
+    products = catalog.products
+    frame["category"] = frame["product_id"].map(lambda product_id: getattr(products.get(product_id), "category", None))
+    # Prefer the current product name over whatever was copied onto older orders
+    frame["product_name"] = frame["product_id"].map(
+        lambda product_id: getattr(products.get(product_id), "name", None)
+    ).fillna(frame["product_name"])
+
+    result = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": dimensions,
+        "sort_by": sort_by,
+        "totals": sales_summary(frame),
+        "groups": [],
+    }
+    if not dimensions or frame.empty:
+        return result
+
+    keys = list(dict.fromkeys(column for name in dimensions for column in SALES_DIMENSIONS[name]))
+    grouped = frame.groupby(keys, dropna=False, sort=False)[["revenue", "units", "cost", "lines"]].sum().reset_index()
+    grouped["margin"] = grouped["revenue"] - grouped["cost"]
+    revenue = grouped["revenue"].to_numpy(dtype=float)
+    grouped["margin_pct"] = np.divide(
+        grouped["margin"].to_numpy(dtype=float) * 100, revenue, out=np.zeros_like(revenue), where=revenue != 0,
+    )
+    grouped = grouped.sort_values(sort_by, ascending=False, kind="stable")
+    if top:
+        grouped = grouped.head(top)
+    grouped = grouped.astype(object).where(grouped.notna(), None)
+    result["groups"] = grouped.to_dict("records")
+    return result
+
+# Inventory valuation
+# Stock on hand comes from the catalog snapshot and recent sales from one
+# order-line aggregation, joined per variant with pandas and then rolled up.
+INVENTORY_LEVELS = {
+    "variant": ["product_id", "product_name", "category", "variant_id", "sku", "size", "color"],
+    "product": ["product_id", "product_name", "category"],
+    "category": ["category"],
+}
+INVENTORY_VELOCITY_DAYS = int(os.environ.get('INVENTORY_VELOCITY_DAYS', '30'))
+
+def add_inventory_ratios(frame: pd.DataFrame, window_days: int) -> pd.DataFrame:
+    stock = frame["stock_on_hand"].to_numpy(dtype=float)
+    sold = frame["units_sold"].to_numpy(dtype=float)
+    velocity = sold / window_days
+    frame["daily_velocity"] = velocity
+    # No recent sales means no finite cover; NaN becomes null in the response
+    frame["days_of_cover"] = np.divide(stock, velocity, out=np.full_like(stock, np.nan), where=velocity > 0)
+    moved = sold + stock
+    frame["sell_through_pct"] = np.divide(sold * 100, moved, out=np.zeros_like(moved), where=moved > 0)
+    return frame
+
+async def inventory_valuation(level: str, window_days: int = INVENTORY_VELOCITY_DAYS, top: Optional[int] = None) -> dict:
+    await catalog.refresh()
+    records = [
+        (product.id, product.name, product.category, variant.id, variant.sku, variant.size.value, variant.color,
+         variant.stock_quantity, variant.price, variant.buy_price)
+        for product in list(catalog.products.values()) for variant in product.variants
+    ]
+    frame = pd.DataFrame.from_records(records, columns=[
+        "product_id", "product_name", "category", "variant_id", "sku", "size", "color",
+        "stock_quantity", "price", "buy_price",
+    ])
+
+    end = datetime.now(timezone.utc)
+    start = (end - timedelta(days=window_days)).isoformat()
+    cursor = await aggregate_orders(
+        sales_lines_pipeline(start, end.isoformat()), start, sales_variant_group(False), allowDiskUse=True,
+    )
+    sold = {row["_id"]["variant_id"]: row["units"] async for row in cursor}
+    frame["units_sold"] = frame["variant_id"].map(sold).fillna(0).astype(int)
+
+    # Oversold variants can go negative; they hold no stock worth valuing
+    frame["stock_on_hand"] = frame["stock_quantity"].clip(lower=0)
+    buy_price = frame["buy_price"].to_numpy(dtype=float, na_value=np.nan)
+    has_cost = np.nan_to_num(buy_price) > 0
+    unit_cost = np.where(has_cost, buy_price, frame["price"].to_numpy(dtype=float) * ESTIMATED_COST_RATIO)
+    frame["stock_value"] = frame["stock_on_hand"].to_numpy(dtype=float) * unit_cost
+    frame["estimated_value"] = np.where(has_cost, 0.0, frame["stock_value"])
+
+    summed = ["stock_on_hand", "stock_value", "estimated_value", "units_sold"]
+    totals = add_inventory_ratios(frame[summed].sum().to_frame().T, window_days).iloc[0]
+    grouped = frame.groupby(INVENTORY_LEVELS[level], dropna=False, sort=False)[summed].sum().reset_index()
+    grouped = add_inventory_ratios(grouped, window_days).sort_values("stock_value", ascending=False, kind="stable")
+    if top:
+        grouped = grouped.head(top)
+    grouped = grouped.astype(object).where(grouped.notna(), None)
+    return {
+        "level": level,
+        "window_days": window_days,
+        "catalog_version": catalog.version,
+        "totals": {key: (None if pd.isna(value) else float(value)) for key, value in totals.items()},
+        "items": grouped.to_dict("records"),
+    }
+
+# Customer statistics
+# One customer_stats document per customer. Order creation and status changes
+# adjust it with $inc; deletes and edits, which can move the first or last
+# order date, recompute the affected customers. rebuild_customer_stats redoes
+# everything from orders (hot and archived).
+CUSTOMER_SORT_FIELDS = ("lifetime_value", "order_count", "returns_count", "last_order_at", "first_order_at")
+CUSTOMER_PAGE_LIMIT = int(os.environ.get('CUSTOMER_PAGE_LIMIT', '50'))
+CUSTOMER_PAGE_MAX_LIMIT = 500
+# Order dates are left unset rather than null: null sorts below every date, so $min would keep it
+EMPTY_CUSTOMER_STATS = {"order_count": 0, "lifetime_value": 0.0, "returns_count": 0}
+UNSET_ORDER_DATES = {"first_order_at": "", "last_order_at": ""}
+CUSTOMER_STATS_BUILT_MARKER = "customer_stats_built"
+CUSTOMER_STATS_GROUP = {"$group": {
+    "_id": "$customer_id",
+    "order_count": {"$sum": 1},
+    "lifetime_value": {"$sum": {"$cond": [{"$eq": ["$status", "returned"]}, 0, "$total_amount"]}},
+    "returns_count": {"$sum": {"$cond": [{"$eq": ["$status", "returned"]}, 1, 0]}},
+    "first_order_at": {"$min": "$created_at"},
+    "last_order_at": {"$max": "$created_at"},
+}}
+
+def customer_stats_increments(order: dict, sign: int = 1) -> dict:
+    """The $inc that adds (sign=1) or removes (sign=-1) one order's contribution."""
+    returned = order["status"] == OrderStatus.RETURNED
+    return {
+        "order_count": sign,
+        "lifetime_value": 0.0 if returned else sign * order["total_amount"],
+        "returns_count": sign if returned else 0,
+    }
+
+async def record_order_in_stats(order: dict):
+    now = datetime.now(timezone.utc).isoformat()
+    await db.customer_stats.update_one(
+        {"customer_id": order["customer_id"]},
+        {
+            "$inc": customer_stats_increments(order),
+            "$min": {"first_order_at": order["created_at"]},
+            "$max": {"last_order_at": order["created_at"]},
+            "$set": {"updated_at": now},
+        },
+        upsert=True,
+    )
+
+async def record_status_in_stats(order: dict, status: str):
+    """Move one order's contribution between returned and not returned."""
+    if (order["status"] == OrderStatus.RETURNED) == (status == OrderStatus.RETURNED):
+        return
+    before = customer_stats_increments(order, -1)
+    after = customer_stats_increments({**order, "status": status})
+    await db.customer_stats.update_one(
+        {"customer_id": order["customer_id"]},
+        {
+            "$inc": {field: before[field] + after[field] for field in ("lifetime_value", "returns_count")},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+        },
+    )
+
+async def ensure_customer_stats(customer_ids: Iterable[str]):
+    """Give new customers an empty stats document so they appear in sorted listings."""
+    operations = [
+        UpdateOne({"customer_id": customer_id}, {"$setOnInsert": EMPTY_CUSTOMER_STATS}, upsert=True)
+        for customer_id in customer_ids
+    ]
+    if operations:
+        await db.customer_stats.bulk_write(operations, ordered=False)
+
+async def recompute_customer_stats(customer_ids: Iterable[str]):
+    """Recompute the given customers from their orders with one aggregation and one bulk write."""
+    customer_ids = list(set(customer_ids))
+    cursor = await aggregate_orders([{"$match": {"customer_id": {"$in": customer_ids}}}], None, [CUSTOMER_STATS_GROUP])
+    found = {row.pop("_id"): row async for row in cursor}
+    now = datetime.now(timezone.utc).isoformat()
+    await db.customer_stats.bulk_write([
+        UpdateOne({"customer_id": customer_id}, {"$set": {**found[customer_id], "updated_at": now}}, upsert=True)
+        if customer_id in found else
+        UpdateOne(
+            {"customer_id": customer_id},
+            {"$set": {**EMPTY_CUSTOMER_STATS, "updated_at": now}, "$unset": UNSET_ORDER_DATES},
+            upsert=True,
+        )
+        for customer_id in customer_ids
+    ], ordered=False)
+
+async def rebuild_customer_stats() -> dict:
+    """Recompute every customer's stats from orders and drop stats for customers that have none.
+
+    Order writes that land while this runs may be counted twice or not at
+    all, so run it when order entry is quiet.
+    """
+    run = datetime.now(timezone.utc).isoformat()
+    await db.customer_stats.create_index("customer_id", unique=True)
+    cursor = await aggregate_orders([], None, [
+        CUSTOMER_STATS_GROUP,
+        {"$project": {
+            "_id": 0, "customer_id": "$_id", "order_count": 1, "lifetime_value": 1, "returns_count": 1,
+            "first_order_at": 1, "last_order_at": 1, "updated_at": {"$literal": run}, "rebuilt_at": {"$literal": run},
+        }},
+        {"$merge": {"into": "customer_stats", "on": "customer_id", "whenMatched": "replace"}},
+    ], allowDiskUse=True)
+    await cursor.to_list(None)
+    # Stats left over from orders that no longer exist
+    reset = await db.customer_stats.update_many(
+        {"rebuilt_at": {"$ne": run}},
+        {"$set": {**EMPTY_CUSTOMER_STATS, "updated_at": run}, "$unset": UNSET_ORDER_DATES},
+    )
+    # Customers who have never ordered get empty documents
+    empty = {key: {"$literal": value} for key, value in EMPTY_CUSTOMER_STATS.items()}
+    await db.customers.aggregate([
+        {"$project": {"_id": 0, "customer_id": "$id", **empty, "updated_at": {"$literal": run}}},
+        {"$merge": {"into": "customer_stats", "on": "customer_id", "whenMatched": "keepExisting"}},
+    ]).to_list(None)
+    await db.settings.update_one(
+        {"id": CUSTOMER_STATS_BUILT_MARKER}, {"$set": {"completed_at": run}}, upsert=True,
+    )
+    return {
+        "customers": await db.customer_stats.count_documents({}),
+        "with_orders": await db.customer_stats.count_documents({"order_count": {"$gt": 0}}),
+        "reset": reset.modified_count,
+    }
+
+async def build_customer_stats_once():
+    """Build stats for customers who existed before they were kept, once per database.
+
+    Without it a customer's first new order would upsert a stats document
+    that ignores their earlier orders. Later rebuilds are run by hand.
+    """
+    if await db.settings.find_one({"id": CUSTOMER_STATS_BUILT_MARKER}, {"_id": 1}):
+        return
+    await rebuild_customer_stats()
+
+async def list_customers_by_stats(sort: str, offset: int, limit: int, min_lifetime_value: Optional[float]) -> dict:
+    query = {} if min_lifetime_value is None else {"lifetime_value": {"$gte": min_lifetime_value}}
+    stats = await db.customer_stats.find(query, {"_id": 0, "updated_at": 0, "rebuilt_at": 0}).sort(
+        [(sort, -1), ("customer_id", 1)]
+    ).skip(offset).limit(limit).to_list(limit)
+    customers = {
+        customer["id"]: customer
+        async for customer in db.customers.find({"id": {"$in": [row["customer_id"] for row in stats]}}, {"_id": 0})
+    }
+    items = [
+        CustomerWithStats(**parse_from_mongo(customers[row["customer_id"]]), stats=CustomerStats(**row))
+        for row in stats if row["customer_id"] in customers
+    ]
+    return {"items": items, "total": await db.customer_stats.count_documents(query), "offset": offset, "limit": limit}
+
+ORDER_SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "order_number": 1, "status": 1, "total_amount": 1, "cod_amount": 1,
+    "tracking_number": 1, "item_count": {"$size": "$items"}, "created_at": 1,
+}
+
+async def customer_order_history(customer_id: str, offset: int, limit: int) -> dict:
+    """Newest-first page of order summaries for one customer, hot and archived.
+
+    Each collection walks its (customer_id, created_at) index for at most
+    ``offset + limit`` orders, so a page never touches the rest of the history.
+    """
+    per_collection = [
+        {"$match": {"customer_id": customer_id}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": offset + limit},
+        {"$project": ORDER_SUMMARY_PROJECTION},
+    ]
+    cursor = await aggregate_orders(
+        per_collection, None, then=[{"$sort": {"created_at": -1, "id": 1}}, {"$skip": offset}, {"$limit": limit}],
+    )
+    items = [OrderSummary(**parse_from_mongo(order)) for order in await distinct_orders(cursor)]
+    total = await db.orders.count_documents({"customer_id": customer_id})
+    if (await archive_state.current()).covers(None):
+        total += await db[ORDERS_ARCHIVE].count_documents({"customer_id": customer_id})
+    return {"items": items, "total": total, "offset": offset, "limit": limit}
+
+# Order filtering
+# Filters for the orders view. The common combinations are backed by indexes:
+# status tabs by (status, created_at), city by (customer_city, status,
+# created_at), date ranges by created_at and the search box by prefix
+# matches on order_number and tracking_number.
+ORDER_SORTS = {
+    "-created_at": ("created_at", -1),
+    "created_at": ("created_at", 1),
+    "-total_amount": ("total_amount", -1),
+    "total_amount": ("total_amount", 1),
+}
+ORDER_PAGE_LIMIT = int(os.environ.get('ORDER_PAGE_LIMIT', '50'))
+ORDER_PAGE_MAX_LIMIT = 500
+ORDER_STATUSES = [status.value for status in OrderStatus]
+
+def order_filter_query(
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    city: Optional[str] = None,
+    has_tracking: Optional[bool] = None,
+    search: Optional[str] = None,
+) -> dict:
+    """Build the orders query for every filter except status. Raises ValueError for bad dates."""
+    query = {}
+    if created_from or created_to:
+        created = query["created_at"] = {}
+        if created_from:
+            created["$gte"] = date.fromisoformat(created_from).isoformat()
+        if created_to:
+            # Dates are ISO strings, so everything on the last day sorts below the next one
+            created["$lt"] = (date.fromisoformat(created_to) + timedelta(days=1)).isoformat()
+    if city:
+        query["customer_city"] = city
+    if has_tracking is not None:
+        query["tracking_number"] = {"$nin": [None, ""]} if has_tracking else {"$in": [None, ""]}
+    if search and search.strip():
+        prefix = {"$regex": f"^{re.escape(search.strip())}"}
+        query["$or"] = [{"order_number": prefix}, {"tracking_number": prefix}]
+    return query
+
+def parse_order_statuses(statuses: Optional[List[str]]) -> Optional[List[str]]:
+    """Accept repeated ``status`` params or comma-separated lists. Raises ValueError for unknown ones."""
+    if not statuses:
+        return None
+    parsed = [status.strip() for value in statuses for status in value.split(",") if status.strip()]
+    unknown = sorted(set(parsed) - set(ORDER_STATUSES))
+    if unknown:
+        raise ValueError(f"Unknown status {', '.join(unknown)}; use {', '.join(ORDER_STATUSES)}")
+    return parsed
+
+def with_statuses(query: dict, statuses: Optional[List[str]]) -> dict:
+    if not statuses:
+        return query
+    return {**query, "status": statuses[0] if len(statuses) == 1 else {"$in": statuses}}
 
-# Create the main app without a prefix
-app = FastAPI()
+async def reads_archive(start: Optional[str], statuses: Optional[List[str]]) -> bool:
+    """Whether a filtered read has to include the archive, which only holds delivered and returned orders."""
+    if statuses is not None and not set(statuses) & set(ARCHIVED_STATUSES):
+        return False
+    return (await archive_state.current()).covers(start)
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+async def list_orders(query: dict, start: Optional[str], statuses: Optional[List[str]], sort: str, offset: int, limit: int) -> dict:
+    field, direction = ORDER_SORTS[sort]
+    query = with_statuses(query, statuses)
+    if not await reads_archive(start, statuses):
+        orders = await db.orders.find(query).sort(field, direction).skip(offset).limit(limit).to_list(limit)
+        total = await db.orders.count_documents(query)
+    else:
+        per_collection = [{"$match": query}, {"$sort": {field: direction}}, {"$limit": offset + limit}]
+        cursor = await aggregate_orders(
+            per_collection, start, then=[{"$sort": {field: direction}}, {"$skip": offset}, {"$limit": limit}],
+        )
+        orders = await distinct_orders(cursor)
+        total = await db.orders.count_documents(query) + await db[ORDERS_ARCHIVE].count_documents(query)
+    items = [Order(**parse_from_mongo(order)) for order in orders]
+    return {"items": items, "total": total, "offset": offset, "limit": limit}
 
-# Enums
-class OrderStatus(str, Enum):
-    PENDING = "pending"
-    ON_COURIER = "on_courier"
-    DELIVERED = "delivered"
-    RETURNED = "returned"
+async def count_orders_by_status(query: dict, start: Optional[str]) -> Dict[str, int]:
+    """Per-status counts for the filter tabs; each one is a count over an index."""
+    counts = {status: await db.orders.count_documents({**query, "status": status}) for status in ORDER_STATUSES}
+    archived = await archive_state.current()
+    if archived.covers(start):
+        for status in ARCHIVED_STATUSES:
+            # Unfiltered counts come from the cached per-status archive totals
+            counts[status] += await db[ORDERS_ARCHIVE].count_documents({**query, "status": status}) \
+                if query else archived.counts.get(status, 0)
+    return counts
 
-class SizeEnum(str, Enum):
-    XS = "XS"
-    S = "S"
-    M = "M"
-    L = "L"
-    XL = "XL"
-    XXL = "XXL"
+# Background jobs
+# Large courier exports and label runs are submitted as jobs instead of being
+# rendered inside the request. The job record lives in Mongo so any worker can
+# report on it; the worker that accepted it fetches orders in chunks and hands
+# the CPU-bound rendering to a process pool, so the event loop keeps serving
+# order entry. Artifacts are written to JOBS_DIR, which must be shared storage
+# when workers run on more than one host, and are removed after
+# JOB_RETENTION_HOURS.
+JOBS_DIR = Path(os.environ.get('JOBS_DIR', str(Path(tempfile.gettempdir()) / "pos_jobs")))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', '500'))
+JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', '24'))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '600'))
+JOB_CLEANUP_SECONDS = float(os.environ.get('JOB_CLEANUP_SECONDS', '300'))
+JOB_MAX_ORDERS = int(os.environ.get('JOB_MAX_ORDERS', '100000'))
 
-# Pydantic Models
-class ProductVariant(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    size: SizeEnum
-    color: str
-    sku: str
-    stock_quantity: int
-    price: float
-    buy_price: Optional[float] = None
-    purchase_date: Optional[datetime] = None
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
 
-class Product(BaseModel):
+# kind -> (file extension, media type)
+JOB_KINDS = {
+    "orders_csv": ("csv", "text/csv"),
+    "bulk_labels": ("html", "text/html"),
+}
+
+class Job(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    description: str
-    category: str
-    variants: List[ProductVariant]
-    low_stock_threshold: int = 5
+    kind: str
+    status: JobStatus = JobStatus.QUEUED
+    total: int = 0
+    done: int = 0
+    error: Optional[str] = None
+    filename: Optional[str] = None
+    size: Optional[int] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
-class Customer(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    email: str
-    phone: str
-    phone_2: Optional[str] = None
-    address: str
-    city: str
-    postal_code: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+_job_pool: Optional[ProcessPoolExecutor] = None
+job_tasks = set()
 
-class OrderItem(BaseModel):
-    product_id: str
-    variant_id: str
-    product_name: str
-    size: str
-    color: str
-    quantity: int
-    unit_price: float
-    total_price: float
+def job_pool() -> ProcessPoolExecutor:
+    global _job_pool
+    if _job_pool is None:
+        # Spawned, not forked: a fork would copy the running event loop and Mongo client threads
+        _job_pool = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _job_pool
 
-class Order(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    order_number: Optional[str] = None
-    customer_id: str
-    customer_name: str
-    customer_address: str
-    customer_phone: str
-    customer_phone_2: Optional[str] = None
-    customer_city: Optional[str] = None
-    items: List[OrderItem]
-    subtotal: float
-    tax_amount: float
-    courier_charges: float = 350.0
-    discount_amount: float = 0.0
-    discount_percentage: float = 0.0
-    total_amount: float
-    status: OrderStatus = OrderStatus.PENDING
-    tracking_number: Optional[str] = None
-    cod_amount: Optional[float] = None
-    remarks: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+def stop_job_pool():
+    global _job_pool
+    for task in list(job_tasks):
+        # Interrupted jobs are failed by cleanup_jobs once they go stale
+        task.cancel()
+    if _job_pool is not None:
+        _job_pool.shutdown(wait=False, cancel_futures=True)
+        _job_pool = None
 
-class BusinessSettings(BaseModel):
-    id: str = Field(default="business_settings")
-    business_name: str = "My Clothing Store"
-    address: str = ""
-    phone: str = ""
-    email: str = ""
-    tax_rate: float = 0.0
-    shipping_label_template: str = """
-    <div style="width: 210mm; height: 297mm; padding: 20mm; font-family: Arial, sans-serif;">
-        <div style="border: 2px solid #000; height: 100%; padding: 10mm;">
-            <h2 style="text-align: center; margin-bottom: 20px;">{{business_name}}</h2>
-            <div style="margin-bottom: 20px;">
-                <strong>From:</strong><br>
-                {{business_address}}<br>
-                {{business_phone}}
-            </div>
-            <div style="margin-bottom: 20px;">
-                <strong>To:</strong><br>
-                {{customer_name}}<br>
-                {{customer_address}}<br>
-                {{customer_phone}}
-            </div>
-            <div style="margin-bottom: 20px;">
-                <strong>Order #:</strong> {{order_number}}<br>
-                <strong>Tracking #:</strong> {{tracking_number}}<br>
-                <strong>Date:</strong> {{order_date}}
-            </div>
-            <div style="margin-bottom: 20px;">
-                <strong>Items:</strong><br>
-                {{order_items}}
-            </div>
-            <div style="margin-top: 40px; text-align: center;">
-                <strong>Total: LKR {{total_amount}}</strong>
-            </div>
-        </div>
-    </div>
-    """
+def job_artifact_path(job_id: str, kind: str) -> Path:
+    return JOBS_DIR / f"{job_id}.{JOB_KINDS[kind][0]}"
 
-# Helper functions
-def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, datetime):
-                data[key] = value.isoformat()
-            elif isinstance(value, list):
-                data[key] = [prepare_for_mongo(item) if isinstance(item, dict) else item for item in value]
-            elif isinstance(value, dict):
-                data[key] = prepare_for_mongo(value)
-    return data
+def job_event(job: dict) -> dict:
+    return {key: job.get(key) for key in ("id", "kind", "status", "total", "done", "error")}
 
-def parse_from_mongo(item):
-    if isinstance(item, dict):
-        for key, value in item.items():
-            if key == '_id':
-                # Skip MongoDB ObjectId fields
-                continue
-            elif isinstance(value, str) and 'T' in value and (value.endswith('Z') or (len(value) > 6 and '+' in value[-6:])):
-                try:
-                    item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                except:
-                    pass
-            elif isinstance(value, list):
-                item[key] = [parse_from_mongo(sub_item) if isinstance(sub_item, dict) else sub_item for sub_item in value]
-            elif isinstance(value, dict):
-                item[key] = parse_from_mongo(value)
-    return item
+async def update_job(job_id: str, **fields) -> dict:
+    fields["updated_at"] = datetime.now(timezone.utc)
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id}, {"$set": prepare_for_mongo(fields)}, projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job:
+        # Only this worker knows about progress, so subscribers on other workers poll instead
+        broadcaster.publish("job_progress", job_event(job))
+    return job
+
+async def run_job(job_id: str, kind: str, order_ids: List[str]):
+    """Render ``order_ids`` chunk by chunk in the process pool into the job's artifact file."""
+    loop = asyncio.get_running_loop()
+    path = job_artifact_path(job_id, kind)
+    partial = path.with_name(path.name + ".part")
+    try:
+        await update_job(job_id, status=JobStatus.RUNNING.value)
+        if kind == "bulk_labels":
+            settings = await db.settings.find_one({"id": "business_settings"}, {"_id": 0}) or BusinessSettings().dict()
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        with partial.open("w", encoding="utf-8", newline="") as sink:
+            for start in range(0, len(order_ids), JOB_CHUNK_SIZE):
+                orders = await fetch_orders_by_ids(order_ids[start:start + JOB_CHUNK_SIZE])
+                if kind == "orders_csv":
+                    chunk = await loop.run_in_executor(job_pool(), render_orders_csv, orders, start == 0)
+                else:
+                    chunk = await render_bulk_labels(
+                        orders, settings,
+                        lambda misses, settings: loop.run_in_executor(job_pool(), render_label_fragments, misses, settings),
+                    )
+                sink.write(chunk)
+                await update_job(job_id, done=min(start + JOB_CHUNK_SIZE, len(order_ids)))
+        partial.replace(path)
+        finished = datetime.now(timezone.utc)
+        await update_job(
+            job_id, status=JobStatus.SUCCEEDED.value, size=path.stat().st_size, finished_at=finished,
+            expires_at=finished + timedelta(hours=JOB_RETENTION_HOURS),
+        )
+    except asyncio.CancelledError:
+        partial.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job_id, kind)
+        partial.unlink(missing_ok=True)
+        finished = datetime.now(timezone.utc)
+        await update_job(
+            job_id, status=JobStatus.FAILED.value, error=str(e), finished_at=finished,
+            expires_at=finished + timedelta(hours=JOB_RETENTION_HOURS),
+        )
+
+async def submit_job(kind: str, order_ids: List[str]) -> Job:
+    job = Job(kind=kind, total=len(order_ids), filename=f"{kind}_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}.{JOB_KINDS[kind][0]}")
+    await db.jobs.insert_one(prepare_for_mongo(job.dict()))
+    task = asyncio.create_task(run_job(job.id, kind, order_ids))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return job
+
+async def cleanup_jobs() -> dict:
+    """Delete expired jobs with their artifacts and fail jobs whose worker stopped reporting."""
+    now = datetime.now(timezone.utc)
+    stale = await db.jobs.update_many(
+        {"status": {"$in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+         "updated_at": {"$lt": (now - timedelta(seconds=JOB_STALE_SECONDS)).isoformat()}},
+        {"$set": {"status": JobStatus.FAILED.value, "error": "Job was interrupted", "finished_at": now.isoformat(),
+                  "expires_at": (now + timedelta(hours=JOB_RETENTION_HOURS)).isoformat()}},
+    )
+    expired = await db.jobs.find({"expires_at": {"$lt": now.isoformat()}}, {"_id": 0, "id": 1, "kind": 1}).to_list(None)
+    for job in expired:
+        job_artifact_path(job["id"], job["kind"]).unlink(missing_ok=True)
+    if expired:
+        await db.jobs.delete_many({"id": {"$in": [job["id"] for job in expired]}})
+    return {"interrupted": stale.modified_count, "expired": len(expired)}
+
+async def cleanup_jobs_periodically():
+    while True:
+        await asyncio.sleep(JOB_CLEANUP_SECONDS)
+        try:
+            await cleanup_jobs()
+        except PyMongoError as e:
+            logger.warning("Job cleanup failed: %s", e)
+
+# Idempotency
+# Clients retry writes with the same Idempotency-Key header. The first request
+# reserves the key, runs, and stores its response; retries of the same request
+# get that response back without running again. Keys expire after
+# IDEMPOTENCY_TTL_HOURS through a TTL index. A failed request releases its key,
+# and a reservation left behind by a crashed worker can be taken over after
+# IDEMPOTENCY_PENDING_SECONDS.
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_PENDING_SECONDS = float(os.environ.get('IDEMPOTENCY_PENDING_SECONDS', '60'))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+async def request_fingerprint(request: Request) -> str:
+    body = await request.body()
+    parts = [request.method.encode(), request.url.path.encode(), request.url.query.encode(), body]
+    return hashlib.sha256(b"\n".join(parts)).hexdigest()
+
+async def reserve_idempotency_key(key: str, fingerprint: str) -> Optional[dict]:
+    """Reserve ``key`` for this request, or return the stored record of the request that already used it."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one(
+            {"_id": key, "fingerprint": fingerprint, "state": "pending", "created_at": now}
+        )
+        return None
+    except DuplicateKeyError:
+        record = await db.idempotency_keys.find_one({"_id": key})
+    if record is None:
+        raise HTTPException(status_code=409, detail="Idempotency-Key expired while in use; retry the request")
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if record["state"] == "done":
+        return record
+    started = record["created_at"].replace(tzinfo=timezone.utc)
+    if now - started > timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS):
+        # The worker that reserved the key never finished; take the reservation over
+        claimed = await db.idempotency_keys.update_one(
+            {"_id": key, "state": "pending", "created_at": record["created_at"]}, {"$set": {"created_at": now}}
+        )
+        if claimed.modified_count:
+            return None
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+async def run_idempotent(request: Request, response: Response, handler):
+    """Run ``handler()`` at most once per Idempotency-Key, replaying its stored result for retries."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await handler()
+    if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters")
+    record = await reserve_idempotency_key(key, await request_fingerprint(request))
+    if record:
+        response.headers[IDEMPOTENCY_REPLAYED_HEADER] = "true"
+        if record.get("status_code"):
+            response.status_code = record["status_code"]
+        return record["body"]
+    try:
+        result = await handler()
+    except Exception:
+        # Failures are not recorded, so the client can retry them with the same key
+        await db.idempotency_keys.delete_one({"_id": key, "state": "pending"})
+        raise
+    await db.idempotency_keys.update_one({"_id": key}, {"$set": {
+        "state": "done", "status_code": response.status_code, "body": jsonable_encoder(result),
+    }})
+    return result
 
 # Product Routes
 @api_router.post("/products", response_model=Product)
 async def create_product(product: Product):
     product_dict = prepare_for_mongo(product.dict())
-    await db.products.insert_one(product_dict)
+    try:
+        await db.products.insert_one(product_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A variant SKU is already used by another product")
+    catalog.apply_product(product)
+    publish_event("product_changed", product.dict())
     return product
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products():
+@api_router.get("/products", response_model=Union[List[Product], DeltaPage[Product]])
+async def get_products(response: Response, updated_since: Optional[str] = None):
+    if updated_since:
+        delta = await fetch_delta("products", *parse_sync_token(updated_since))
+        delta["items"] = [Product(**parse_from_mongo(product)) for product in delta["items"]]
+        response.headers[SYNC_TOKEN_HEADER] = delta["sync_token"]
+        return delta
+    response.headers[SYNC_TOKEN_HEADER] = current_sync_token()
     products = await db.products.find().to_list(1000)
     return [Product(**parse_from_mongo(product)) for product in products]
 
+@api_router.post("/products/import")
+async def import_products_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    batch_size: int = Form(IMPORT_BATCH_SIZE),
+):
+    try:
+        fmt = detect_import_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await import_products(iter_import_rows(stream, fmt), max(1, batch_size))
+    finally:
+        stream.detach()
+        await catalog.refresh()
+        publish_event("resync", {"collection": "products"})
+
 @api_router.get("/products/low-stock")
 async def get_low_stock_products():
-    products = await db.products.find().to_list(1000)
     low_stock_items = []
     
-    for product in products:
-        product_obj = Product(**parse_from_mongo(product))
+    for product_obj in list(catalog.products.values()):
         for variant in product_obj.variants:
             if variant.stock_quantity <= product_obj.low_stock_threshold:
                 low_stock_items.append({
@@ -216,25 +3147,74 @@ async def get_product(product_id: str):
 
 @api_router.put("/products/{product_id}", response_model=Product)
 async def update_product(product_id: str, product: Product):
+    # The path decides which product changes, whatever id the body carries
+    product.id = product_id
     product.updated_at = datetime.now(timezone.utc)
     product_dict = prepare_for_mongo(product.dict())
-    await db.products.update_one({"id": product_id}, {"$set": product_dict})
+    try:
+        result = await db.products.update_one({"id": product_id}, {"$set": product_dict})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A variant SKU is already used by another product")
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    catalog.apply_product(product)
+    publish_event("product_changed", product.dict())
     return product
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str):
     await db.products.delete_one({"id": product_id})
+    catalog.remove_product(product_id)
+    await record_tombstone("products", product_id)
+    publish_event("product_deleted", {"id": product_id})
     return {"message": "Product deleted successfully"}
 
 # Customer Routes
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer: Customer):
+    customer.phone_normalized = normalize_phone(customer.phone)
     customer_dict = prepare_for_mongo(customer.dict())
     await db.customers.insert_one(customer_dict)
+    await ensure_customer_stats([customer.id])
     return customer
 
-@api_router.get("/customers", response_model=List[Customer])
-async def get_customers():
+@api_router.post("/customers/import")
+async def import_customers_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    batch_size: int = Form(IMPORT_BATCH_SIZE),
+):
+    try:
+        fmt = detect_import_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return await import_customers(iter_import_rows(stream, fmt), max(1, batch_size))
+    finally:
+        stream.detach()
+
+@api_router.get("/customers", response_model=Union[List[Customer], DeltaPage[Customer], CustomerPage])
+async def get_customers(
+    response: Response,
+    updated_since: Optional[str] = None,
+    sort: Optional[str] = None,
+    offset: int = 0,
+    limit: int = CUSTOMER_PAGE_LIMIT,
+    min_lifetime_value: Optional[float] = None,
+):
+    if sort:
+        if sort not in CUSTOMER_SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(CUSTOMER_SORT_FIELDS)}")
+        validate_page(offset, limit, CUSTOMER_PAGE_MAX_LIMIT)
+        return await list_customers_by_stats(sort, offset, limit, min_lifetime_value)
+    if updated_since:
+        delta = await fetch_delta("customers", *parse_sync_token(updated_since))
+        delta["items"] = [Customer(**parse_from_mongo(customer)) for customer in delta["items"]]
+        response.headers[SYNC_TOKEN_HEADER] = delta["sync_token"]
+        return delta
+    response.headers[SYNC_TOKEN_HEADER] = current_sync_token()
     customers = await db.customers.find().to_list(1000)
     return [Customer(**parse_from_mongo(customer)) for customer in customers]
 
@@ -245,8 +3225,17 @@ async def get_customer(customer_id: str):
         raise HTTPException(status_code=404, detail="Customer not found")
     return Customer(**parse_from_mongo(customer))
 
+@api_router.get("/customers/{customer_id}/orders", response_model=OrderHistoryPage)
+async def get_customer_orders(customer_id: str, offset: int = 0, limit: int = CUSTOMER_PAGE_LIMIT):
+    validate_page(offset, limit, CUSTOMER_PAGE_MAX_LIMIT)
+    if not await db.customers.find_one({"id": customer_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return await customer_order_history(customer_id, offset, limit)
+
 @api_router.put("/customers/{customer_id}", response_model=Customer)
 async def update_customer(customer_id: str, customer: Customer):
+    customer.phone_normalized = normalize_phone(customer.phone)
+    customer.updated_at = datetime.now(timezone.utc)
     customer_dict = prepare_for_mongo(customer.dict())
     await db.customers.update_one({"id": customer_id}, {"$set": customer_dict})
     return customer
@@ -258,40 +3247,88 @@ async def delete_customer(customer_id: str):
         raise HTTPException(status_code=404, detail="Customer not found")
     
     await db.customers.delete_one({"id": customer_id})
+    await db.customer_stats.delete_one({"customer_id": customer_id})
+    await record_tombstone("customers", customer_id)
     return {"message": "Customer deleted successfully"}
 
 # Order Routes
 @api_router.post("/orders", response_model=Order)
-async def create_order(order: Order):
+async def create_order(order: Order, request: Request, response: Response):
+    return await run_idempotent(request, response, lambda: place_order(order))
+
+async def place_order(order: Order) -> Order:
+    await catalog.ensure_variants(order.items)
+    for item in order.items:
+        if catalog.variant(item.product_id, item.variant_id) is None:
+            raise HTTPException(status_code=400, detail=f"Unknown product variant {item.variant_id}")
+
     # Generate order number
-    order_count = await db.orders.count_documents({})
-    order.order_number = f"ORD-{order_count + 1:06d}"
+    order.order_number = await next_order_number()
     
     # Update stock quantities
-    for item in order.items:
-        product = await db.products.find_one({"id": item.product_id})
-        if product:
-            product_obj = Product(**parse_from_mongo(product))
-            for variant in product_obj.variants:
-                if variant.id == item.variant_id:
-                    variant.stock_quantity -= item.quantity
-                    break
-            
-            product_dict = prepare_for_mongo(product_obj.dict())
-            await db.products.update_one({"id": item.product_id}, {"$set": product_dict})
+    await adjust_stock(order.items, -1)
     
     order_dict = prepare_for_mongo(order.dict())
     await db.orders.insert_one(order_dict)
+    await record_order_in_stats(order_dict)
+    publish_event("order_created", order.dict())
     return order
 
-@api_router.get("/orders", response_model=List[Order])
-async def get_orders():
+@api_router.get("/orders", response_model=Union[List[Order], DeltaPage[Order], OrderPage])
+async def get_orders(
+    response: Response,
+    updated_since: Optional[str] = None,
+    status: Optional[List[str]] = Query(None),
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    city: Optional[str] = None,
+    has_tracking: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = None,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    if updated_since:
+        delta = await fetch_delta("orders", *parse_sync_token(updated_since))
+        delta["items"] = [Order(**parse_from_mongo(order)) for order in delta["items"]]
+        response.headers[SYNC_TOKEN_HEADER] = delta["sync_token"]
+        return delta
+    filtered = status or created_from or created_to or city or has_tracking is not None or search or sort
+    if filtered or offset is not None or limit is not None:
+        offset = 0 if offset is None else offset
+        limit = ORDER_PAGE_LIMIT if limit is None else limit
+        try:
+            statuses = parse_order_statuses(status)
+            query = order_filter_query(created_from, created_to, city, has_tracking, search)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        sort = sort or "-created_at"
+        if sort not in ORDER_SORTS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(ORDER_SORTS)}")
+        validate_page(offset, limit, ORDER_PAGE_MAX_LIMIT)
+        return await list_orders(query, query.get("created_at", {}).get("$gte"), statuses, sort, offset, limit)
+    response.headers[SYNC_TOKEN_HEADER] = current_sync_token()
     orders = await db.orders.find().to_list(1000)
     return [Order(**parse_from_mongo(order)) for order in orders]
 
+@api_router.get("/orders/counts")
+async def get_order_counts(
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    city: Optional[str] = None,
+    has_tracking: Optional[bool] = None,
+    search: Optional[str] = None,
+):
+    try:
+        query = order_filter_query(created_from, created_to, city, has_tracking, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    counts = await count_orders_by_status(query, query.get("created_at", {}).get("$gte"))
+    return {"total": sum(counts.values()), "by_status": counts}
+
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
-    order = await db.orders.find_one({"id": order_id})
+    order = await find_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return Order(**parse_from_mongo(order))
@@ -299,102 +3336,56 @@ async def get_order(order_id: str):
 @api_router.post("/orders/export-csv")
 async def export_orders_csv(order_ids: List[str]):
     try:
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write CSV headers
-        headers = [
-            "Waybill Number", "Order Number", "Customer Name", "Address", 
-            "Order Description", "Customer First Phone No", "Customer Second Phone No",
-            "COD Amount", "City", "Remarks"
-        ]
-        writer.writerow(headers)
-        
-        # Fetch orders and write data
-        for order_id in order_ids:
-            order = await db.orders.find_one({"id": order_id})
-            if order:
-                order_obj = Order(**parse_from_mongo(order))
-                
-                # Create order description from items
-                order_description = "; ".join([
-                    f"{item.product_name} ({item.size}, {item.color}) x{item.quantity}" 
-                    for item in order_obj.items
-                ])
-                
-                # Extract city from address
-                address_parts = order_obj.customer_address.split(", ")
-                city = address_parts[-2] if len(address_parts) >= 2 else order_obj.customer_city if hasattr(order_obj, 'customer_city') else ""
-                
-                row = [
-                    order_obj.tracking_number or "",
-                    order_obj.order_number or "",
-                    order_obj.customer_name or "",
-                    order_obj.customer_address or "",
-                    order_description,
-                    order_obj.customer_phone or "",
-                    order_obj.customer_phone_2 or "",
-                    order_obj.cod_amount or order_obj.total_amount,
-                    city,
-                    order_obj.remarks or ""
-                ]
-                writer.writerow(row)
-        
-        output.seek(0)
-        csv_content = output.getvalue()
-        output.close()
-        
-        from fastapi.responses import Response
+        csv_content = render_orders_csv(await fetch_orders_by_ids(order_ids))
         return Response(
             content=csv_content,
             media_type="text/csv",
             headers={"Content-Disposition": "attachment; filename=orders_export.csv"}
         )
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
 
 @api_router.put("/orders/{order_id}", response_model=Order)
 async def update_order(order_id: str, order: Order):
-    existing_order = await db.orders.find_one({"id": order_id})
+    existing_order = await find_order_for_update(order_id)
     if not existing_order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     order.updated_at = datetime.now(timezone.utc)
     order_dict = prepare_for_mongo(order.dict())
     await db.orders.update_one({"id": order_id}, {"$set": order_dict})
+    await recompute_customer_stats({existing_order["customer_id"], order.customer_id})
+    await label_cache.forget_order(order_id)
+    publish_event("order_updated", order.dict())
     return order
 
 @api_router.delete("/orders/{order_id}")
 async def delete_order(order_id: str):
-    existing_order = await db.orders.find_one({"id": order_id})
+    existing_order = await find_order_for_update(order_id)
     if not existing_order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     order_obj = Order(**parse_from_mongo(existing_order))
     
     # Restore stock quantities when deleting order
-    for item in order_obj.items:
-        product = await db.products.find_one({"id": item.product_id})
-        if product:
-            product_obj = Product(**parse_from_mongo(product))
-            for variant in product_obj.variants:
-                if variant.id == item.variant_id:
-                    variant.stock_quantity += item.quantity
-                    break
-            
-            product_dict = prepare_for_mongo(product_obj.dict())
-            await db.products.update_one({"id": item.product_id}, {"$set": product_dict})
+    await adjust_stock(order_obj.items, 1)
     
     await db.orders.delete_one({"id": order_id})
+    await recompute_customer_stats([order_obj.customer_id])
+    await label_cache.forget_order(order_id)
+    await record_tombstone("orders", order_id)
+    publish_event("order_deleted", {"id": order_id})
     return {"message": "Order deleted successfully"}
 
 @api_router.put("/orders/{order_id}/status")
-async def update_order_status(order_id: str, status: OrderStatus, tracking_number: Optional[str] = None):
-    order = await db.orders.find_one({"id": order_id})
+async def update_order_status(
+    order_id: str, status: OrderStatus, request: Request, response: Response, tracking_number: Optional[str] = None,
+):
+    return await run_idempotent(request, response, lambda: apply_order_status(order_id, status, tracking_number))
+
+async def apply_order_status(order_id: str, status: OrderStatus, tracking_number: Optional[str] = None) -> dict:
+    order = await find_order_for_update(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -402,29 +3393,24 @@ async def update_order_status(order_id: str, status: OrderStatus, tracking_numbe
     
     # If returning order, restore stock
     if status == OrderStatus.RETURNED and order_obj.status != OrderStatus.RETURNED:
-        for item in order_obj.items:
-            product = await db.products.find_one({"id": item.product_id})
-            if product:
-                product_obj = Product(**parse_from_mongo(product))
-                for variant in product_obj.variants:
-                    if variant.id == item.variant_id:
-                        variant.stock_quantity += item.quantity
-                        break
-                
-                product_dict = prepare_for_mongo(product_obj.dict())
-                await db.products.update_one({"id": item.product_id}, {"$set": product_dict})
+        await adjust_stock(order_obj.items, 1)
     
     update_data = {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}
     if tracking_number:
         update_data["tracking_number"] = tracking_number
     
     await db.orders.update_one({"id": order_id}, {"$set": update_data})
+    await record_status_in_stats(order, status)
+    await label_cache.forget_order(order_id)
+    publish_event("order_status_changed", order_status_event(
+        order_id, status, tracking_number or order_obj.tracking_number
+    ))
     return {"message": "Order status updated successfully"}
 
 # Shipping Label Routes
 @api_router.get("/orders/{order_id}/shipping-label", response_class=HTMLResponse)
 async def get_shipping_label(order_id: str):
-    order = await db.orders.find_one({"id": order_id})
+    order = await find_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -432,65 +3418,43 @@ async def get_shipping_label(order_id: str):
     if not settings:
         settings = BusinessSettings().dict()
     
-    order_obj = Order(**parse_from_mongo(order))
-    settings_obj = BusinessSettings(**settings)
-    
-    # Prepare template variables
-    order_items_html = "<ul>"
-    for item in order_obj.items:
-        order_items_html += f"<li>{item.product_name} ({item.size}, {item.color}) x{item.quantity}</li>"
-    order_items_html += "</ul>"
-    
-    html_content = settings_obj.shipping_label_template
-    html_content = html_content.replace("{{business_name}}", settings_obj.business_name or "")
-    html_content = html_content.replace("{{business_address}}", settings_obj.address or "")
-    html_content = html_content.replace("{{business_phone}}", settings_obj.phone or "")
-    html_content = html_content.replace("{{customer_name}}", order_obj.customer_name or "")
-    html_content = html_content.replace("{{customer_address}}", order_obj.customer_address or "")
-    html_content = html_content.replace("{{customer_phone}}", order_obj.customer_phone or "")
-    html_content = html_content.replace("{{order_number}}", order_obj.order_number or "TBD")
-    html_content = html_content.replace("{{tracking_number}}", order_obj.tracking_number or "TBD")
-    html_content = html_content.replace("{{order_date}}", order_obj.created_at.strftime("%Y-%m-%d") if order_obj.created_at else "")
-    html_content = html_content.replace("{{order_items}}", order_items_html)
-    html_content = html_content.replace("{{total_amount}}", f"{order_obj.total_amount:.2f}" if order_obj.total_amount else "0.00")
-    
-    return HTMLResponse(content=html_content)
+    [label] = await cached_label_fragments([order], settings)
+    return HTMLResponse(content=label)
 
 @api_router.post("/orders/bulk-labels", response_class=HTMLResponse)
 async def get_bulk_shipping_labels(order_ids: List[str]):
     settings = await db.settings.find_one({"id": "business_settings"})
     if not settings:
         settings = BusinessSettings().dict()
-    
-    settings_obj = BusinessSettings(**settings)
-    bulk_html = ""
-    
-    for order_id in order_ids:
-        order = await db.orders.find_one({"id": order_id})
-        if order:
-            order_obj = Order(**parse_from_mongo(order))
-            
-            order_items_html = "<ul>"
-            for item in order_obj.items:
-                order_items_html += f"<li>{item.product_name} ({item.size}, {item.color}) x{item.quantity}</li>"
-            order_items_html += "</ul>"
-            
-            html_content = settings_obj.shipping_label_template
-            html_content = html_content.replace("{{business_name}}", settings_obj.business_name or "")
-            html_content = html_content.replace("{{business_address}}", settings_obj.address or "")
-            html_content = html_content.replace("{{business_phone}}", settings_obj.phone or "")
-            html_content = html_content.replace("{{customer_name}}", order_obj.customer_name or "")
-            html_content = html_content.replace("{{customer_address}}", order_obj.customer_address or "")
-            html_content = html_content.replace("{{customer_phone}}", order_obj.customer_phone or "")
-            html_content = html_content.replace("{{order_number}}", order_obj.order_number or "TBD")
-            html_content = html_content.replace("{{tracking_number}}", order_obj.tracking_number or "TBD")
-            html_content = html_content.replace("{{order_date}}", order_obj.created_at.strftime("%Y-%m-%d") if order_obj.created_at else "")
-            html_content = html_content.replace("{{order_items}}", order_items_html)
-            html_content = html_content.replace("{{total_amount}}", f"{order_obj.total_amount:.2f}" if order_obj.total_amount else "0.00")
-            
-            bulk_html += html_content + '<div style="page-break-after: always;"></div>'
-    
-    return HTMLResponse(content=bulk_html)
+    return HTMLResponse(content=await render_bulk_labels(await fetch_orders_by_ids(order_ids), settings))
+
+# Job Routes
+@api_router.post("/jobs/{kind}", response_model=Job, status_code=202)
+async def create_job(kind: str, order_ids: List[str], request: Request, response: Response):
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind; use {', '.join(JOB_KINDS)}")
+    if not 1 <= len(order_ids) <= JOB_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Submit between 1 and {JOB_MAX_ORDERS} order ids")
+    return await run_idempotent(request, response, lambda: submit_job(kind, order_ids))
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**parse_from_mongo(job))
+
+@api_router.get("/jobs/{job_id}/download")
+async def download_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != JobStatus.SUCCEEDED.value:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    path = job_artifact_path(job_id, job["kind"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Job output has expired")
+    return FileResponse(path, media_type=JOB_KINDS[job["kind"]][1], filename=job["filename"])
 
 # Finance Routes
 @api_router.get("/finance/daily-sales")
@@ -501,10 +3465,10 @@ async def get_daily_sales(date: str = None):
     start_date = datetime.fromisoformat(f"{date}T00:00:00")
     end_date = datetime.fromisoformat(f"{date}T23:59:59")
     
-    orders = await db.orders.find({
+    orders = await find_orders({
         "created_at": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
         "status": {"$ne": "returned"}
-    }).to_list(1000)
+    }, start_date.isoformat())
     
     total_sales = sum(order["total_amount"] for order in orders)
     total_orders = len(orders)
@@ -521,10 +3485,10 @@ async def get_profit_loss(start_date: str, end_date: str):
     start = datetime.fromisoformat(f"{start_date}T00:00:00")
     end = datetime.fromisoformat(f"{end_date}T23:59:59")
     
-    orders = await db.orders.find({
+    orders = await find_orders({
         "created_at": {"$gte": start.isoformat(), "$lte": end.isoformat()},
         "status": {"$ne": "returned"}
-    }).to_list(1000)
+    }, start.isoformat())
     
     total_revenue = sum(order["total_amount"] for order in orders)
     total_actual_cost = 0.0
@@ -532,28 +3496,23 @@ async def get_profit_loss(start_date: str, end_date: str):
     items_with_cost_data = 0
     total_items = 0
     
+    # Buy prices come from the catalog snapshot
+    order_objs = [Order(**parse_from_mongo(order)) for order in orders]
+    await catalog.ensure_variants(item for order_obj in order_objs for item in order_obj.items)
+    
     # Calculate actual costs from buy prices
-    for order in orders:
-        order_obj = Order(**parse_from_mongo(order))
+    for order_obj in order_objs:
         for item in order_obj.items:
             total_items += item.quantity
-            # Try to get actual buy price from product variant
-            product = await db.products.find_one({"id": item.product_id})
-            if product:
-                product_obj = Product(**parse_from_mongo(product))
-                for variant in product_obj.variants:
-                    if variant.id == item.variant_id and variant.buy_price:
-                        actual_cost = variant.buy_price * item.quantity
-                        total_actual_cost += actual_cost
-                        items_with_cost_data += item.quantity
-                        break
-                else:
-                    # No buy price found, use estimated cost
-                    estimated_cost = item.unit_price * 0.6 * item.quantity
-                    total_estimated_cost += estimated_cost
+            variant = catalog.variant(item.product_id, item.variant_id)
+            buy_price = variant.buy_price if variant else None
+            if buy_price:
+                actual_cost = buy_price * item.quantity
+                total_actual_cost += actual_cost
+                items_with_cost_data += item.quantity
             else:
-                # Product not found, use estimated cost
-                estimated_cost = item.unit_price * 0.6 * item.quantity
+                # No buy price found, use estimated cost
+                estimated_cost = item.unit_price * ESTIMATED_COST_RATIO * item.quantity
                 total_estimated_cost += estimated_cost
     
     total_cost = total_actual_cost + total_estimated_cost
@@ -574,6 +3533,64 @@ async def get_profit_loss(start_date: str, end_date: str):
         "total_items_sold": total_items
     }
 
+@api_router.get("/finance/export")
+async def export_finance_lines(start_date: str, end_date: str, format: str = "csv"):
+    if format not in FINANCE_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {format!r}; use csv or parquet")
+    if format == "parquet" and pq is None:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow")
+    try:
+        datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+
+    frames = iter_finance_frames(start_date, end_date)
+    headers = {"Content-Disposition": f'attachment; filename="finance_{start_date}_{end_date}.{format}"'}
+    if format == "csv":
+        return StreamingResponse(finance_csv_chunks(frames), media_type="text/csv", headers=headers)
+
+    # Parquet's footer is written last, so build the file before sending it
+    spool = tempfile.SpooledTemporaryFile(max_size=FINANCE_EXPORT_SPOOL_BYTES)
+    await write_finance_parquet(frames, spool)
+    spool.seek(0)
+
+    def read_spool():
+        with spool:
+            yield from iter(lambda: spool.read(1024 * 1024), b"")
+
+    return StreamingResponse(read_spool(), media_type="application/vnd.apache.parquet", headers=headers)
+
+# Analytics Routes
+@api_router.get("/analytics/sales")
+async def get_sales_analytics(
+    start_date: str,
+    end_date: str,
+    group_by: str = "product",
+    sort_by: str = "revenue",
+    top: Optional[int] = None,
+):
+    try:
+        datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+        dimensions = parse_sales_dimensions(group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if sort_by not in SALES_METRICS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(SALES_METRICS)}")
+    if top is not None and top < 1:
+        raise HTTPException(status_code=400, detail="top must be at least 1")
+    return await sales_breakdown(start_date, end_date, dimensions, sort_by, top)
+
+# Inventory Routes
+@api_router.get("/inventory/valuation")
+async def get_inventory_valuation(level: str = "product", window_days: int = INVENTORY_VELOCITY_DAYS, top: Optional[int] = None):
+    if level not in INVENTORY_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {', '.join(INVENTORY_LEVELS)}")
+    if not 1 <= window_days <= 365:
+        raise HTTPException(status_code=400, detail="window_days must be between 1 and 365")
+    if top is not None and top < 1:
+        raise HTTPException(status_code=400, detail="top must be at least 1")
+    return await inventory_valuation(level, window_days, top)
+
 # Settings Routes
 @api_router.get("/settings", response_model=BusinessSettings)
 async def get_settings():
@@ -593,8 +3610,34 @@ async def update_settings(settings: BusinessSettings):
         {"$set": settings_dict}, 
         upsert=True
     )
+    await label_cache.clear()
+    publish_event("settings_changed", settings.dict())
     return settings
 
+# Live events
+@api_router.get("/events")
+async def stream_events(request: Request):
+    queue = broadcaster.subscribe(request.headers.get("last-event-id"))
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Dashboard route
 @api_router.get("/dashboard")
 async def get_dashboard():
@@ -606,13 +3649,15 @@ async def get_dashboard():
     low_stock = await get_low_stock_products()
     
     # Get recent orders
-    recent_orders = await db.orders.find().sort("created_at", -1).limit(10).to_list(10)
+    orders = read_db().orders
+    recent_orders = await orders.find().sort("created_at", -1).limit(10).to_list(10)
     
-    # Get order status counts
-    total_orders = await db.orders.count_documents({})
-    pending_orders = await db.orders.count_documents({"status": "pending"})
-    on_courier_orders = await db.orders.count_documents({"status": "on_courier"})
-    delivered_orders = await db.orders.count_documents({"status": "delivered"})
+    # Get order status counts; archived orders are only ever delivered or returned
+    archived = await archive_state.current()
+    total_orders = await orders.estimated_document_count() + archived.total
+    pending_orders = await orders.count_documents({"status": "pending"})
+    on_courier_orders = await orders.count_documents({"status": "on_courier"})
+    delivered_orders = await orders.count_documents({"status": "delivered"}) + archived.counts.get("delivered", 0)
     
     return {
         "daily_sales": daily_sales,
@@ -627,16 +3672,55 @@ async def get_dashboard():
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def pool_status() -> dict:
+    pools = mongo_pool_stats.snapshot()
+    return {
+        "max_pool_size": MONGO_CLIENT_OPTIONS["maxPoolSize"],
+        "checked_out": sum(pool["checked_out"] for pool in pools.values()),
+        "wait_queue": sum(pool["waiting"] for pool in pools.values()),
+        "servers": pools,
+    }
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Liveness only: a Mongo outage should mark workers unready, not restart them
+    return {
+        "status": "ok", "pool": pool_status(), "catalog": catalog.status(),
+        "label_cache": label_cache.status(), "admission": admission_status(),
+    }
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz(response: Response):
+    if not getattr(app.state, "ready", False):
+        response.status_code = 503
+        return {"status": "not_ready", "pool": pool_status()}
+    try:
+        await asyncio.wait_for(db.command("ping"), READINESS_PING_TIMEOUT)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        response.status_code = 503
+        return {"status": "unavailable", "error": str(e) or type(e).__name__, "pool": pool_status()}
+    return {"status": "ready", "pool": pool_status()}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Inside CORS, so browsers can read the 429 and its Retry-After
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SYNC_TOKEN_HEADER, IDEMPOTENCY_REPLAYED_HEADER, "Retry-After"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+# Outermost, so sizes are measured as sent and latency includes compression
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -645,6 +3729,90 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+app.on_event("startup")(connect_mongo)
+
+@app.on_event("startup")
+async def ensure_indexes():
+    for collection in ("products", "customers"):
+        await db[collection].create_index("id")
+    for collection in ("orders", ORDERS_ARCHIVE):
+        # Moves between the two upsert on id, which only a unique index makes safe
+        await ensure_unique_index(collection, "id")
+    await ensure_unique_sku_index()
+    await db.products.create_index("name")
+    await db.orders.create_index("created_at")
+    await db.orders.create_index([("status", 1), ("created_at", -1)])
+    await db.orders.create_index([("customer_id", 1), ("created_at", -1)])
+    for collection in ("orders", ORDERS_ARCHIVE):
+        await db[collection].create_index([("customer_city", 1), ("status", 1), ("created_at", -1)])
+        await db[collection].create_index("order_number")
+        await db[collection].create_index("tracking_number")
+    await db[ORDERS_ARCHIVE].create_index([("customer_id", 1), ("created_at", -1)])
+    await db.customer_stats.create_index("customer_id", unique=True)
+    for field in CUSTOMER_SORT_FIELDS:
+        await db.customer_stats.create_index([(field, -1), ("customer_id", 1)])
+    await db[ORDERS_ARCHIVE].create_index("created_at")
+    await db[ORDERS_ARCHIVE].create_index([("status", 1), ("created_at", -1)])
+    await db.settings.create_index("id")
+    await db.idempotency_keys.create_index(
+        "created_at", name="idempotency_ttl", expireAfterSeconds=int(IDEMPOTENCY_TTL_HOURS * 3600)
+    )
+    await db.jobs.create_index("id")
+    await db.jobs.create_index([("status", 1), ("updated_at", 1)])
+    await db.jobs.create_index("expires_at")
+    await db.customers.create_index("phone_normalized")
+    for collection in ("products", "customers", "orders"):
+        await db[collection].create_index([("updated_at", 1), ("id", 1)])
+    await db.tombstones.create_index([("collection", 1), ("deleted_at", 1), ("id", 1)])
+    await db.tombstones.create_index(
+        "deleted_at", name="tombstone_ttl", expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 86400
+    )
+
+@app.on_event("startup")
+async def migrate_customer_phones():
+    await backfill_customer_phones()
+
+@app.on_event("startup")
+async def init_order_counter():
+    await ensure_order_counter()
+
+@app.on_event("startup")
+async def load_archive_state():
+    await archive_state.load()
+
+@app.on_event("startup")
+async def build_customer_stats():
+    # Before any order write adjusts stats incrementally
+    await build_customer_stats_once()
+
+@app.on_event("startup")
+async def load_catalog():
+    await catalog.load()
+    app.state.catalog_refresh_task = asyncio.create_task(refresh_catalog_periodically())
+
+@app.on_event("startup")
+async def start_job_cleanup():
+    app.state.job_cleanup_task = asyncio.create_task(cleanup_jobs_periodically())
+
+@app.on_event("startup")
+async def start_event_source():
+    if EVENTS_SOURCE == "change_stream":
+        app.state.change_stream_task = asyncio.create_task(watch_change_streams())
+
+@app.on_event("startup")
+async def mark_ready():
+    # Registered last: /readyz only passes once the pool is warm and indexes exist
+    app.state.ready = True
+
+@app.on_event("shutdown")
+async def mark_not_ready():
+    app.state.ready = False
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for name in ("change_stream_task", "catalog_refresh_task", "job_cleanup_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    stop_job_pool()
     client.close()
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""Fixtures for tests that run the API in-process against a local mongod.
+
+Tests using them are skipped when the backend dependencies are not installed
+or no mongod answers at TEST_MONGO_URL (default mongodb://localhost:27017).
+"""
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL", "mongodb://localhost:27017")
+# server.py reads these at import time
+os.environ.setdefault("MONGO_URL", TEST_MONGO_URL)
+os.environ.setdefault("DB_NAME", f"pos_test_{uuid.uuid4().hex[:8]}")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+
+@pytest.fixture(scope="session")
+def mongo():
+    """Skip unless the backend dependencies are installed and a mongod answers."""
+    pymongo = pytest.importorskip("pymongo")
+    for module in ("motor", "fastapi", "httpx"):
+        pytest.importorskip(module)
+    try:
+        pymongo.MongoClient(TEST_MONGO_URL, serverSelectionTimeoutMS=500).admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {TEST_MONGO_URL}")
+    return pymongo
+
+
+def make_command_recorder(monitoring):
+    class CommandRecorder(monitoring.CommandListener):
+        """Collects every command the API's Motor client sends while recording is on."""
+
+        IGNORED = {"endSessions", "killCursors"}
+
+        def __init__(self):
+            self.commands = []
+            self.recording = False
+
+        def started(self, event):
+            if self.recording and event.command_name not in self.IGNORED:
+                target = event.command.get(event.command_name)
+                self.commands.append(
+                    (event.command_name, target if isinstance(target, str) else None, event.command)
+                )
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+        def __enter__(self):
+            self.commands = []
+            self.recording = True
+            return self
+
+        def __exit__(self, *exc):
+            self.recording = False
+
+        @property
+        def count(self) -> int:
+            return len(self.commands)
+
+    return CommandRecorder()
+
+
+@pytest.fixture(scope="session")
+def make_recorder(mongo):
+    return lambda: make_command_recorder(mongo.monitoring)
+
+
+@pytest.fixture
+def recorder(make_recorder):
+    return make_recorder()
+
+
+@pytest.fixture
+def sync_db(mongo):
+    """Synchronous handle on the test database for seeding and assertions."""
+    client = mongo.MongoClient(TEST_MONGO_URL)
+    database = client[os.environ["DB_NAME"]]
+    yield database
+    client.drop_database(database.name)
+    client.close()
+
+
+@contextmanager
+def in_process_api(db_name: str, listener):
+    """TestClient for the app on ``db_name`` whose Motor client also reports commands to ``listener``."""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    # The startup hook creates the client on the TestClient's event loop
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(server, "DB_NAME", db_name)
+        patch.setattr(server, "mongo_event_listeners", [*server.mongo_event_listeners, listener])
+        with TestClient(server.app) as http:
+            yield http
+
+
+@pytest.fixture
+def api(recorder, sync_db):
+    with in_process_api(sync_db.name, recorder) as http:
+        yield http
+
+
+@pytest.fixture(scope="session")
+def make_api(mongo):
+    """Factory for in-process API clients on a given database, for module-scoped setups."""
+    return in_process_api
+
+
+@pytest.fixture(scope="session")
+def backend():
+    """The server module, for unit tests that need its dependencies but no mongod."""
+    for module in ("pymongo", "motor", "fastapi", "httpx"):
+        pytest.importorskip(module)
+    import server
+
+    return server
+
+
+def product_doc(name: str = "Test Tee", category: str = "T-Shirts", variants=None, *, stock: int = 10,
+                price: float = 1800.0, buy_price=900.0, color: str = "Black", low_stock_threshold: int = 5) -> dict:
+    """A product as stored and as posted; ``variants`` are (size, stock, buy_price) tuples, by default one M."""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()), "name": name, "description": "", "category": category,
+        "low_stock_threshold": low_stock_threshold,
+        "variants": [
+            {"id": str(uuid.uuid4()), "size": size, "color": color, "sku": f"SKU-{uuid.uuid4().hex[:8]}",
+             "stock_quantity": quantity, "price": price, "buy_price": cost, "purchase_date": None}
+            for size, quantity, cost in variants or [("M", stock, buy_price)]
+        ],
+        "created_at": now, "updated_at": now,
+    }
+
+
+def order_doc(lines=None, *, customer=None, city: str = "Colombo", status: str = "pending", days_ago: int = 0,
+              unit_price=None, courier_charges: float = 350.0, **fields) -> dict:
+    """An order as stored and as posted; ``lines`` are (product, variant index, quantity) tuples.
+
+    Without ``lines`` it has one unit of a product that is not in the database.
+    ``unit_price`` overrides the variant prices, and ``fields`` any other field.
+    """
+    created = (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+    customer = customer or {
+        "id": str(uuid.uuid4()), "name": "Test Customer", "address": f"No. 1, Station Road, {city}, 10000",
+        "phone": "0771234567", "city": city,
+    }
+    items = []
+    for product, index, quantity in lines or [(product_doc(), 0, 1)]:
+        variant = product["variants"][index]
+        price = variant["price"] if unit_price is None else unit_price
+        items.append({
+            "product_id": product["id"], "variant_id": variant["id"], "product_name": product["name"],
+            "size": variant["size"], "color": variant["color"], "quantity": quantity,
+            "unit_price": price, "total_price": price * quantity,
+        })
+    subtotal = sum(item["total_price"] for item in items)
+    return {
+        "id": str(uuid.uuid4()), "order_number": f"ORD-{uuid.uuid4().hex[:6].upper()}",
+        "customer_id": customer["id"], "customer_name": customer["name"], "customer_address": customer["address"],
+        "customer_phone": customer["phone"], "customer_city": customer["city"], "items": items,
+        "subtotal": subtotal, "tax_amount": 0.0, "courier_charges": courier_charges, "discount_amount": 0.0,
+        "discount_percentage": 0.0, "total_amount": subtotal + courier_charges, "status": status,
+        "created_at": created, "updated_at": created, **fields,
+    }
+
+
+@pytest.fixture(scope="session")
+def make_product():
+    return product_doc
+
+
+@pytest.fixture(scope="session")
+def make_order():
+    return order_doc
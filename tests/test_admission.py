@@ -0,0 +1,74 @@
+"""Admission lanes: heavy routes are bounded, interactive ones keep priority, overload gets 429."""
+import asyncio
+from datetime import date
+
+
+def _profit_loss(api):
+    today = date.today().isoformat()
+    return api.get("/api/finance/profit-loss", params={"start_date": today, "end_date": today})
+
+
+def test_saturated_heavy_lane_fast_fails_without_touching_pos_routes(api, backend, monkeypatch):
+    monkeypatch.setattr(backend.heavy_lane, "limit", 0)
+    monkeypatch.setattr(backend.heavy_lane, "queue_size", 0)
+    rejected = backend.admission_rejections.labels("heavy", "queue_full")._value.get()
+
+    response = _profit_loss(api)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "5"
+    assert backend.admission_rejections.labels("heavy", "queue_full")._value.get() == rejected + 1
+
+    assert api.get("/api/products").status_code == 200
+    assert api.get("/healthz").json()["admission"]["heavy"]["limit"] == 0
+
+
+def test_queued_requests_time_out_with_429(api, backend, monkeypatch):
+    monkeypatch.setattr(backend.heavy_lane, "limit", 0)
+    monkeypatch.setattr(backend.heavy_lane, "queue_size", 1)
+    monkeypatch.setattr(backend.heavy_lane, "timeout", 0.05)
+    assert _profit_loss(api).status_code == 429
+    assert backend.heavy_lane.queued == 0
+
+
+def test_queue_depth_is_exported(api):
+    body = api.get("/metrics").text
+    assert 'admission_queued_requests{lane="heavy"}' in body
+    assert 'admission_active_requests{lane="interactive"}' in body
+
+
+def test_heavy_requests_wait_while_interactive_ones_are_queued(api, backend):
+    Lane = backend.AdmissionLane
+
+    async def scenario():
+        interactive = Lane("interactive", 1, 4, 1.0, 1)
+        heavy = Lane("heavy", 2, 4, 1.0, 5, yields_to=interactive)
+        order = []
+
+        async def request(lane, name, hold):
+            assert await lane.acquire() is None
+            order.append(name)
+            await asyncio.sleep(hold)
+            lane.release()
+
+        holder = asyncio.create_task(request(interactive, "pos-1", 0.05))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(request(interactive, "pos-2", 0.05))
+        await asyncio.sleep(0)
+        # The heavy lane has free slots but must not start while pos-2 is queued
+        report = asyncio.create_task(request(heavy, "report", 0))
+        await asyncio.sleep(0.01)
+        while_queued = heavy.status()
+        await asyncio.gather(holder, queued, report)
+        return order, while_queued, interactive.status(), heavy.status()
+
+    order, while_queued, interactive, heavy = api.portal.call(scenario)
+    assert while_queued["active"] == 0 and while_queued["queued"] == 1
+    assert sorted(order) == ["pos-1", "pos-2", "report"]
+    assert interactive["active"] == heavy["active"] == 0
+
+
+def test_long_lived_and_health_routes_are_exempt(backend):
+    assert backend.admission_lane("GET", "/api/events") is None
+    assert backend.admission_lane("GET", "/healthz") is None
+    assert backend.admission_lane("POST", "/api/orders") is backend.interactive_lane
+    assert backend.admission_lane("POST", "/api/orders/bulk-labels") is backend.heavy_lane
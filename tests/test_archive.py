@@ -0,0 +1,90 @@
+"""Hot/cold order archival and reads that span both collections."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def seeded(api, sync_db, make_order):
+    orders = {
+        "old_delivered": make_order(status="delivered", days_ago=400),
+        "old_returned": make_order(status="returned", days_ago=300),
+        "old_pending": make_order(status="pending", days_ago=400),
+        "recent_delivered": make_order(status="delivered", days_ago=10),
+    }
+    sync_db.orders.insert_many([dict(order) for order in orders.values()])
+    return orders
+
+
+def _archive(api, **kwargs):
+    import server
+
+    return api.portal.call(lambda: server.archive_orders(older_than_days=180, announce_wait=0, **kwargs))
+
+
+def _profit_loss(api):
+    today = datetime.now(timezone.utc).date()
+    return api.get("/api/finance/profit-loss", params={
+        "start_date": (today - timedelta(days=500)).isoformat(), "end_date": today.isoformat(),
+    }).json()
+
+
+def test_only_old_terminal_orders_move(api, sync_db, seeded):
+    summary = _archive(api, batch_size=1)
+    assert summary["archived"] == 2
+    assert summary["counts"] == {"delivered": 1, "returned": 1}
+    hot = {order["id"] for order in sync_db.orders.find()}
+    archived = {order["id"] for order in sync_db.orders_archive.find()}
+    assert hot == {seeded["old_pending"]["id"], seeded["recent_delivered"]["id"]}
+    assert archived == {seeded["old_delivered"]["id"], seeded["old_returned"]["id"]}
+    # Re-running has nothing left to move
+    assert _archive(api)["archived"] == 0
+
+
+def test_reads_span_hot_and_archive(api, seeded):
+    before_totals = _profit_loss(api)
+    before_dashboard = api.get("/api/dashboard").json()["order_stats"]
+    _archive(api)
+
+    old_id = seeded["old_delivered"]["id"]
+    assert api.get(f"/api/orders/{old_id}").json()["id"] == old_id
+    assert api.get(f"/api/orders/{old_id}/shipping-label").status_code == 200
+    ids = [old_id, seeded["recent_delivered"]["id"]]
+    export = api.post("/api/orders/export-csv", json=ids)
+    assert export.status_code == 200
+    assert seeded["old_delivered"]["order_number"] in export.text
+    assert _profit_loss(api)["total_revenue"] == before_totals["total_revenue"]
+    assert api.get("/api/dashboard").json()["order_stats"] == before_dashboard
+
+
+def test_changing_an_archived_order_moves_it_back(api, sync_db, seeded):
+    _archive(api)
+    old_id = seeded["old_delivered"]["id"]
+    response = api.put(f"/api/orders/{old_id}/status", params={"status": "returned"})
+    assert response.status_code == 200
+    assert sync_db.orders.find_one({"id": old_id})["status"] == "returned"
+    assert sync_db.orders_archive.find_one({"id": old_id}) is None
+    state = sync_db.counters.find_one({"_id": "order_archive"})
+    assert state["counts"] == {"delivered": 0, "returned": 1}
+    # The next run archives it again under its new status
+    assert _archive(api)["counts"] == {"delivered": 0, "returned": 2}
+
+
+def test_concurrent_updates_move_an_archived_order_back_once(api, sync_db, seeded):
+    import asyncio
+
+    import server
+
+    _archive(api)
+    old_id = seeded["old_delivered"]["id"]
+
+    async def move_back_twice():
+        return await asyncio.gather(*(server.find_order_for_update(old_id) for _ in range(2)))
+
+    first, second = api.portal.call(move_back_twice)
+    assert first["id"] == second["id"] == old_id
+    assert sync_db.orders.count_documents({"id": old_id}) == 1
+    assert sync_db.orders_archive.find_one({"id": old_id}) is None
+    state = sync_db.counters.find_one({"_id": "order_archive"})
+    assert state["counts"] == {"delivered": 0, "returned": 1}
+    assert sync_db.orders.index_information()["id_1"]["unique"] is True
@@ -0,0 +1,79 @@
+"""In-process catalog snapshot: write-through, delta refresh and fallbacks."""
+import uuid
+from datetime import datetime, timezone
+
+
+def test_writes_through_the_api_update_the_snapshot(api, backend, make_product, make_order):
+    catalog = backend.catalog
+    product = make_product(stock=6)
+    version = catalog.version
+    assert api.post("/api/products", json=product).status_code == 200
+    assert product["id"] in catalog.products
+    assert catalog.version > version
+
+    assert api.post("/api/orders", json=make_order([(product, 0, 2)])).status_code == 200
+    assert catalog.variant(product["id"], product["variants"][0]["id"]).stock_quantity == 4
+    low_stock = api.get("/api/products/low-stock").json()
+    assert [item["variant_id"] for item in low_stock] == [product["variants"][0]["id"]]
+
+    assert api.delete(f"/api/products/{product['id']}").status_code == 200
+    assert product["id"] not in catalog.products
+    assert api.get("/api/products/low-stock").json() == []
+
+
+def test_updates_keep_the_path_id_whatever_the_body_says(api, backend, sync_db, make_product):
+    catalog = backend.catalog
+    product = make_product()
+    api.post("/api/products", json=product)
+
+    body = dict(product, id=str(uuid.uuid4()), name="Renamed Tee")
+    response = api.put(f"/api/products/{product['id']}", json=body)
+    assert response.json()["id"] == product["id"]
+    assert sync_db.products.count_documents({"id": body["id"]}) == 0
+    assert sync_db.products.find_one({"id": product["id"]})["name"] == "Renamed Tee"
+    assert catalog.products[product["id"]].name == "Renamed Tee"
+    assert body["id"] not in catalog.products
+
+
+def test_updates_to_unknown_products_leave_the_snapshot_alone(api, backend, make_product, make_order):
+    product = make_product()
+    response = api.put(f"/api/products/{product['id']}", json=product)
+    assert response.status_code == 404
+    assert product["id"] not in backend.catalog.products
+    assert api.post("/api/orders", json=make_order([(product, 0, 1)])).status_code == 400
+
+
+def test_refresh_applies_writes_made_directly_in_mongo(api, backend, sync_db, make_product):
+    catalog = backend.catalog
+    kept, removed = make_product(), make_product()
+    for product in (kept, removed):
+        assert api.post("/api/products", json=product).status_code == 200
+    outside = make_product(stock=1)
+    sync_db.products.insert_one(dict(outside))
+    sync_db.products.update_one({"id": kept["id"]}, {"$set": {
+        "variants.0.buy_price": 1000.0, "updated_at": datetime.now(timezone.utc).isoformat(),
+    }})
+    # Another worker deleting a product leaves the document gone and a tombstone behind
+    sync_db.products.delete_one({"id": removed["id"]})
+    sync_db.tombstones.insert_one({"collection": "products", "id": removed["id"], "deleted_at": datetime.now(timezone.utc)})
+
+    api.portal.call(catalog.refresh)
+
+    assert outside["id"] in catalog.products
+    assert removed["id"] not in catalog.products
+    assert catalog.variant(kept["id"], kept["variants"][0]["id"]).buy_price == 1000.0
+
+
+def test_orders_for_products_not_yet_in_the_snapshot_are_accepted(api, backend, sync_db, make_product, make_order):
+    product = make_product()
+    sync_db.products.insert_one(dict(product))
+    response = api.post("/api/orders", json=make_order([(product, 0, 1)]))
+    assert response.status_code == 200
+    assert product["id"] in backend.catalog.products
+
+
+def test_orders_for_unknown_variants_are_rejected(api, make_product, make_order):
+    product = make_product()
+    response = api.post("/api/orders", json=make_order([(product, 0, 1)]))
+    assert response.status_code == 400
+    assert product["variants"][0]["id"] in response.json()["detail"]
@@ -0,0 +1,141 @@
+"""Response compression middleware, driven as plain ASGI (no mongod)."""
+import asyncio
+import gzip
+import json
+
+import pytest
+
+LARGE = json.dumps([{"id": i, "name": f"Product {i}", "category": "T-Shirts"} for i in range(200)]).encode()
+
+
+def _app(chunks, content_type: str = "application/json", extra_headers=()):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type.encode()), *extra_headers]
+        if len(chunks) == 1:
+            headers.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    return app
+
+
+def _run(backend, app, accept_encoding=None, method="GET", minimum_size=1024):
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    scope = {"type": "http", "method": method, "path": "/", "headers": headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(backend.CompressionMiddleware(app, minimum_size=minimum_size)(scope, receive, send))
+    start, *bodies = messages
+    return backend.Headers(raw=start["headers"]), bodies
+
+
+def _body(bodies) -> bytes:
+    return b"".join(message["body"] for message in bodies)
+
+
+@pytest.fixture
+def without_brotli(backend, monkeypatch):
+    monkeypatch.setattr(backend, "brotli", None)
+    return backend
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0.1, identity", "gzip"),
+    ("identity", None),
+    ("", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("*, gzip;q=0", None),
+    ("br", None),
+    ("br, gzip", "gzip"),
+])
+def test_negotiation_without_brotli(without_brotli, header, expected):
+    assert without_brotli.negotiate_encoding(header) == expected
+
+
+def test_negotiation_prefers_brotli_by_weight(backend):
+    pytest.importorskip("brotli")
+    assert backend.negotiate_encoding("gzip, br") == "br"
+    assert backend.negotiate_encoding("br;q=0.5, gzip") == "gzip"
+    assert backend.negotiate_encoding("br;q=0, gzip") == "gzip"
+
+
+def test_large_responses_are_compressed(without_brotli):
+    headers, bodies = _run(without_brotli, _app([LARGE]), "gzip, deflate")
+    assert headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in headers["vary"]
+    assert int(headers["content-length"]) == len(_body(bodies)) < len(LARGE)
+    assert gzip.decompress(_body(bodies)) == LARGE
+
+
+def test_brotli_responses_decode(backend):
+    brotli = pytest.importorskip("brotli")
+    headers, bodies = _run(backend, _app([LARGE]), "br")
+    assert headers["content-encoding"] == "br"
+    assert brotli.decompress(_body(bodies)) == LARGE
+
+
+def test_small_responses_pass_through_with_vary(without_brotli):
+    headers, bodies = _run(without_brotli, _app([b'{"ok": true}']), "gzip")
+    assert "content-encoding" not in headers
+    assert "Accept-Encoding" in headers["vary"]
+    assert headers["content-length"] == "12"
+    assert _body(bodies) == b'{"ok": true}'
+
+
+def test_refused_encodings_leave_the_response_alone(without_brotli):
+    for accept_encoding in (None, "gzip;q=0"):
+        headers, bodies = _run(without_brotli, _app([LARGE]), accept_encoding)
+        assert "content-encoding" not in headers
+        assert _body(bodies) == LARGE
+
+
+def test_streamed_bodies_are_compressed_incrementally(without_brotli):
+    chunks = [b"order_number,total\n"] + [f"ORD-{i:05d},{i * 10}\n".encode() * 20 for i in range(10)]
+    headers, bodies = _run(without_brotli, _app(chunks, "text/csv; charset=utf-8"), "gzip", minimum_size=256)
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    # The header row is buffered until the threshold, then every chunk is flushed as it arrives
+    assert len(bodies) == len(chunks) - 1
+    assert all(message["more_body"] for message in bodies[:-1]) and not bodies[-1]["more_body"]
+    assert gzip.decompress(_body(bodies)) == b"".join(chunks)
+
+
+def test_short_streams_are_sent_uncompressed(without_brotli):
+    chunks = [b"a,b\n", b"1,2\n"]
+    headers, bodies = _run(without_brotli, _app(chunks, "text/csv"), "gzip")
+    assert "content-encoding" not in headers
+    assert _body(bodies) == b"".join(chunks)
+
+
+def test_event_streams_and_encoded_bodies_pass_through(without_brotli):
+    events = [b"id: 1\nevent: order_created\ndata: {}\n\n" * 100, b"id: 2\nevent: resync\ndata: {}\n\n"]
+    headers, bodies = _run(without_brotli, _app(events, "text/event-stream"), "gzip")
+    assert "content-encoding" not in headers and "vary" not in headers
+    assert [message["body"] for message in bodies] == events
+
+    already = gzip.compress(LARGE)
+    headers, bodies = _run(without_brotli, _app([already], extra_headers=[(b"content-encoding", b"gzip")]), "gzip")
+    assert _body(bodies) == already
+
+
+def test_head_requests_keep_their_content_length(without_brotli):
+    async def head_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(LARGE)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    headers, bodies = _run(without_brotli, head_app, "gzip", method="HEAD")
+    assert "content-encoding" not in headers
+    assert headers["content-length"] == str(len(LARGE))
+    assert _body(bodies) == b""
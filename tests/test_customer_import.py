@@ -0,0 +1,83 @@
+"""Customer import: phone-based merging, rejected rows, write failures and the phone backfill."""
+import io
+import uuid
+
+HEADER = "name,email,phone,address,city,postal_code"
+
+
+def _row(name: str, phone: str, city: str = "Kandy") -> str:
+    return f"{name},{name.lower()}@example.lk,{phone},No. 1 Park Road,{city},20000"
+
+
+def _import(api, *rows: str, batch_size: int = 500) -> dict:
+    content = "\n".join([HEADER, *rows]) + "\n"
+    response = api.post(
+        "/api/customers/import",
+        files={"file": ("customers.csv", io.BytesIO(content.encode()), "text/csv")},
+        data={"batch_size": str(batch_size)},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_rows_merge_into_existing_customers_by_phone(api, sync_db):
+    existing = {"id": str(uuid.uuid4()), "name": "Nimal", "email": "nimal@example.lk", "phone": "077 123 4567",
+                "address": "No. 2 Lake Road", "city": "Kandy", "postal_code": "20000"}
+    api.post("/api/customers", json=existing)
+
+    summary = _import(api, _row("Nimal", "+94771234567", city="Galle"), _row("Kamala", "0712223334"))
+
+    assert (summary["inserted"], summary["merged"], summary["rejected"]) == (1, 1, 0)
+    assert sync_db.customers.count_documents({"phone_normalized": "+94771234567"}) == 1
+    assert sync_db.customers.find_one({"id": existing["id"]})["city"] == "Galle"
+    kamala = sync_db.customers.find_one({"phone_normalized": "+94712223334"})
+    assert sync_db.customer_stats.count_documents({"customer_id": kamala["id"]}) == 1
+
+
+def test_duplicates_within_a_batch_become_one_customer(api, sync_db):
+    summary = _import(api, _row("Sunil", "0759990001"), _row("Sunil", "94759990001", city="Matara"))
+
+    assert (summary["rows"], summary["inserted"], summary["merged"]) == (2, 1, 1)
+    customers = list(sync_db.customers.find({"phone_normalized": "+94759990001"}))
+    assert [customer["city"] for customer in customers] == ["Matara"]
+
+
+def test_unparseable_phones_are_rejected(api, sync_db):
+    summary = _import(api, _row("Ruwan", "12345"), _row("Dilani", "0765554443"))
+
+    assert (summary["inserted"], summary["rejected"], summary["error_count"]) == (1, 1, 1)
+    assert summary["errors"][0]["row"] == 2
+    assert "phone" in summary["errors"][0]["error"]
+
+
+def test_failed_writes_count_only_as_rejected(api, sync_db):
+    city = f"Clash-{uuid.uuid4().hex[:6]}"
+    sync_db.customers.create_index("city", unique=True, partialFilterExpression={"city": city})
+
+    summary = _import(api, _row("Asha", "0781110001", city=city), _row("Bimal", "0781110002", city=city),
+                      _row("Bimal", "0781110002", city=city))
+
+    assert summary["rows"] == 3
+    assert (summary["inserted"], summary["merged"], summary["rejected"]) == (1, 0, 2)
+    assert sorted(error["row"] for error in summary["errors"]) == [3, 4]
+    assert summary["inserted"] + summary["merged"] + summary["rejected"] == summary["rows"]
+
+
+def test_phone_backfill_runs_once(api, sync_db):
+    import server
+
+    sync_db.settings.delete_many({"id": server.CUSTOMER_PHONE_BACKFILL_MARKER})
+    sync_db.customers.insert_many([
+        {"id": "legacy-ok", "name": "Legacy", "phone": "0772223334"},
+        {"id": "legacy-bad", "name": "Legacy", "phone": "n/a"},
+    ])
+    api.portal.call(server.backfill_customer_phones)
+
+    assert sync_db.customers.find_one({"id": "legacy-ok"})["phone_normalized"] == "+94772223334"
+    assert sync_db.customers.find_one({"id": "legacy-bad"})["phone_normalized"] is None
+    assert sync_db.settings.count_documents({"id": server.CUSTOMER_PHONE_BACKFILL_MARKER}) == 1
+
+    # Later runs skip the scan entirely
+    sync_db.customers.insert_one({"id": "legacy-late", "name": "Legacy", "phone": "0772223335"})
+    api.portal.call(server.backfill_customer_phones)
+    assert "phone_normalized" not in sync_db.customers.find_one({"id": "legacy-late"})
@@ -0,0 +1,54 @@
+"""Per-customer order history, newest first, across hot and archived orders."""
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def customer(api):
+    customer = {"id": str(uuid.uuid4()), "name": "History Customer", "email": "history@example.lk",
+                "phone": "0761234567", "address": "No. 3, Temple Road, Matara, 81000", "city": "Matara",
+                "postal_code": "81000"}
+    assert api.post("/api/customers", json=customer).status_code == 200
+    return customer
+
+
+@pytest.fixture
+def history(sync_db, customer, make_product, make_order):
+    tee = make_product(price=900.0)
+    # Oldest first; index 0 is 400 days old and gets archived in the archive test
+    orders = [
+        make_order([(tee, 0, 1)] * (days_ago % 3 + 1), customer=customer, status="delivered", days_ago=days_ago)
+        for days_ago in (400, 300, 60, 20, 5)
+    ]
+    sync_db.orders.insert_many([dict(order) for order in orders])
+    sync_db.orders.insert_one(make_order(status="delivered", days_ago=1))
+    return orders
+
+
+def test_pages_newest_first_with_summaries(api, customer, history):
+    first = api.get(f"/api/customers/{customer['id']}/orders", params={"limit": 2}).json()
+    assert first["total"] == 5
+    assert [order["id"] for order in first["items"]] == [history[4]["id"], history[3]["id"]]
+    summary = first["items"][0]
+    assert summary["item_count"] == len(history[4]["items"])
+    assert summary["total_amount"] == history[4]["total_amount"]
+    assert "items" not in summary and "customer_address" not in summary
+
+    rest = api.get(f"/api/customers/{customer['id']}/orders", params={"limit": 2, "offset": 4}).json()
+    assert [order["id"] for order in rest["items"]] == [history[0]["id"]]
+
+
+def test_includes_archived_orders(api, customer, history):
+    import server
+
+    api.portal.call(lambda: server.archive_orders(older_than_days=180, announce_wait=0))
+    page = api.get(f"/api/customers/{customer['id']}/orders").json()
+    assert page["total"] == 5
+    assert [order["id"] for order in page["items"]] == [order["id"] for order in reversed(history)]
+
+
+def test_unknown_customer_and_bad_paging(api, customer):
+    assert api.get(f"/api/customers/{uuid.uuid4()}/orders").status_code == 404
+    assert api.get(f"/api/customers/{customer['id']}/orders", params={"limit": 0}).status_code == 400
+    assert api.get(f"/api/customers/{customer['id']}/orders", params={"offset": -1}).status_code == 400
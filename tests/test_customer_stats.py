@@ -0,0 +1,124 @@
+"""Per-customer order statistics and value-sorted customer listings."""
+import uuid
+
+import pytest
+
+
+def _customer(name: str, phone: str) -> dict:
+    return {"id": str(uuid.uuid4()), "name": name, "email": f"{phone}@example.lk", "phone": phone,
+            "address": "No. 7, Lake Drive, Kurunegala, 60000", "city": "Kurunegala", "postal_code": "60000"}
+
+
+@pytest.fixture
+def product(api, make_product):
+    product = make_product("Stats Shirt", "Shirts", stock=100, price=1000.0, color="White")
+    assert api.post("/api/products", json=product).status_code == 200
+    return product
+
+
+@pytest.fixture
+def order_body(product, make_order):
+    """An order by ``customer`` whose total is exactly ``total``."""
+    return lambda customer, total: make_order(
+        [(product, 0, 1)], customer=customer, unit_price=total, courier_charges=0.0,
+    )
+
+
+@pytest.fixture
+def customers(api):
+    created = [_customer("Big Spender", "0711111111"), _customer("Regular", "0722222222"),
+               _customer("Window Shopper", "0733333333")]
+    for customer in created:
+        assert api.post("/api/customers", json=customer).status_code == 200
+    return created
+
+
+def _stats(sync_db, customer_id: str) -> dict:
+    return sync_db.customer_stats.find_one({"customer_id": customer_id}, {"_id": 0})
+
+
+def test_order_writes_keep_stats_current(api, sync_db, customers, order_body):
+    big = customers[0]
+    first = api.post("/api/orders", json=order_body(big, 5000.0)).json()
+    second = api.post("/api/orders", json=order_body(big, 3000.0)).json()
+    stats = _stats(sync_db, big["id"])
+    assert (stats["order_count"], stats["lifetime_value"], stats["returns_count"]) == (2, 8000.0, 0)
+    stored = {doc["id"]: doc["created_at"] for doc in sync_db.orders.find({"customer_id": big["id"]})}
+    assert (stats["first_order_at"], stats["last_order_at"]) == (stored[first["id"]], stored[second["id"]])
+
+    api.put(f"/api/orders/{second['id']}/status", params={"status": "returned"})
+    stats = _stats(sync_db, big["id"])
+    assert (stats["order_count"], stats["lifetime_value"], stats["returns_count"]) == (2, 5000.0, 1)
+
+    api.delete(f"/api/orders/{second['id']}")
+    stats = _stats(sync_db, big["id"])
+    assert (stats["order_count"], stats["lifetime_value"], stats["returns_count"]) == (1, 5000.0, 0)
+    assert stats["first_order_at"] == stats["last_order_at"]
+
+    api.delete(f"/api/orders/{first['id']}")
+    stats = _stats(sync_db, big["id"])
+    assert stats["order_count"] == 0
+    assert "last_order_at" not in stats
+
+
+def test_sorted_and_paginated_listing(api, customers, order_body):
+    big, regular, window = customers
+    api.post("/api/orders", json=order_body(big, 9000.0))
+    for _ in range(3):
+        api.post("/api/orders", json=order_body(regular, 1000.0))
+
+    page = api.get("/api/customers", params={"sort": "lifetime_value", "limit": 2}).json()
+    assert page["total"] == 3
+    assert [item["id"] for item in page["items"]] == [big["id"], regular["id"]]
+    assert page["items"][0]["stats"]["lifetime_value"] == 9000.0
+
+    rest = api.get("/api/customers", params={"sort": "lifetime_value", "limit": 2, "offset": 2}).json()
+    assert [item["id"] for item in rest["items"]] == [window["id"]]
+    assert rest["items"][0]["stats"]["order_count"] == 0
+
+    by_count = api.get("/api/customers", params={"sort": "order_count"}).json()
+    assert by_count["items"][0]["id"] == regular["id"]
+
+    valuable = api.get("/api/customers", params={"sort": "lifetime_value", "min_lifetime_value": 2000}).json()
+    assert [item["id"] for item in valuable["items"]] == [big["id"]]
+
+
+def test_rebuild_matches_incremental_stats(api, sync_db, customers, order_body):
+    import server
+
+    for customer, total in ((customers[0], 1200.0), (customers[0], 800.0), (customers[1], 500.0)):
+        api.post("/api/orders", json=order_body(customer, total))
+    before = {customer["id"]: _stats(sync_db, customer["id"]) for customer in customers}
+    sync_db.customer_stats.delete_many({})
+
+    summary = api.portal.call(server.rebuild_customer_stats)
+    assert summary == {"customers": 3, "with_orders": 2, "reset": 0}
+    for customer in customers:
+        rebuilt = _stats(sync_db, customer["id"])
+        for field in ("order_count", "lifetime_value", "returns_count", "first_order_at", "last_order_at"):
+            assert rebuilt.get(field) == before[customer["id"]].get(field)
+
+
+def test_stats_are_built_once_for_customers_with_earlier_orders(api, sync_db, customers, order_body):
+    import server
+
+    big = customers[0]
+    api.post("/api/orders", json=order_body(big, 2000.0))
+    # As deployed onto a database whose orders predate customer_stats
+    sync_db.customer_stats.delete_many({})
+    sync_db.settings.delete_many({"id": server.CUSTOMER_STATS_BUILT_MARKER})
+
+    api.portal.call(server.build_customer_stats_once)
+    api.post("/api/orders", json=order_body(big, 1000.0))
+    assert _stats(sync_db, big["id"])["order_count"] == 2
+    assert _stats(sync_db, big["id"])["lifetime_value"] == 3000.0
+    assert _stats(sync_db, customers[2]["id"])["order_count"] == 0
+
+    # Later startups leave the incrementally kept stats alone
+    sync_db.customer_stats.update_one({"customer_id": big["id"]}, {"$set": {"order_count": 99}})
+    api.portal.call(server.build_customer_stats_once)
+    assert _stats(sync_db, big["id"])["order_count"] == 99
+
+
+def test_rejects_unknown_sort(api):
+    assert api.get("/api/customers", params={"sort": "name"}).status_code == 400
@@ -0,0 +1,105 @@
+"""Delta sync: tokens, tombstones, page cutoffs and token expiry."""
+import base64
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+def _customer() -> dict:
+    return {"id": str(uuid.uuid4()), "name": "Delta Customer", "email": "delta@example.lk", "phone": "0771112223",
+            "address": "No. 1, Park Road, Kandy, 20000", "city": "Kandy", "postal_code": "20000"}
+
+
+def _token(response) -> str:
+    return response.headers["x-sync-token"]
+
+
+def test_changes_and_deletions_round_trip(api, make_product):
+    kept, removed = make_product("Delta Tee"), make_product("Delta Tee")
+    for product in (kept, removed):
+        api.post("/api/products", json=product)
+    token = _token(api.get("/api/products"))
+
+    api.delete(f"/api/products/{removed['id']}")
+    kept["name"] = "Delta Tee v2"
+    api.put(f"/api/products/{kept['id']}", json=kept)
+
+    delta = api.get("/api/products", params={"updated_since": token})
+    body = delta.json()
+    assert kept["id"] in {item["id"] for item in body["items"]}
+    assert removed["id"] in body["deleted"]
+    assert body["has_more"] is False
+    assert delta.headers["x-sync-token"] == body["sync_token"]
+
+
+def test_customer_edits_bump_updated_at(api, sync_db):
+    customer = _customer()
+    api.post("/api/customers", json=customer)
+    before = sync_db.customers.find_one({"id": customer["id"]})["updated_at"]
+    token = _token(api.get("/api/customers"))
+
+    customer["city"] = "Galle"
+    api.put(f"/api/customers/{customer['id']}", json=customer)
+    assert sync_db.customers.find_one({"id": customer["id"]})["updated_at"] > before
+    items = api.get("/api/customers", params={"updated_since": token}).json()["items"]
+    assert [item["city"] for item in items if item["id"] == customer["id"]] == ["Galle"]
+
+
+def test_stock_changes_bump_product_updated_at(api, sync_db, make_product, make_order):
+    product = make_product("Delta Tee")
+    api.post("/api/products", json=product)
+    before = sync_db.products.find_one({"id": product["id"]})["updated_at"]
+    api.post("/api/orders", json=make_order([(product, 0, 2)]))
+    after = sync_db.products.find_one({"id": product["id"]})
+    assert after["variants"][0]["stock_quantity"] == 8
+    assert after["updated_at"] > before
+
+
+def test_pages_through_many_records_sharing_a_timestamp(api, sync_db, make_product):
+    import server
+
+    moment = datetime.now(timezone.utc).replace(microsecond=250000)
+    products = [dict(make_product("Delta Tee"), updated_at=moment.isoformat()) for _ in range(7)]
+    sync_db.products.insert_many([dict(product) for product in products])
+    deleted = [str(uuid.uuid4()) for _ in range(4)]
+    sync_db.tombstones.insert_many(
+        [{"collection": "products", "id": product_id, "deleted_at": moment} for product_id in deleted]
+    )
+
+    since, after_id = moment - timedelta(seconds=1), None
+    seen, gone = [], []
+    for _ in range(20):
+        page = api.portal.call(lambda: server.fetch_delta("products", since, after_id, limit=3))
+        seen += [doc["id"] for doc in page["items"]]
+        gone += page["deleted"]
+        if not page["has_more"]:
+            break
+        since, after_id = server.parse_sync_token(page["sync_token"])
+    else:
+        pytest.fail("delta paging did not terminate")
+
+    assert sorted(seen) == sorted(product["id"] for product in products)
+    assert sorted(gone) == sorted(deleted)
+
+
+def test_tokens_older_than_tombstone_retention_require_a_resync(api, make_product):
+    import server
+
+    stale = datetime.now(timezone.utc) - timedelta(days=server.TOMBSTONE_RETENTION_DAYS + 1)
+    response = api.get("/api/products", params={"updated_since": server.encode_sync_token(stale)})
+    assert response.status_code == 410
+    assert response.json()["resync_required"] is True
+
+    # The catalog refresh falls back to a full load instead
+    api.post("/api/products", json=make_product("Delta Tee"))
+    server.catalog.sync_token = server.encode_sync_token(stale)
+    api.portal.call(server.catalog.refresh)
+    assert server.parse_sync_token(server.catalog.sync_token)[0] > stale
+
+
+def test_accepts_plain_timestamps_and_rejects_garbage(api):
+    since = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    assert api.get("/api/orders", params={"updated_since": since}).status_code == 200
+    garbage = base64.urlsafe_b64encode(b"not a date").decode()
+    assert api.get("/api/orders", params={"updated_since": garbage}).status_code == 400
@@ -0,0 +1,119 @@
+"""Change events: broadcaster replay and resync, the SSE endpoint and publishing write handlers."""
+import asyncio
+import uuid
+
+import pytest
+
+
+class _Request:
+    """Enough of a Request for stream_events: headers and a disconnect after ``polls`` checks."""
+
+    def __init__(self, last_event_id=None, polls: int = 1):
+        self.headers = {"last-event-id": last_event_id} if last_event_id else {}
+        self.polls = polls
+
+    async def is_disconnected(self) -> bool:
+        self.polls -= 1
+        return self.polls < 0
+
+
+@pytest.fixture
+def broadcaster(backend, monkeypatch):
+    fresh = backend.EventBroadcaster(queue_size=4, replay_size=6)
+    monkeypatch.setattr(backend, "broadcaster", fresh)
+    return fresh
+
+
+def _drain(queue) -> list:
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_last_event_id_replays_missed_events(broadcaster):
+    first, second, third = (broadcaster.publish("order_created", {"n": n}) for n in range(3))
+    queue = broadcaster.subscribe(first["id"])
+    assert _drain(queue) == [second, third]
+    assert _drain(broadcaster.subscribe(third["id"])) == []
+
+
+def test_unknown_or_evicted_ids_get_a_resync(broadcaster):
+    first = broadcaster.publish("order_created")
+    for _ in range(8):
+        broadcaster.publish("stock_changed")
+    for last_event_id in (first["id"], f"other-{broadcaster._sequence}", f"{broadcaster.epoch}-x"):
+        assert [event["type"] for event in _drain(broadcaster.subscribe(last_event_id))] == ["resync"]
+
+
+def test_slow_subscribers_are_drained_and_told_to_resync(broadcaster):
+    slow = broadcaster.subscribe()
+    for _ in range(broadcaster.queue_size + 1):
+        broadcaster.publish("stock_changed")
+    [event] = _drain(slow)
+    assert event["type"] == "resync"
+    assert event["id"] == f"{broadcaster.epoch}-{broadcaster.queue_size + 1}"
+
+
+def test_stream_sends_replay_then_unsubscribes_on_disconnect(backend, broadcaster):
+    first = broadcaster.publish("order_created", {"id": "o1"})
+    second = broadcaster.publish("order_deleted", {"id": "o1"})
+
+    async def run():
+        response = await backend.stream_events(_Request(first["id"], polls=1))
+        assert response.media_type == "text/event-stream"
+        assert broadcaster.subscriber_count == 1
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(run())
+    assert chunks == ["retry: 3000\n\n", backend.format_sse(second)]
+    assert broadcaster.subscriber_count == 0
+
+
+def test_stream_heartbeats_and_cleans_up_when_closed(backend, broadcaster, monkeypatch):
+    monkeypatch.setattr(backend, "EVENTS_HEARTBEAT_SECONDS", 0.01)
+
+    async def run():
+        response = await backend.stream_events(_Request(polls=100))
+        chunks = response.body_iterator
+        received = [await chunks.__anext__(), await chunks.__anext__()]
+        # What Starlette does when the client goes away mid-stream
+        await chunks.aclose()
+        return received
+
+    assert asyncio.run(run()) == ["retry: 3000\n\n", ": keep-alive\n\n"]
+    assert broadcaster.subscriber_count == 0
+
+
+def test_write_handlers_publish_events(api):
+    import server
+
+    queue = server.broadcaster.subscribe()
+    try:
+        product_id, variant_id = str(uuid.uuid4()), str(uuid.uuid4())
+        api.post("/api/products", json={
+            "id": product_id, "name": "Event Tee", "description": "", "category": "T-Shirts",
+            "variants": [{"id": variant_id, "size": "M", "color": "Black", "sku": f"EVT-{uuid.uuid4().hex[:6]}",
+                          "stock_quantity": 5, "price": 1000.0}],
+        })
+        order = api.post("/api/orders", json={
+            "customer_id": str(uuid.uuid4()), "customer_name": "Event Customer",
+            "customer_address": "No. 1, Park Road, Kandy, 20000", "customer_phone": "0771234567",
+            "subtotal": 1000.0, "tax_amount": 0.0, "total_amount": 1350.0,
+            "items": [{"product_id": product_id, "variant_id": variant_id, "product_name": "Event Tee", "size": "M",
+                       "color": "Black", "quantity": 1, "unit_price": 1000.0, "total_price": 1000.0}],
+        }).json()
+        api.put(f"/api/orders/{order['id']}/status", params={"status": "on_courier", "tracking_number": "TRK1"})
+        api.put("/api/settings", json={"business_name": "Event Store"})
+        events = _drain(queue)
+    finally:
+        server.broadcaster.unsubscribe(queue)
+
+    by_type = {event["type"]: event["data"] for event in events}
+    assert by_type["product_changed"]["id"] == product_id
+    assert by_type["stock_changed"] == {"product_id": product_id, "variants": [{"id": variant_id, "stock_quantity": 4}]}
+    assert by_type["order_created"]["id"] == order["id"]
+    assert by_type["order_status_changed"] == {"id": order["id"], "status": "on_courier", "tracking_number": "TRK1"}
+    assert by_type["settings_changed"]["business_name"] == "Event Store"
+    sequences = [int(event["id"].split("-")[1]) for event in events]
+    assert sequences == sorted(sequences)
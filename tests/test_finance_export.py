@@ -0,0 +1,71 @@
+"""Finance order-line export to CSV and Parquet."""
+import csv
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+
+@pytest.fixture
+def sold(api, make_product, make_order):
+    costed, uncosted = (
+        make_product("Finance Tee", variants=[("L", 50, buy_price)], price=2000.0, color="Blue", low_stock_threshold=1)
+        for buy_price in (1200.0, None)
+    )
+    for product in (costed, uncosted):
+        assert api.post("/api/products", json=product).status_code == 200
+    lines = [(costed, 0, 2), (uncosted, 0, 2)]
+    for _ in range(3):
+        assert api.post("/api/orders", json=make_order(lines, city="Matara")).status_code == 200
+    return costed, uncosted
+
+
+def _params(fmt: str) -> dict:
+    today = datetime.now(timezone.utc).date().isoformat()
+    return {"start_date": today, "end_date": today, "format": fmt}
+
+
+def test_csv_export_has_one_row_per_line_with_margin(api, sold):
+    costed, uncosted = sold
+    response = api.get("/api/finance/export", params=_params("csv"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 6
+    by_variant = {row["variant_id"]: row for row in rows}
+    real = by_variant[costed["variants"][0]["id"]]
+    assert float(real["cost"]) == 2400.0
+    assert float(real["margin"]) == 1600.0
+    assert real["cost_estimated"] == "False"
+    estimated = by_variant[uncosted["variants"][0]["id"]]
+    assert float(estimated["cost"]) == pytest.approx(2400.0)
+    assert estimated["cost_estimated"] == "True"
+    assert {row["city"] for row in rows} == {"Matara"}
+
+
+def test_csv_export_reads_one_cursor(api, recorder, sold):
+    with recorder:
+        response = api.get("/api/finance/export", params=_params("csv"))
+    assert response.status_code == 200
+    assert [command for command, _, _ in recorder.commands if command != "getMore"] == ["aggregate"]
+
+
+def test_empty_range_still_has_header(api):
+    response = api.get("/api/finance/export", params={"start_date": "2001-01-01", "end_date": "2001-01-31"})
+    assert response.status_code == 200
+    assert response.text.strip().split(",")[0] == "order_id"
+
+
+def test_parquet_export_matches_csv(api, sold):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = api.get("/api/finance/export", params=_params("parquet"))
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 6
+    assert str(table.schema.field("quantity").type) == "int64"
+    assert sum(table.column("margin").to_pylist()) == pytest.approx(3 * 1600.0 + 3 * 1600.0)
+
+
+def test_rejects_unknown_format(api):
+    response = api.get("/api/finance/export", params=_params("xlsx"))
+    assert response.status_code == 400
@@ -0,0 +1,46 @@
+"""Liveness and readiness probes."""
+import asyncio
+
+
+def test_healthz_reports_pool(api):
+    response = api.get("/healthz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert body["pool"]["max_pool_size"] > 0
+
+
+def test_readyz_after_startup_has_warm_pool(api):
+    import server
+
+    response = api.get("/readyz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert body["pool"]["wait_queue"] == 0
+    opened = sum(pool["open"] for pool in body["pool"]["servers"].values())
+    assert opened >= min(server.MONGO_CLIENT_OPTIONS["minPoolSize"], server.MONGO_CLIENT_OPTIONS["maxPoolSize"])
+
+
+def test_readyz_fails_while_not_ready(api):
+    import server
+
+    server.app.state.ready = False
+    try:
+        response = api.get("/readyz")
+    finally:
+        server.app.state.ready = True
+    assert response.status_code == 503
+    assert response.json()["status"] == "not_ready"
+
+
+def test_readyz_fails_when_mongo_does_not_answer(api, monkeypatch):
+    import server
+
+    async def slow_ping(*args, **kwargs):
+        await asyncio.sleep(server.READINESS_PING_TIMEOUT * 2)
+
+    monkeypatch.setattr(server.db, "command", slow_ping)
+    response = api.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "unavailable"
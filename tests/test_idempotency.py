@@ -0,0 +1,96 @@
+"""Idempotency-Key handling for order creation, status changes and job submission."""
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def product(api, make_product):
+    product = make_product("Retry Tee")
+    assert api.post("/api/products", json=product).status_code == 200
+    return product
+
+
+@pytest.fixture
+def order_body(product, make_order):
+    """A fresh order body of two units on each call."""
+    return lambda: make_order([(product, 0, 2)], customer_name="Retry Customer")
+
+
+def _stock(sync_db, product: dict) -> int:
+    return sync_db.products.find_one({"id": product["id"]})["variants"][0]["stock_quantity"]
+
+
+def test_retried_order_is_created_once(api, sync_db, product, order_body):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    body = order_body()
+    first = api.post("/api/orders", json=body, headers=headers)
+    retry = api.post("/api/orders", json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert sync_db.orders.count_documents({"customer_name": "Retry Customer"}) == 1
+    assert _stock(sync_db, product) == 8
+
+    # Without a key every request is a new order
+    api.post("/api/orders", json=order_body())
+    assert _stock(sync_db, product) == 6
+
+
+def test_key_reused_for_a_different_request_is_rejected(api, order_body):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    body = order_body()
+    api.post("/api/orders", json=body, headers=headers)
+    changed = dict(body, total_amount=9999.0)
+    assert api.post("/api/orders", json=changed, headers=headers).status_code == 422
+
+
+def test_failed_requests_release_their_key(api, sync_db, order_body):
+    key = str(uuid.uuid4())
+    bad = order_body()
+    bad["items"][0]["variant_id"] = str(uuid.uuid4())
+    assert api.post("/api/orders", json=bad, headers={"Idempotency-Key": key}).status_code == 400
+    assert sync_db.idempotency_keys.find_one({"_id": key}) is None
+    assert api.post("/api/orders", json=bad, headers={"Idempotency-Key": key}).status_code == 400
+
+
+def test_status_change_and_in_flight_reservations(api, sync_db, product, order_body):
+    order = api.post("/api/orders", json=order_body()).json()
+    path = f"/api/orders/{order['id']}/status"
+    query = "status=returned"
+    key = str(uuid.uuid4())
+    fingerprint = hashlib.sha256(b"\n".join([b"PUT", path.encode(), query.encode(), b""])).hexdigest()
+    now = datetime.now(timezone.utc)
+
+    # Another worker is still handling this request
+    sync_db.idempotency_keys.insert_one({"_id": key, "fingerprint": fingerprint, "state": "pending", "created_at": now})
+    assert api.put(f"{path}?{query}", headers={"Idempotency-Key": key}).status_code == 409
+
+    # ... until its reservation goes stale, after which a retry takes over
+    sync_db.idempotency_keys.update_one({"_id": key}, {"$set": {"created_at": now - timedelta(minutes=10)}})
+    assert api.put(f"{path}?{query}", headers={"Idempotency-Key": key}).status_code == 200
+    retry = api.put(f"{path}?{query}", headers={"Idempotency-Key": key})
+    assert retry.status_code == 200 and retry.headers["idempotent-replayed"] == "true"
+    assert _stock(sync_db, product) == 10
+    assert sync_db.customer_stats.find_one({"customer_id": order["customer_id"]})["returns_count"] == 1
+
+
+def test_job_submission_is_replayed(api, order_body, tmp_path, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "JOBS_DIR", tmp_path)
+    order = api.post("/api/orders", json=order_body()).json()
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    first = api.post("/api/jobs/orders_csv", json=[order["id"]], headers=headers)
+    retry = api.post("/api/jobs/orders_csv", json=[order["id"]], headers=headers)
+    assert first.status_code == retry.status_code == 202
+    assert retry.json()["id"] == first.json()["id"]
+
+
+def test_keys_expire_through_a_ttl_index(api, sync_db):
+    indexes = sync_db.idempotency_keys.index_information()
+    assert indexes["idempotency_ttl"]["expireAfterSeconds"] > 0
@@ -0,0 +1,53 @@
+"""Inventory valuation with sell-through and days of cover."""
+import pytest
+
+
+@pytest.fixture
+def stocked(api, make_product, make_order):
+    hoodie = make_product("Valuation Hoodie", "Hoodies", [("M", 40, 1000.0), ("L", 10, None)], price=2000.0,
+                          color="Grey", low_stock_threshold=1)
+    cap = make_product("Valuation Cap", "Accessories", [("S", -3, 300.0)], price=2000.0, color="Grey",
+                       low_stock_threshold=1)
+    for product in (hoodie, cap):
+        assert api.post("/api/products", json=product).status_code == 200
+    assert api.post("/api/orders", json=make_order([(hoodie, 0, 10)], city="Badulla")).status_code == 200
+    return hoodie, cap
+
+
+def test_product_level_valuation(api, stocked):
+    hoodie, cap = stocked
+    body = api.get("/api/inventory/valuation", params={"window_days": 10}).json()
+    items = {item["product_id"]: item for item in body["items"]}
+    # 30 left at cost 1000, plus 10 without a buy price at 60% of 2000
+    assert items[hoodie["id"]]["stock_value"] == 30 * 1000.0 + 10 * 1200.0
+    assert items[hoodie["id"]]["estimated_value"] == 10 * 1200.0
+    assert items[hoodie["id"]]["units_sold"] == 10
+    assert items[hoodie["id"]]["daily_velocity"] == 1.0
+    assert items[hoodie["id"]]["days_of_cover"] == 40.0
+    assert items[hoodie["id"]]["sell_through_pct"] == pytest.approx(10 / 50 * 100)
+    # Oversold stock is not valued and nothing sold means no cover figure
+    assert items[cap["id"]]["stock_value"] == 0
+    assert items[cap["id"]]["days_of_cover"] is None
+    assert body["totals"]["stock_value"] == 42000.0
+    assert body["items"][0]["product_id"] == hoodie["id"]
+
+
+def test_variant_and_category_levels(api, stocked):
+    hoodie, _ = stocked
+    variants = api.get("/api/inventory/valuation", params={"level": "variant"}).json()["items"]
+    by_variant = {item["variant_id"]: item for item in variants}
+    assert by_variant[hoodie["variants"][0]["id"]]["stock_on_hand"] == 30
+    categories = api.get("/api/inventory/valuation", params={"level": "category", "top": 1}).json()["items"]
+    assert [item["category"] for item in categories] == ["Hoodies"]
+
+
+def test_reads_orders_once(api, recorder, stocked):
+    with recorder:
+        assert api.get("/api/inventory/valuation").status_code == 200
+    aggregates = [collection for command, collection, _ in recorder.commands if command == "aggregate"]
+    assert aggregates == ["orders"]
+
+
+@pytest.mark.parametrize("params", [{"level": "sku"}, {"window_days": 0}, {"top": 0}])
+def test_rejects_bad_parameters(api, params):
+    assert api.get("/api/inventory/valuation", params=params).status_code == 400
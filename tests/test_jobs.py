@@ -0,0 +1,80 @@
+"""Background export and label jobs rendered in the process pool."""
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def jobs_dir(api, tmp_path, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "JOBS_DIR", tmp_path)
+    # Several chunks for a handful of orders
+    monkeypatch.setattr(server, "JOB_CHUNK_SIZE", 2)
+    return tmp_path
+
+
+@pytest.fixture
+def order_ids(sync_db, make_order):
+    orders = [make_order(order_number=f"ORD-{number:06d}", tracking_number=f"TRK-{number}") for number in range(5)]
+    sync_db.orders.insert_many([dict(order) for order in orders])
+    # An unknown id is skipped, as in the synchronous endpoints
+    return [order["id"] for order in orders] + [str(uuid.uuid4())]
+
+
+def _wait(api, job_id: str, timeout: float = 60.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = api.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.mark.parametrize("kind, sync_path", [
+    ("orders_csv", "/api/orders/export-csv"),
+    ("bulk_labels", "/api/orders/bulk-labels"),
+])
+def test_job_output_matches_synchronous_endpoint(api, jobs_dir, order_ids, kind, sync_path):
+    response = api.post(f"/api/jobs/{kind}", json=order_ids)
+    assert response.status_code == 202
+    submitted = response.json()
+    assert submitted["status"] == "queued" and submitted["total"] == len(order_ids)
+
+    job = _wait(api, submitted["id"])
+    assert job["status"] == "succeeded", job["error"]
+    assert job["done"] == len(order_ids)
+    assert job["expires_at"]
+
+    download = api.get(f"/api/jobs/{job['id']}/download")
+    assert download.status_code == 200
+    assert download.text == api.post(sync_path, json=order_ids).text
+    assert job["size"] == len(download.content)
+    assert job["filename"] in download.headers["content-disposition"]
+
+
+def test_cleanup_removes_expired_and_interrupted_jobs(api, sync_db, jobs_dir, order_ids):
+    import server
+
+    job = _wait(api, api.post("/api/jobs/orders_csv", json=order_ids).json()["id"])
+    past = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    sync_db.jobs.update_one({"id": job["id"]}, {"$set": {"expires_at": past}})
+    stuck = {"id": str(uuid.uuid4()), "kind": "bulk_labels", "status": "running", "total": 10, "done": 2,
+             "created_at": past, "updated_at": past}
+    sync_db.jobs.insert_one(dict(stuck))
+
+    assert api.portal.call(server.cleanup_jobs) == {"interrupted": 1, "expired": 1}
+    assert not list(jobs_dir.iterdir())
+    assert api.get(f"/api/jobs/{job['id']}").status_code == 404
+    interrupted = api.get(f"/api/jobs/{stuck['id']}").json()
+    assert interrupted["status"] == "failed" and interrupted["error"]
+    assert api.get(f"/api/jobs/{stuck['id']}/download").status_code == 409
+
+
+def test_rejects_unknown_kind_and_empty_jobs(api, jobs_dir):
+    assert api.post("/api/jobs/pdf", json=["x"]).status_code == 404
+    assert api.post("/api/jobs/orders_csv", json=[]).status_code == 400
+    assert api.get(f"/api/jobs/{uuid.uuid4()}").status_code == 404
@@ -0,0 +1,105 @@
+"""Rendered shipping labels cached by content, with LRU spill to disk."""
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def cache(api, tmp_path, monkeypatch):
+    import server
+
+    cache = server.LabelCache(server.LABEL_CACHE_MAX_BYTES, tmp_path, server.LABEL_CACHE_DISK_MAX_BYTES)
+    monkeypatch.setattr(server, "label_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def orders(sync_db, make_order):
+    orders = [
+        make_order(order_number=f"ORD-{number:06d}", customer_name=f"Label Customer {number}") for number in range(3)
+    ]
+    sync_db.orders.insert_many([dict(order) for order in orders])
+    return orders
+
+
+def _lookups(result: str) -> float:
+    import server
+
+    return server.label_cache_lookups.labels(result)._value.get()
+
+
+def test_reprints_are_served_from_the_cache(api, cache, orders):
+    ids = [order["id"] for order in orders]
+    first = api.post("/api/orders/bulk-labels", json=ids).text
+    assert cache.status()["entries"] == 3
+
+    hits = _lookups("memory")
+    assert api.post("/api/orders/bulk-labels", json=ids).text == first
+    assert api.get(f"/api/orders/{ids[0]}/shipping-label").text in first
+    assert _lookups("memory") - hits == 4
+
+
+def test_order_and_settings_changes_render_fresh_labels(api, cache, orders):
+    order_id = orders[0]["id"]
+    before = api.get(f"/api/orders/{order_id}/shipping-label").text
+    assert "TRK-CACHE-1" not in before
+
+    api.put(f"/api/orders/{order_id}/status", params={"status": "on_courier", "tracking_number": "TRK-CACHE-1"})
+    after_status = api.get(f"/api/orders/{order_id}/shipping-label").text
+    assert "TRK-CACHE-1" in after_status
+    # The superseded label was dropped rather than left to age out
+    assert cache.status()["entries"] == 1
+
+    settings = api.get("/api/settings").json()
+    settings["business_name"] = "Cached Threads"
+    api.put("/api/settings", json=settings)
+    assert cache.status()["entries"] == 0
+    assert "Cached Threads" in api.get(f"/api/orders/{order_id}/shipping-label").text
+
+
+def test_writes_made_elsewhere_change_the_key(api, cache, sync_db, orders):
+    order_id = orders[1]["id"]
+    api.get(f"/api/orders/{order_id}/shipping-label")
+    # Another worker edits the order; this worker's cache is never told
+    sync_db.orders.update_one({"id": order_id}, {"$set": {"customer_name": "Renamed Elsewhere"}})
+    assert "Renamed Elsewhere" in api.get(f"/api/orders/{order_id}/shipping-label").text
+
+
+def test_evicted_labels_spill_to_disk(api, tmp_path, monkeypatch, orders):
+    import server
+
+    # Room for roughly one label in memory
+    cache = server.LabelCache(1500, tmp_path, server.LABEL_CACHE_DISK_MAX_BYTES)
+    monkeypatch.setattr(server, "label_cache", cache)
+    ids = [order["id"] for order in orders]
+    first = api.post("/api/orders/bulk-labels", json=ids).text
+    assert len(list(tmp_path.glob("*.html"))) >= 2
+
+    disk_hits = _lookups("disk")
+    assert api.post("/api/orders/bulk-labels", json=ids).text == first
+    assert _lookups("disk") > disk_hits
+
+
+def test_order_keys_are_forgotten_with_their_labels(backend, tmp_path):
+    # Room for one label in memory and about four on disk
+    cache = backend.LabelCache(100, tmp_path, 250)
+    html = "x" * 60
+
+    async def run():
+        for number in range(20):
+            await cache.put(f"order-{number}", f"key-{number}", html)
+        files = {path.stem for path in tmp_path.glob("*.html")}
+        assert len(files) <= 5
+        # Only orders whose label is still in memory or on disk are remembered
+        assert set(cache._order_keys.values()) == set(cache._entries) | files
+        assert await cache.get("key-19") == html
+
+        await cache.forget_order("order-18")
+        assert not (tmp_path / "key-18.html").exists()
+        assert await cache.get("key-18") is None
+
+        await cache.clear()
+        assert cache.status() == {"entries": 0, "bytes": 0, "orders": 0}
+        assert list(tmp_path.glob("*.html")) == []
+
+    asyncio.run(run())
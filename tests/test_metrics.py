@@ -0,0 +1,116 @@
+"""Prometheus metrics: route-template labels, in-flight tracking, per-request Mongo counts and collectors."""
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+
+def _sample(backend, name: str, **labels):
+    return backend.REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def metrics_app(backend):
+    """A small app behind MetricsMiddleware whose handlers report on the request they run in."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    seen = {}
+
+    @app.get("/widgets/{widget_id}")
+    async def get_widget(widget_id: str):
+        seen["in_flight"] = _sample(
+            backend, "http_requests_in_flight", method="GET", route="/widgets/{widget_id}")
+        return {"id": widget_id}
+
+    @app.get("/widgets/{widget_id}/fail")
+    async def fail_widget(widget_id: str):
+        raise RuntimeError("boom")
+
+    @app.get("/widgets/{widget_id}/queries")
+    async def query_widget(widget_id: str, count: int):
+        for request_id in range(count):
+            event = SimpleNamespace(command_name="find", command={"find": "widgets"},
+                                    connection_id=("localhost", 27017), request_id=request_id, duration_micros=1500)
+            backend.mongo_command_metrics.started(event)
+            backend.mongo_command_metrics.succeeded(event)
+        return {"queries": count}
+
+    app.add_middleware(backend.MetricsMiddleware)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        client.seen = seen
+        yield client
+
+
+def test_requests_are_labelled_by_route_template(backend, metrics_app):
+    template = "/widgets/{widget_id}"
+    before = _sample(backend, "http_request_duration_seconds_count", method="GET", route=template, status="200")
+    widget_id = uuid.uuid4().hex
+    assert metrics_app.get(f"/widgets/{widget_id}").status_code == 200
+    metrics_app.get("/no/such/route")
+
+    assert _sample(backend, "http_request_duration_seconds_count", method="GET", route=template, status="200") == before + 1
+    assert _sample(backend, "http_response_size_bytes_count", method="GET", route=template) >= 1
+    assert _sample(backend, "http_request_duration_seconds_count", method="GET", route="unmatched", status="404") >= 1
+    exposition = backend.generate_latest().decode()
+    assert widget_id not in exposition
+
+
+def test_in_flight_gauge_rises_and_falls_even_on_exceptions(backend, metrics_app):
+    metrics_app.get("/widgets/w1")
+    assert metrics_app.seen["in_flight"] == 1
+    assert _sample(backend, "http_requests_in_flight", method="GET", route="/widgets/{widget_id}") == 0
+
+    template = "/widgets/{widget_id}/fail"
+    failures = _sample(backend, "http_request_duration_seconds_count", method="GET", route=template, status="500")
+    assert metrics_app.get("/widgets/w1/fail").status_code == 500
+    assert _sample(backend, "http_requests_in_flight", method="GET", route=template) == 0
+    assert _sample(backend, "http_request_duration_seconds_count", method="GET", route=template, status="500") == failures + 1
+
+
+def test_mongo_commands_are_counted_per_request(backend, metrics_app):
+    template = "/widgets/{widget_id}/queries"
+    requests = _sample(backend, "mongo_commands_per_request_count", route=template)
+    commands = _sample(backend, "mongo_commands_per_request_sum", route=template)
+    by_route = _sample(backend, "mongo_route_commands_total", route=template, command="find", collection="widgets")
+
+    metrics_app.get("/widgets/w1/queries", params={"count": 3})
+    metrics_app.get("/widgets/w2/queries", params={"count": 0})
+
+    assert _sample(backend, "mongo_commands_per_request_count", route=template) == requests + 2
+    assert _sample(backend, "mongo_commands_per_request_sum", route=template) == commands + 3
+    assert _sample(backend, "mongo_route_commands_total", route=template, command="find", collection="widgets") == by_route + 3
+
+
+def test_pool_collector_reports_each_server(backend, monkeypatch):
+    stats = backend.MongoPoolStats()
+    monkeypatch.setattr(backend, "mongo_pool_stats", stats)
+    event = SimpleNamespace(address=("db-test", 27017))
+    stats.pool_created(event)
+    for _ in range(3):
+        stats.connection_created(event)
+    stats.connection_check_out_started(event)
+    stats.connection_checked_out(event)
+    stats.connection_check_out_started(event)
+    stats.connection_check_out_failed(event)
+
+    address = {"address": "db-test:27017"}
+    assert _sample(backend, "mongo_pool_open_connections", **address) == 3
+    assert _sample(backend, "mongo_pool_checked_out_connections", **address) == 1
+    assert _sample(backend, "mongo_pool_waiting_connections", **address) == 0
+    assert _sample(backend, "mongo_pool_checkouts_total", **address) == 1
+    assert _sample(backend, "mongo_pool_checkout_failures_total", **address) == 1
+
+    stats.pool_closed(event)
+    assert backend.REGISTRY.get_sample_value("mongo_pool_open_connections", address) is None
+
+
+def test_metrics_endpoint_uses_route_templates(api):
+    product_id = str(uuid.uuid4())
+    assert api.get(f"/api/products/{product_id}").status_code == 404
+
+    response = api.get("/metrics")
+    assert response.status_code == 200
+    assert 'route="/api/products/{product_id}"' in response.text
+    assert product_id not in response.text
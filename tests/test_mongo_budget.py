@@ -0,0 +1,145 @@
+"""Mongo round-trip budgets per endpoint.
+
+Each endpoint is called with a small and a large number of items or ids. The
+number of commands must be identical for both and within the budget, so any
+per-item query (an N+1) fails here instead of in production.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+BUDGETS = {
+    # order number counter, stock bulk write, stock re-read for events, insert, customer stats
+    "create_order": 5,
+    # find, stock bulk write, stock re-read, delete, customer stats aggregate and write, tombstone
+    "delete_order": 7,
+    # find, stock bulk write, stock re-read, status update, customer stats
+    "return_order": 5,
+    "export_orders_csv": 1,
+    # settings, orders
+    "bulk_labels": 2,
+    # orders; buy prices come from the catalog snapshot
+    "profit_loss": 1,
+}
+SMALL, LARGE = 1, 12
+
+
+def _lines(products, count: int) -> list:
+    """Two of one variant from each of the first ``count`` products."""
+    return [(product, index % 3, 2) for index, product in enumerate(products[:count])]
+
+
+@pytest.fixture
+def products(api, sync_db, make_product):
+    import server
+
+    docs = [
+        make_product(f"Budget Shirt {index}", "Shirts", [("S", 100, None), ("M", 100, 1100.0), ("L", 100, None)],
+                     price=2000.0)
+        for index in range(LARGE)
+    ]
+    sync_db.products.insert_many([dict(doc) for doc in docs])
+    # Written behind the API's back, so pull them into the catalog snapshot now
+    # rather than on the first measured request
+    api.portal.call(server.catalog.refresh)
+    return docs
+
+
+@pytest.fixture
+def orders(api, products, make_order):
+    """Orders created through the API so they match what the handlers expect."""
+    created = []
+    for count in (SMALL, LARGE):
+        for _ in range(LARGE):
+            response = api.post("/api/orders", json=make_order(_lines(products, count)))
+            assert response.status_code == 200
+            created.append(response.json())
+    return {
+        SMALL: [order for order in created if len(order["items"]) == SMALL],
+        LARGE: [order for order in created if len(order["items"]) == LARGE],
+    }
+
+
+def assert_flat_budget(name: str, counts: dict, recorded: dict):
+    small, large = counts[SMALL], counts[LARGE]
+    detail = f"{name}: {SMALL} -> {small} commands, {LARGE} -> {large} commands\n" + "\n".join(
+        f"  {command} {collection}" for command, collection, _ in recorded[LARGE]
+    )
+    assert small == large, f"command count grows with input size\n{detail}"
+    assert large <= BUDGETS[name], f"over budget of {BUDGETS[name]}\n{detail}"
+
+
+def measure(recorder, call) -> tuple:
+    with recorder:
+        response = call()
+    assert response.status_code == 200, response.text
+    return recorder.count, list(recorder.commands)
+
+
+def test_create_order_budget(api, recorder, products, make_order):
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        counts[size], recorded[size] = measure(
+            recorder, lambda: api.post("/api/orders", json=make_order(_lines(products, size)))
+        )
+    assert_flat_budget("create_order", counts, recorded)
+
+
+def test_delete_order_budget(api, recorder, orders):
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        order_id = orders[size][0]["id"]
+        counts[size], recorded[size] = measure(recorder, lambda: api.delete(f"/api/orders/{order_id}"))
+    assert_flat_budget("delete_order", counts, recorded)
+
+
+def test_return_order_budget(api, recorder, orders):
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        order_id = orders[size][1]["id"]
+        counts[size], recorded[size] = measure(
+            recorder, lambda: api.put(f"/api/orders/{order_id}/status", params={"status": "returned"})
+        )
+    assert_flat_budget("return_order", counts, recorded)
+
+
+def test_export_csv_budget(api, recorder, orders):
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        ids = [order["id"] for order in orders[LARGE][:size]]
+        counts[size], recorded[size] = measure(recorder, lambda: api.post("/api/orders/export-csv", json=ids))
+    assert_flat_budget("export_orders_csv", counts, recorded)
+
+
+def test_bulk_labels_budget(api, recorder, orders):
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        ids = [order["id"] for order in orders[LARGE][:size]]
+        counts[size], recorded[size] = measure(recorder, lambda: api.post("/api/orders/bulk-labels", json=ids))
+    assert_flat_budget("bulk_labels", counts, recorded)
+
+
+def test_profit_loss_budget(api, recorder, orders, sync_db):
+    # Both ranges hold orders, but the second one holds many more line items
+    today = datetime.now(timezone.utc).date()
+    counts, recorded = {}, {}
+    for size in (SMALL, LARGE):
+        start = today if size == LARGE else today + timedelta(days=1)
+        if size == SMALL:
+            sync_db.orders.update_one(
+                {"id": orders[SMALL][0]["id"]},
+                {"$set": {"created_at": f"{start.isoformat()}T12:00:00+00:00"}},
+            )
+        counts[size], recorded[size] = measure(recorder, lambda: api.get(
+            "/api/finance/profit-loss", params={"start_date": start.isoformat(), "end_date": start.isoformat()}
+        ))
+    assert_flat_budget("profit_loss", counts, recorded)
+
+
+def test_create_order_decrements_stock_once_per_item(api, products, sync_db, make_order):
+    response = api.post("/api/orders", json=make_order(_lines(products, LARGE)))
+    assert response.status_code == 200
+    for index, product in enumerate(products):
+        stored = sync_db.products.find_one({"id": product["id"]})
+        variant = next(v for v in stored["variants"] if v["id"] == product["variants"][index % 3]["id"])
+        assert variant["stock_quantity"] == 98
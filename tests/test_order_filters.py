@@ -0,0 +1,110 @@
+"""Server-side order filters, sorting, paging and per-status counts."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def orders(api, sync_db, make_order):
+    orders = {
+        "colombo_pending": make_order(
+            city="Colombo", status="pending", days_ago=1, unit_price=1500.0, order_number="ORD-000101",
+        ),
+        "colombo_courier": make_order(
+            city="Colombo", status="on_courier", days_ago=3, unit_price=4200.0, tracking_number="TRK-88001",
+        ),
+        "kandy_courier": make_order(
+            city="Kandy", status="on_courier", days_ago=5, unit_price=2600.0, tracking_number="TRK-88002",
+        ),
+        "kandy_delivered": make_order(
+            city="Kandy", status="delivered", days_ago=40, unit_price=3100.0, tracking_number="TRK-77003",
+        ),
+        "galle_returned": make_order(
+            city="Galle", status="returned", days_ago=400, unit_price=900.0, tracking_number="TRK-66004",
+            order_number="ORD-000102",
+        ),
+    }
+    sync_db.orders.insert_many([dict(order) for order in orders.values()])
+    return orders
+
+
+def _ids(page: dict) -> list:
+    return [order["id"] for order in page["items"]]
+
+
+def test_status_city_and_tracking_filters(api, orders):
+    page = api.get("/api/orders", params={"status": ["pending", "on_courier"]}).json()
+    assert page["total"] == 3
+    assert _ids(page) == [orders[key]["id"] for key in ("colombo_pending", "colombo_courier", "kandy_courier")]
+
+    # Comma-separated statuses work too
+    assert api.get("/api/orders", params={"status": "pending,on_courier"}).json()["total"] == 3
+
+    page = api.get("/api/orders", params={"city": "Kandy", "status": "on_courier"}).json()
+    assert _ids(page) == [orders["kandy_courier"]["id"]]
+
+    page = api.get("/api/orders", params={"has_tracking": "false"}).json()
+    assert _ids(page) == [orders["colombo_pending"]["id"]]
+
+
+def test_date_range_search_and_sort(api, orders):
+    today = datetime.now(timezone.utc).date()
+    page = api.get("/api/orders", params={
+        "created_from": (today - timedelta(days=10)).isoformat(), "created_to": today.isoformat(),
+    }).json()
+    assert page["total"] == 3
+
+    assert _ids(api.get("/api/orders", params={"search": "TRK-88"}).json()) == [
+        orders["colombo_courier"]["id"], orders["kandy_courier"]["id"],
+    ]
+    assert _ids(api.get("/api/orders", params={"search": "ORD-000102"}).json()) == [orders["galle_returned"]["id"]]
+    # Prefix only, and regex characters are literal
+    assert api.get("/api/orders", params={"search": "88001"}).json()["total"] == 0
+    assert api.get("/api/orders", params={"search": "TRK.*"}).json()["total"] == 0
+
+    page = api.get("/api/orders", params={"sort": "-total_amount", "limit": 2, "offset": 1}).json()
+    assert page["total"] == 5
+    assert _ids(page) == [orders["kandy_delivered"]["id"], orders["kandy_courier"]["id"]]
+
+
+def test_filters_include_archived_orders(api, orders):
+    import server
+
+    api.portal.call(lambda: server.archive_orders(older_than_days=180, announce_wait=0))
+    page = api.get("/api/orders", params={"status": ["delivered", "returned"]}).json()
+    assert _ids(page) == [orders["kandy_delivered"]["id"], orders["galle_returned"]["id"]]
+    assert page["total"] == 2
+    # Pending-only filters never touch the archive, and the archive holds no pending orders
+    assert api.get("/api/orders", params={"status": "pending"}).json()["total"] == 1
+
+    counts = api.get("/api/orders/counts").json()
+    assert counts == {
+        "total": 5, "by_status": {"pending": 1, "on_courier": 2, "delivered": 1, "returned": 1},
+    }
+    counts = api.get("/api/orders/counts", params={"city": "Galle"}).json()
+    assert counts["by_status"]["returned"] == 1 and counts["total"] == 1
+
+
+def test_counts_follow_filters(api, orders):
+    counts = api.get("/api/orders/counts", params={"city": "Kandy"}).json()
+    assert counts == {"total": 2, "by_status": {"pending": 0, "on_courier": 1, "delivered": 1, "returned": 0}}
+
+
+def test_unfiltered_list_is_unchanged(api, orders):
+    assert isinstance(api.get("/api/orders").json(), list)
+
+
+def test_paging_alone_selects_the_paged_listing(api, orders):
+    page = api.get("/api/orders", params={"offset": 1, "limit": 2}).json()
+    assert (page["total"], page["offset"], page["limit"]) == (5, 1, 2)
+    assert _ids(page) == [orders[key]["id"] for key in ("colombo_courier", "kandy_courier")]
+    assert api.get("/api/orders", params={"limit": 3}).json()["limit"] == 3
+    assert api.get("/api/orders", params={"offset": 500}).json()["items"] == []
+
+
+@pytest.mark.parametrize("params", [
+    {"status": "lost"}, {"sort": "customer_name"}, {"created_from": "yesterday"},
+    {"status": "pending", "limit": 0}, {"status": "pending", "offset": -1}, {"limit": 0}, {"offset": -1},
+])
+def test_rejects_bad_filters(api, params):
+    assert api.get("/api/orders", params=params).status_code == 400
@@ -0,0 +1,139 @@
+"""Product import: CSV and NDJSON parsing, row errors, SKU upserts and summary counts."""
+import io
+import json
+import uuid
+
+
+def _csv(rows) -> str:
+    header = "product_name,category,size,color,sku,stock_quantity,price"
+    return "\n".join([header, *(",".join(str(value) for value in row) for row in rows)]) + "\n"
+
+
+def _import(api, content: str, filename: str, **form) -> dict:
+    response = api.post(
+        "/api/products/import",
+        files={"file": (filename, io.BytesIO(content.encode()), "text/plain")},
+        data={key: str(value) for key, value in form.items()},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_csv_rows_group_into_products(api, sync_db):
+    tag = uuid.uuid4().hex[:6]
+    summary = _import(api, _csv([
+        ("Import Tee", "T-Shirts", "S", "Black", f"{tag}-S", 4, 1500),
+        ("Import Tee", "T-Shirts", "M", "Black", f"{tag}-M", 6, 1500),
+        ("Import Cap", "Hats", "M", "Red", f"{tag}-CAP", 2, 900),
+    ]), "products.csv")
+
+    assert summary["rows"] == 3
+    assert summary["products_created"] == 2
+    assert summary["variants_inserted"] == 3
+    assert summary["error_count"] == 0
+    tee = sync_db.products.find_one({"name": "Import Tee"})
+    assert sorted(v["sku"] for v in tee["variants"]) == [f"{tag}-M", f"{tag}-S"]
+
+
+def test_bad_rows_are_reported_while_good_rows_import(api, sync_db):
+    tag = uuid.uuid4().hex[:6]
+    lines = [
+        {"product_name": "Ndjson Tee", "size": "M", "color": "Blue", "sku": f"{tag}-OK", "stock_quantity": 3, "price": 1200},
+        {"product_name": "Ndjson Tee", "size": "M", "color": "Blue", "sku": f"{tag}-LIST", "stock_quantity": [3], "price": 1200},
+        {"product_name": "Ndjson Tee", "size": "M", "color": "Blue", "sku": f"{tag}-OBJ", "stock_quantity": 1, "price": {"lkr": 1}},
+        {"product_name": "Ndjson Tee", "low_stock_threshold": [1], "size": "M", "color": "Blue", "sku": f"{tag}-T", "stock_quantity": 1, "price": 1},
+        {"product_name": ["Ndjson Tee"], "size": "M", "color": "Blue", "sku": f"{tag}-N", "stock_quantity": 1, "price": 1},
+        {"product_name": "Ndjson Tee", "size": "M", "color": "Blue", "sku": f"{tag}-OK", "stock_quantity": 9, "price": 1200},
+    ]
+    content = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n[1, 2]\n"
+    summary = _import(api, content, "products.ndjson")
+
+    assert summary["rows"] == 8
+    assert summary["products_created"] == 1
+    assert summary["variants_inserted"] == 1
+    assert summary["error_count"] == 7
+    assert [error["row"] for error in summary["errors"]] == [2, 3, 4, 5, 6, 7, 8]
+    assert "Duplicate SKU" in summary["errors"][4]["error"]
+    variants = sync_db.products.find_one({"name": "Ndjson Tee"})["variants"]
+    assert [(v["sku"], v["stock_quantity"]) for v in variants] == [(f"{tag}-OK", 3)]
+
+
+def test_reimport_upserts_by_sku(api, sync_db):
+    tag = uuid.uuid4().hex[:6]
+    _import(api, _csv([("Upsert Tee", "T-Shirts", "M", "Black", f"{tag}-M", 4, 1500)]), "products.csv")
+    variant_id = sync_db.products.find_one({"name": "Upsert Tee"})["variants"][0]["id"]
+
+    summary = _import(api, _csv([
+        ("Upsert Tee", "T-Shirts", "M", "Black", f"{tag}-M", 10, 1600),
+        ("Upsert Tee", "T-Shirts", "L", "Black", f"{tag}-L", 2, 1600),
+    ]), "products.csv")
+
+    assert summary["products_created"] == 0
+    assert summary["products_updated"] == 1
+    assert summary["variants_updated"] == 1
+    assert summary["variants_inserted"] == 1
+    products = list(sync_db.products.find({"name": "Upsert Tee"}))
+    assert len(products) == 1
+    variants = {v["sku"]: v for v in products[0]["variants"]}
+    assert variants[f"{tag}-M"]["id"] == variant_id
+    assert (variants[f"{tag}-M"]["stock_quantity"], variants[f"{tag}-M"]["price"]) == (10, 1600)
+
+
+def test_failed_writes_are_reported_against_their_rows(api, sync_db):
+    tag = uuid.uuid4().hex[:6]
+    # Force the second product insert in the batch to fail
+    sync_db.products.create_index("category", unique=True, partialFilterExpression={"category": tag})
+    summary = _import(api, _csv([
+        ("First Clash", tag, "M", "Black", f"{tag}-1", 1, 100),
+        ("Second Clash", tag, "M", "Black", f"{tag}-2", 1, 100),
+        ("Second Clash", tag, "L", "Black", f"{tag}-3", 1, 100),
+    ]), "products.csv")
+
+    assert summary["products_created"] == 1
+    assert summary["variants_inserted"] == 1
+    assert summary["error_count"] == 2
+    assert sorted(error["row"] for error in summary["errors"]) == [3, 4]
+
+
+def test_import_racing_another_writer_lands_on_its_product(api, sync_db, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
+    tag = uuid.uuid4().hex[:6]
+    rival = {"id": str(uuid.uuid4()), "name": "Rival Tee", "description": "", "category": "T-Shirts",
+             "variants": [{"id": str(uuid.uuid4()), "size": "M", "color": "Black", "sku": f"{tag}-M",
+                           "stock_quantity": 1, "price": 1500.0}]}
+    bulk_write = AsyncIOMotorCollection.bulk_write
+    raced = []
+
+    async def racing_bulk_write(self, *args, **kwargs):
+        # Another writer creates the SKU between the import's lookup and its write
+        if self.name == "products" and not raced:
+            raced.append(sync_db.products.insert_one(dict(rival)))
+        return await bulk_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncIOMotorCollection, "bulk_write", racing_bulk_write)
+    summary = _import(api, _csv([("Race Tee", "T-Shirts", "M", "Black", f"{tag}-M", 4, 1500)]), "products.csv")
+
+    assert summary["error_count"] == 0
+    assert (summary["products_created"], summary["variants_updated"]) == (0, 1)
+    [stored] = sync_db.products.find({"variants.sku": f"{tag}-M"})
+    assert stored["id"] == rival["id"]
+    assert stored["variants"][0]["stock_quantity"] == 4
+
+
+def test_skus_are_unique_across_products(api, sync_db):
+    import server
+
+    tag = uuid.uuid4().hex[:6]
+    _import(api, _csv([("Unique Tee", "T-Shirts", "M", "Black", f"{tag}-M", 4, 1500)]), "products.csv")
+    clash = {"id": str(uuid.uuid4()), "name": "Clash Tee", "description": "", "category": "T-Shirts",
+             "variants": [{"id": str(uuid.uuid4()), "size": "M", "color": "Black", "sku": f"{tag}-M",
+                           "stock_quantity": 1, "price": 1500.0}]}
+    assert api.post("/api/products", json=clash).status_code == 409
+    assert clash["id"] not in server.catalog.products
+
+    # Databases created before the index was unique get it upgraded at startup
+    sync_db.products.drop_index(server.SKU_INDEX)
+    sync_db.products.create_index("variants.sku", name=server.SKU_INDEX)
+    api.portal.call(server.ensure_unique_sku_index)
+    assert sync_db.products.index_information()[server.SKU_INDEX]["unique"] is True
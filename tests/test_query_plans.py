@@ -0,0 +1,200 @@
+"""Query-plan regression tests.
+
+Every endpoint below is exercised once against a seeded database while the
+commands it sends are recorded. Each filter, sort and pipeline is then
+re-run through explain(executionStats) and must:
+
+* not COLLSCAN when it has a filter (plain "list everything" reads may),
+* not sort in memory when it asks for a sort,
+* not examine more than MAX_EXAMINED_RATIO documents per document returned.
+"""
+import asyncio
+import io
+import os
+from datetime import date, timedelta
+
+import pytest
+
+MAX_EXAMINED_RATIO = 3
+EXAMINED_SLACK = 10
+SEED_SPEC = {"products": 60, "customers": 800, "orders": 6000, "seed": 7, "days": 180}
+END_DATE = date(2025, 6, 30)
+
+
+def _seed(db_name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from datagen import ShopSpec, generate_shop
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        try:
+            await generate_shop(client[db_name], ShopSpec(end_date=END_DATE, **SEED_SPEC), drop=True)
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+def _scenarios(sync_db):
+    order = sync_db.orders.find_one({"status": "delivered"}, {"_id": 0})
+    pending = sync_db.orders.find_one({"status": "pending"}, {"_id": 0}) or order
+    product = sync_db.products.find_one({}, {"_id": 0})
+    customer = sync_db.customers.find_one({}, {"_id": 0})
+    order_ids = [doc["id"] for doc in sync_db.orders.find({}, {"id": 1}).limit(25)]
+    since = f"{(END_DATE - timedelta(days=3)).isoformat()}T00:00:00+00:00"
+    variant = product["variants"][0]
+    new_order = {
+        "customer_id": customer["id"], "customer_name": customer["name"],
+        "customer_address": customer["address"], "customer_phone": customer["phone"],
+        "customer_city": customer["city"], "subtotal": variant["price"], "tax_amount": 0.0,
+        "total_amount": variant["price"] + 350.0,
+        "items": [{
+            "product_id": product["id"], "variant_id": variant["id"], "product_name": product["name"],
+            "size": variant["size"], "color": variant["color"], "quantity": 1,
+            "unit_price": variant["price"], "total_price": variant["price"],
+        }],
+    }
+    product_csv = (
+        "product_name,description,category,size,color,sku,stock_quantity,price\n"
+        f"{product['name']},,{product['category']},{variant['size']},{variant['color']},"
+        f"{variant['sku']},7,{variant['price']}\n"
+        "Plan Test Tee,,T-Shirts,M,Black,PLAN-TEE-M,5,1500\n"
+    )
+    customer_csv = (
+        "name,email,phone,address,city,postal_code\n"
+        f"{customer['name']},{customer['email']},{customer['phone']},{customer['address']},"
+        f"{customer['city']},{customer['postal_code']}\n"
+        "Plan Test,plan@example.lk,0719998887,\"No. 1, Lake Road, Kandy, 20000\",Kandy,20000\n"
+    )
+    day = order["created_at"][:10]
+    return {
+        "products_list": ("GET", "/api/products", {}),
+        "products_delta": ("GET", "/api/products", {"params": {"updated_since": since}}),
+        "product_get": ("GET", f"/api/products/{product['id']}", {}),
+        "low_stock": ("GET", "/api/products/low-stock", {}),
+        "customers_list": ("GET", "/api/customers", {}),
+        "customers_delta": ("GET", "/api/customers", {"params": {"updated_since": since}}),
+        "customer_get": ("GET", f"/api/customers/{customer['id']}", {}),
+        "customer_orders": ("GET", f"/api/customers/{order['customer_id']}/orders", {"params": {"limit": 10}}),
+        "orders_list": ("GET", "/api/orders", {}),
+        "orders_delta": ("GET", "/api/orders", {"params": {"updated_since": since}}),
+        "orders_filtered": ("GET", "/api/orders", {"params": {"status": ["pending", "on_courier"], "limit": 20}}),
+        "orders_by_city": ("GET", "/api/orders", {"params": {"city": order["customer_city"], "status": "delivered"}}),
+        "orders_by_date": ("GET", "/api/orders", {"params": {"created_from": day, "created_to": day}}),
+        "order_counts": ("GET", "/api/orders/counts", {
+            "params": {"created_from": (END_DATE - timedelta(days=30)).isoformat()},
+        }),
+        "order_get": ("GET", f"/api/orders/{order['id']}", {}),
+        "create_order": ("POST", "/api/orders", {"json": new_order}),
+        "order_status": ("PUT", f"/api/orders/{pending['id']}/status", {"params": {"status": "returned"}}),
+        "delete_order": ("DELETE", f"/api/orders/{order_ids[-1]}", {}),
+        "export_csv": ("POST", "/api/orders/export-csv", {"json": order_ids[:20]}),
+        "bulk_labels": ("POST", "/api/orders/bulk-labels", {"json": order_ids[:20]}),
+        "shipping_label": ("GET", f"/api/orders/{order['id']}/shipping-label", {}),
+        "daily_sales": ("GET", "/api/finance/daily-sales", {"params": {"date": day}}),
+        "profit_loss": ("GET", "/api/finance/profit-loss", {
+            "params": {"start_date": (END_DATE - timedelta(days=30)).isoformat(), "end_date": END_DATE.isoformat()},
+        }),
+        "dashboard": ("GET", "/api/dashboard", {}),
+        "settings": ("GET", "/api/settings", {}),
+        "import_products": ("POST", "/api/products/import", {
+            "files": {"file": ("catalog.csv", io.BytesIO(product_csv.encode()), "text/csv")},
+        }),
+        "import_customers": ("POST", "/api/customers/import", {
+            "files": {"file": ("customers.csv", io.BytesIO(customer_csv.encode()), "text/csv")},
+        }),
+    }
+
+
+SCENARIOS = [
+    "products_list", "products_delta", "product_get", "low_stock", "customers_list", "customers_delta",
+    "customer_get", "customer_orders", "orders_list", "orders_delta", "orders_filtered",
+    "orders_by_city", "orders_by_date", "order_counts", "order_get", "create_order", "order_status",
+    "delete_order", "export_csv", "bulk_labels", "shipping_label", "daily_sales", "profit_loss",
+    "dashboard", "settings", "import_products", "import_customers",
+]
+
+
+def _explain_targets(command_name: str, command: dict):
+    """Split a recorded command into explainable commands, one per write statement."""
+    import server
+
+    base = {key: value for key, value in command.items() if key not in server.DRIVER_FIELDS}
+    if command_name in ("update", "delete"):
+        statements_key = "updates" if command_name == "update" else "deletes"
+        for statement in base.pop(statements_key, []):
+            yield {**base, statements_key: [statement]}, statement.get("q", {}), None
+    elif command_name == "aggregate":
+        pipeline = base.get("pipeline", [])
+        match = pipeline[0].get("$match", {}) if pipeline else {}
+        sort = next((stage["$sort"] for stage in pipeline if "$sort" in stage), None)
+        yield base, match, sort
+    elif command_name == "findAndModify":
+        yield base, base.get("query", {}), base.get("sort")
+    elif command_name in ("find", "count", "distinct"):
+        yield base, base.get("filter", base.get("query", {})), base.get("sort")
+
+
+def plan_violations(summary: dict, query: dict, sort) -> list:
+    problems = []
+    if query and "COLLSCAN" in summary["stages"]:
+        problems.append("COLLSCAN")
+    if sort and "SORT" in summary["stages"]:
+        problems.append("in-memory SORT")
+    returned = summary["returned"] or 0
+    if query and summary["docs_examined"] > MAX_EXAMINED_RATIO * returned + EXAMINED_SLACK:
+        problems.append(f"examined {summary['docs_examined']} docs for {returned} returned")
+    return problems
+
+
+@pytest.fixture(scope="module")
+def plans(mongo, make_api, make_recorder):
+    """Run every scenario once and explain each query it issued."""
+    import server
+
+    client = mongo.MongoClient(os.environ["MONGO_URL"])
+    db_name = f"{os.environ['DB_NAME']}_plans"
+    sync_db = client[db_name]
+    _seed(db_name)
+    recorder = make_recorder()
+    results = {}
+    try:
+        with make_api(db_name, recorder) as http:
+            for name, (method, path, kwargs) in _scenarios(sync_db).items():
+                with recorder:
+                    response = http.request(method, path, **kwargs)
+                assert response.status_code == 200, f"{name}: {response.text}"
+                explained = []
+                for command_name, collection, command in recorder.commands:
+                    if command_name not in server.EXPLAINABLE_COMMANDS:
+                        continue
+                    for target, query, sort in _explain_targets(command_name, command):
+                        explain = sync_db.command({"explain": target, "verbosity": "executionStats"})
+                        summary = server.summarize_explain(explain)
+                        explained.append({
+                            "command": command_name,
+                            "collection": collection,
+                            "shape": server.command_shape(command_name, target),
+                            "summary": summary,
+                            "violations": plan_violations(summary, query, sort),
+                        })
+                results[name] = explained
+        yield results
+    finally:
+        client.drop_database(db_name)
+        client.close()
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_queries_use_indexes(plans, scenario):
+    failing = [plan for plan in plans[scenario] if plan["violations"]]
+    assert not failing, "\n".join(
+        f"{plan['command']} {plan['collection']} {plan['shape']}: {', '.join(plan['violations'])} "
+        f"(stages {plan['summary']['stages']})"
+        for plan in failing
+    )
+
+
+def test_every_scenario_was_captured(plans):
+    assert set(plans) == set(SCENARIOS)
@@ -0,0 +1,79 @@
+"""Report routes read with the report read preference; everything else stays on the primary.
+
+The replica-set checks need mongod running as a replica set, which a single
+local node is enough for::
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval 'rs.initiate()'
+    TEST_MONGO_URL='mongodb://localhost:27017/?replicaSet=rs0' pytest tests/test_read_routing.py
+"""
+import os
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def replica_api(mongo, make_api, sync_db, recorder, monkeypatch):
+    import server
+
+    hello = mongo.MongoClient(os.environ["MONGO_URL"]).admin.command("hello")
+    if not hello.get("setName"):
+        pytest.skip("mongod is not running as a replica set")
+    # A single-node set has no secondary, so secondaryPreferred still answers from the primary
+    monkeypatch.setattr(server, "REPORT_READ_PREFERENCE", "secondaryPreferred")
+    monkeypatch.setattr(server, "REPORT_MAX_STALENESS_SECONDS", 120)
+    with make_api(sync_db.name, recorder) as http:
+        yield http
+
+
+def _read_preferences(recorder, collection: str) -> list:
+    return [
+        command.get("$readPreference") for name, target, command in recorder.commands
+        if target == collection and name in ("find", "aggregate", "count")
+    ]
+
+
+def test_reports_read_from_secondaries_with_a_staleness_bound(replica_api, recorder):
+    today = date.today().isoformat()
+    with recorder:
+        assert replica_api.get("/api/finance/profit-loss", params={"start_date": today, "end_date": today}).status_code == 200
+    preferences = _read_preferences(recorder, "orders")
+    assert preferences
+    assert all(pref == {"mode": "secondaryPreferred", "maxStalenessSeconds": 120} for pref in preferences)
+
+    with recorder:
+        assert replica_api.get("/api/dashboard").status_code == 200
+    assert all(pref and pref["mode"] == "secondaryPreferred" for pref in _read_preferences(recorder, "orders"))
+
+
+def test_interactive_reads_stay_on_the_primary(replica_api, recorder):
+    with recorder:
+        assert replica_api.get("/api/orders", params={"status": "pending"}).status_code == 200
+    preferences = _read_preferences(recorder, "orders")
+    assert preferences and not any(preferences)
+
+
+def test_read_db_follows_the_route_class(api):
+    import server
+
+    assert server.read_db() is server.db
+    for route, expected in (("/api/finance/profit-loss", server.reports_db), ("/api/orders", server.db)):
+        token = server.current_request.set(server.RequestContext(route))
+        try:
+            assert server.read_db() is expected
+        finally:
+            server.current_request.reset(token)
+
+
+def test_rejects_invalid_policies(api, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "REPORT_READ_PREFERENCE", "fastest")
+    with pytest.raises(ValueError):
+        server.report_read_preference()
+    monkeypatch.setattr(server, "REPORT_READ_PREFERENCE", "secondary")
+    monkeypatch.setattr(server, "REPORT_MAX_STALENESS_SECONDS", 30)
+    with pytest.raises(ValueError):
+        server.report_read_preference()
+    monkeypatch.setattr(server, "REPORT_MAX_STALENESS_SECONDS", 0)
+    assert server.report_read_preference().max_staleness == -1
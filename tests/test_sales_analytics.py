@@ -0,0 +1,81 @@
+"""Sales breakdowns by product, variant, size, colour, category and city."""
+from datetime import datetime, timezone
+
+import pytest
+
+
+@pytest.fixture
+def sales(api, make_product, make_order):
+    tee, dress = (
+        make_product(name, category, [("S", 100, buy_price), ("M", 100, buy_price)], price=1000.0, color="Green",
+                     low_stock_threshold=1)
+        for name, category, buy_price in (("Analytics Tee", "T-Shirts", 400.0), ("Analytics Dress", "Dresses", None))
+    )
+    for product in (tee, dress):
+        assert api.post("/api/products", json=product).status_code == 200
+    orders = [
+        make_order([(tee, 0, 3), (dress, 1, 1)], city="Colombo"),
+        make_order([(tee, 1, 2)], city="Kandy"),
+        make_order([(dress, 0, 5)], city="Kandy"),
+    ]
+    created = [api.post("/api/orders", json=order).json() for order in orders]
+    returned = api.post("/api/orders", json=make_order([(tee, 0, 10)], city="Galle")).json()
+    assert api.put(f"/api/orders/{returned['id']}/status", params={"status": "returned"}).status_code == 200
+    return tee, dress, created
+
+
+def _get(api, **params):
+    today = datetime.now(timezone.utc).date().isoformat()
+    response = api.get("/api/analytics/sales", params={"start_date": today, "end_date": today, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_groups_by_product_with_margin(api, sales):
+    tee, dress, _ = sales
+    body = _get(api, group_by="product")
+    groups = {group["product_id"]: group for group in body["groups"]}
+    assert groups[tee["id"]]["units"] == 5
+    assert groups[tee["id"]]["revenue"] == 5000.0
+    assert groups[tee["id"]]["margin"] == 5000.0 - 5 * 400.0
+    # No buy price: estimated at the same ratio profit-loss uses
+    assert groups[dress["id"]]["margin"] == pytest.approx(6000.0 * 0.4)
+    assert body["totals"]["revenue"] == 11000.0
+    assert body["totals"]["units"] == 11
+    assert [group["product_id"] for group in body["groups"]] == [dress["id"], tee["id"]]
+
+
+def test_combines_category_and_city(api, sales):
+    body = _get(api, group_by="category,city", sort_by="units")
+    rows = {(group["category"], group["city"]): group["units"] for group in body["groups"]}
+    assert rows == {
+        ("T-Shirts", "Colombo"): 3, ("T-Shirts", "Kandy"): 2,
+        ("Dresses", "Colombo"): 1, ("Dresses", "Kandy"): 5,
+    }
+    assert body["groups"][0]["units"] == 5
+
+
+def test_size_and_top_n(api, sales):
+    body = _get(api, group_by="size", top=1)
+    assert len(body["groups"]) == 1
+    assert body["groups"][0]["size"] == "S"
+    assert body["groups"][0]["units"] == 8
+
+
+def test_totals_only_without_dimensions(api, sales):
+    body = _get(api, group_by="")
+    assert body["groups"] == []
+    assert body["totals"]["lines"] == 4
+
+
+def test_single_aggregation(api, recorder, sales):
+    with recorder:
+        _get(api, group_by="variant,city")
+    assert [command for command, _, _ in recorder.commands if command != "getMore"] == ["aggregate"]
+
+
+@pytest.mark.parametrize("params", [{"group_by": "weekday"}, {"sort_by": "profit"}, {"top": 0}])
+def test_rejects_bad_parameters(api, params):
+    today = datetime.now(timezone.utc).date().isoformat()
+    response = api.get("/api/analytics/sales", params={"start_date": today, "end_date": today, **params})
+    assert response.status_code == 400
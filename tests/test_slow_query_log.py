@@ -0,0 +1,98 @@
+"""Slow query log: redaction and record shape, driven by fake command events (no mongod)."""
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+
+def _started(command_name: str, command: dict, request_id: int = 1):
+    return SimpleNamespace(command_name=command_name, command=command, database_name="pos",
+                           connection_id=("localhost", 27017), request_id=request_id)
+
+
+def _succeeded(command_name: str, reply: dict, duration_ms: float, request_id: int = 1):
+    return SimpleNamespace(command_name=command_name, reply=reply, duration_micros=int(duration_ms * 1000),
+                           connection_id=("localhost", 27017), request_id=request_id)
+
+
+@pytest.fixture
+def listener(backend, monkeypatch):
+    monkeypatch.setattr(backend, "SLOW_QUERY_MS", 50)
+    monkeypatch.setattr(backend, "SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0)
+    return backend.SlowQueryLogger()
+
+
+def test_redacts_literals_but_keeps_operators(backend):
+    shape = backend.command_shape("find", {
+        "find": "orders",
+        "filter": {"status": "pending", "total_amount": {"$gte": 5000}, "$or": [{"city": "Kandy"}, {"city": "Galle"}]},
+        "sort": {"created_at": -1},
+        "lsid": {"id": "session"},
+    })
+    assert shape == {
+        "filter": {"status": "?", "total_amount": {"$gte": "?"}, "$or": [{"city": "?"}]},
+        "sort": {"created_at": "?"},
+    }
+    updates = backend.command_shape("update", {"update": "products", "updates": [
+        {"q": {"id": "p1"}, "u": {"$inc": {"variants.$.stock_quantity": -2}}},
+        {"q": {"id": "p2"}, "u": {"$inc": {"variants.$.stock_quantity": -1}}},
+    ]})
+    assert updates == {"q": [{"id": "?"}]}
+
+
+def test_logs_slow_commands_with_route_and_returned_count(backend, listener, caplog):
+    token = backend.current_request.set(backend.RequestContext("/api/orders"))
+    try:
+        listener.started(_started("find", {"find": "orders", "filter": {"status": "pending"}}))
+    finally:
+        backend.current_request.reset(token)
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        listener.succeeded(_succeeded("find", {"cursor": {"firstBatch": [{}, {}, {}]}, "ok": 1}, 120))
+
+    [record] = caplog.records
+    message = record.getMessage()
+    assert "find on orders from /api/orders took 120.0 ms" in message
+    assert "returned=3, examined=not sampled" in message
+    assert '"status": "?"' in message and "pending" not in message
+
+
+def test_skips_fast_and_unexplainable_commands(listener, caplog):
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        listener.started(_started("find", {"find": "orders", "filter": {}}, request_id=1))
+        listener.succeeded(_succeeded("find", {"cursor": {"firstBatch": []}}, 10, request_id=1))
+        listener.started(_started("insert", {"insert": "orders", "documents": [{}]}, request_id=2))
+        listener.succeeded(_succeeded("insert", {"n": 1}, 500, request_id=2))
+    assert caplog.records == []
+    assert listener._inflight == {}
+
+
+def test_failed_commands_are_logged_without_a_count(listener, caplog):
+    listener.started(_started("count", {"count": "customers", "query": {"city": "Kandy"}}))
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        listener.failed(SimpleNamespace(command_name="count", duration_micros=90_000,
+                                        connection_id=("localhost", 27017), request_id=1))
+    assert "from - took 90.0 ms (returned=None" in caplog.records[0].getMessage()
+
+
+def test_sampled_explains_drop_driver_fields(backend, listener, monkeypatch, caplog):
+    monkeypatch.setattr(backend, "SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 1)
+    submitted = []
+    listener._explain_executor = SimpleNamespace(submit=lambda fn, *args: submitted.append(args))
+    listener.started(_started("find", {"find": "orders", "filter": {"id": "o1"}, "lsid": {}, "$db": "pos"}))
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        listener.succeeded(_succeeded("find", {"cursor": {"firstBatch": []}}, 75))
+
+    assert "examined=see explain" in caplog.records[0].getMessage()
+    [(database, command, record)] = submitted
+    assert database == "pos"
+    assert command == {"find": "orders", "filter": {"id": "o1"}}
+    assert record["shape"] == {"filter": {"id": "?"}}
+
+
+def test_summarize_explain_totals_nested_stages(backend):
+    explain = {
+        "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+        "executionStats": {"totalDocsExamined": 40, "totalKeysExamined": 41, "nReturned": 4},
+    }
+    summary = backend.summarize_explain({"stages": [{"$cursor": explain}, {"$group": {}}]})
+    assert summary == {"docs_examined": 40, "keys_examined": 41, "returned": 4, "stages": ["FETCH", "IXSCAN"]}